@@ -0,0 +1,219 @@
+"""
+向量化回测引擎 (规则 → 持仓 → 绩效，参数网格一次评估)
+
+只依赖 NumPy/pandas，不导入 Streamlit：stock.app.py 的参数扫描以 spawn 方式
+启动进程池，子进程只需导入本模块即可执行 backtest_chunk，不会重新执行页面脚本。
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# 默认单边佣金与滑点 (按成交金额比例)
+BACKTEST_FEE = 0.0003
+BACKTEST_SLIPPAGE = 0.0005
+TRADING_DAYS_PER_YEAR = 250
+
+def window_sum(x, window):
+    """按列计算滚动窗口和 (累计和相减)，不足一个窗口的位置为 NaN"""
+    csum = np.cumsum(x, axis=0)
+    out = np.full_like(csum, np.nan)
+    if len(x) >= window:
+        out[window - 1:] = csum[window - 1:]
+        out[window:] -= csum[:-window]
+    return out
+
+class SignalFeatures:
+    """回测所需指标的按参数记忆化计算，口径与 calculate_* 系列一致
+
+    滚动窗口统一用累计和相减 (window_sum) 计算，避免逐个参数构造 pandas 对象；
+    EMA 的递推交给 pandas 的编译实现。
+    """
+
+    def __init__(self, close):
+        self.close = np.asarray(close, dtype=float)
+        # 以首个价格为基准平移，降低平方和相减时的精度损失
+        self._base = self.close[0] if len(self.close) else 0.0
+        self._shifted = (self.close - self._base)[:, None]
+        self._memo = {}
+
+    @classmethod
+    def from_frame(cls, df):
+        """复用 add_technical_indicators 已算好的默认参数指标列"""
+        features = cls(df['收盘'].to_numpy(dtype=float))
+        for period in (5, 10, 20, 60):
+            if f'MA{period}' in df:
+                features._memo[("ma", period)] = df[f'MA{period}'].to_numpy(dtype=float)
+        if 'MACD' in df and 'Signal' in df:
+            features._memo[("macd", 12, 26, 9)] = (df['MACD'].to_numpy(dtype=float),
+                                                   df['Signal'].to_numpy(dtype=float))
+        if 'RSI' in df:
+            features._memo[("rsi", 14)] = df['RSI'].to_numpy(dtype=float)
+        if 'BB_Middle' in df:
+            features._memo[("bb", 20, 2)] = tuple(df[c].to_numpy(dtype=float)
+                                                  for c in ('BB_Middle', 'BB_Upper', 'BB_Lower'))
+        return features
+
+    def _cached(self, key, compute):
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def ma(self, period):
+        return self._cached(("ma", period),
+                            lambda: window_sum(self._shifted, period)[:, 0] / period + self._base)
+
+    def ema(self, span):
+        return self._cached(("ema", span), lambda: _ewm(self.close, span))
+
+    def macd(self, fast=12, slow=26, signal=9):
+        def compute():
+            macd = self.ema(fast) - self.ema(slow)
+            return macd, _ewm(macd, signal)
+        return self._cached(("macd", fast, slow, signal), compute)
+
+    def rsi(self, period=14):
+        def compute():
+            delta = np.zeros_like(self._shifted)
+            delta[1:] = np.diff(self._shifted, axis=0)
+            gain = window_sum(np.maximum(delta, 0.0), period)
+            loss = window_sum(np.maximum(-delta, 0.0), period)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return (100 - 100 / (1 + gain / loss))[:, 0]
+        return self._cached(("rsi", period), compute)
+
+    def bollinger(self, period=20, std_dev=2):
+        def compute():
+            s1 = window_sum(self._shifted, period)[:, 0]
+            s2 = window_sum(self._shifted ** 2, period)[:, 0]
+            std = np.sqrt(np.maximum((s2 - s1 * s1 / period) / (period - 1), 0.0))
+            mid = self.ma(period)
+            return mid, mid + std * std_dev, mid - std * std_dev
+        return self._cached(("bb", period, std_dev), compute)
+
+def _ewm(values, span):
+    return pd.Series(values).ewm(span=span, adjust=False).mean().to_numpy()
+
+def hold_between(entry, exit_):
+    """入场信号后持有、离场信号后空仓：用前向填充代替逐K线的状态机"""
+    state = np.where(entry, 1.0, np.where(exit_, 0.0, np.nan))
+    last = np.where(np.isnan(state), 0, np.arange(len(state)))
+    np.maximum.accumulate(last, out=last)
+    return np.nan_to_num(state[last], nan=0.0)
+
+def rule_ma_cross(f, fast=5, slow=20):
+    """短均线在长均线之上时持有 (金叉买入、死叉卖出)"""
+    return (f.ma(fast) > f.ma(slow)).astype(float)
+
+def rule_macd(f, fast=12, slow=26, signal=9):
+    """MACD 在信号线之上时持有"""
+    macd, sig = f.macd(fast, slow, signal)
+    return (macd > sig).astype(float)
+
+def rule_rsi(f, period=14, lower=30, upper=70):
+    """RSI 跌破 lower (超卖) 买入，升破 upper (超买) 卖出"""
+    rsi = f.rsi(period)
+    return hold_between(rsi < lower, rsi > upper)
+
+def rule_bollinger(f, period=20, std_dev=2):
+    """收盘跌破下轨买入，回到中轨之上卖出"""
+    mid, _, lower = f.bollinger(period, std_dev)
+    return hold_between(f.close < lower, f.close > mid)
+
+# 策略名 -> (规则函数, 默认参数, 参数网格)
+BACKTEST_RULES = {
+    "均线交叉": (rule_ma_cross, {"fast": 5, "slow": 20},
+                 {"fast": [5, 10, 20], "slow": [20, 30, 60, 120]}),
+    "MACD 金叉": (rule_macd, {"fast": 12, "slow": 26, "signal": 9},
+                  {"fast": [8, 12], "slow": [21, 26, 34], "signal": [5, 9]}),
+    "RSI 超卖反弹": (rule_rsi, {"period": 14, "lower": 30, "upper": 70},
+                     {"period": [6, 14], "lower": [20, 30], "upper": [70, 80]}),
+    "布林带回归": (rule_bollinger, {"period": 20, "std_dev": 2},
+                   {"period": [10, 20, 30], "std_dev": [1.5, 2, 2.5]}),
+}
+
+def parameter_grid(grid):
+    """展开参数网格，剔除短周期不小于长周期的无效组合"""
+    names = list(grid)
+    combos = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    return [p for p in combos if p.get("fast", 0) < p.get("slow", np.inf)]
+
+def evaluate_positions(close, positions, fee=BACKTEST_FEE, slippage=BACKTEST_SLIPPAGE,
+                       periods_per_year=TRADING_DAYS_PER_YEAR):
+    """按列评估多组目标持仓 (日期×组合，取值 0/1)
+
+    信号在当日收盘产生、次日持有，避免未来函数。每次持仓变动按
+    fee + slippage 扣除成本。periods_per_year 为每年K线根数，用于年化。
+    返回 (绩效字典, 净值二维数组)，绩效字典的每个值都是长度为组合数的一维数组。
+    """
+    close = np.asarray(close, dtype=float)
+    positions = np.asarray(positions, dtype=float).reshape(len(close), -1)
+    n_bars, n_combos = positions.shape
+    pos = np.zeros_like(positions)
+    pos[1:] = positions[:-1]
+    ret = np.zeros(n_bars)
+    ret[1:] = close[1:] / close[:-1] - 1
+
+    change = np.diff(pos, axis=0, prepend=0.0)
+    trades = np.abs(change)
+    strat = pos * ret[:, None] - trades * (fee + slippage)
+    equity = np.cumprod(1 + strat, axis=0)
+    drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+
+    # 逐笔收益：给每段持仓 (含离场当日的成本) 编号，按编号汇总对数收益
+    entries = change > 0
+    n_trades = entries.sum(axis=0)
+    in_trade = (pos > 0) | (change < 0)
+    trade_id = np.cumsum(entries, axis=0) * in_trade
+    offsets = np.concatenate([[0], np.cumsum(n_trades + 1)[:-1]])
+    trade_pnl = np.bincount((trade_id + offsets).ravel(), weights=np.log1p(strat).ravel(),
+                            minlength=int((n_trades + 1).sum()))
+    is_trade = np.ones(len(trade_pnl), dtype=bool)
+    is_trade[offsets] = False
+    wins = np.add.reduceat((trade_pnl > 0) & is_trade, offsets)
+
+    years = max(n_bars - 1, 1) / periods_per_year
+    std = strat.std(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        metrics = {
+            '总收益': equity[-1] - 1,
+            '年化收益': equity[-1] ** (1 / years) - 1,
+            '最大回撤': drawdown.min(axis=0),
+            '夏普比率': np.where(std > 0, strat.mean(axis=0) / std * np.sqrt(periods_per_year), np.nan),
+            '交易次数': n_trades,
+            '胜率': np.where(n_trades > 0, wins / n_trades, np.nan),
+            '年换手(倍)': trades.sum(axis=0) / years,
+            '持仓占比': pos.mean(axis=0),
+        }
+    return metrics, equity
+
+def backtest_grid(features, rules=None, fee=BACKTEST_FEE, slippage=BACKTEST_SLIPPAGE,
+                  periods_per_year=TRADING_DAYS_PER_YEAR):
+    """对一只股票评估多个策略的全部参数组合，返回按组合一行的绩效表
+
+    rules 为 {策略名: 参数字典列表}，默认使用 BACKTEST_RULES 的完整网格。
+    各组合的持仓拼成二维数组后一次性评估。
+    """
+    if rules is None:
+        rules = {name: parameter_grid(grid) for name, (_, _, grid) in BACKTEST_RULES.items()}
+    labels, params, columns = [], [], []
+    for name, combos in rules.items():
+        rule = BACKTEST_RULES[name][0]
+        for p in combos:
+            labels.append(name)
+            params.append(", ".join(f"{k}={v}" for k, v in p.items()))
+            columns.append(rule(features, **p))
+    if not columns:
+        return pd.DataFrame()
+    metrics, _ = evaluate_positions(features.close, np.column_stack(columns), fee, slippage,
+                                    periods_per_year)
+    return pd.DataFrame({'策略': labels, '参数': params, **metrics})
+
+def backtest_chunk(closes, symbols, rules=None, fee=BACKTEST_FEE, slippage=BACKTEST_SLIPPAGE):
+    """对一组股票逐只执行 backtest_grid，结果按股票拼接 (进程池中每个任务处理一块)"""
+    frames = []
+    for sym in symbols:
+        result = backtest_grid(SignalFeatures(closes[sym]), rules, fee, slippage)
+        result.insert(0, '代码', sym)
+        frames.append(result)
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
@@ -0,0 +1,275 @@
+"""
+性能基准脚本
+
+用法:
+    python benchmark.py panel --symbols 500 --years 5
+    python benchmark.py render --rows 5000
+    python benchmark.py pipeline --latency 0.05
+    python benchmark.py backtest --symbols 200 --years 5
+    python benchmark.py intraday --symbols 50
+
+直接导入 stock.app.py 中的函数，使用合成行情数据 (ReplaySource)，不访问任何上游接口。
+"""
+import argparse
+import concurrent.futures
+import datetime
+import functools
+import importlib.util
+import multiprocessing
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stock.app.py")
+TRADING_DAYS_PER_YEAR = 250
+
+
+def load_app():
+    """以普通模块方式导入 stock.app.py (文件名含点号，无法直接 import)"""
+    spec = importlib.util.spec_from_file_location("stock_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_closes(n_days, n_symbols, seed=42):
+    """生成 日期×代码 的随机游走收盘价"""
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0.0003, 0.02, size=(n_days, n_symbols))
+    return 20 * np.exp(np.cumsum(returns, axis=0))
+
+
+def timeit(func, repeat):
+    """返回多次运行中的最短耗时 (秒) 与最后一次结果"""
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_panel(app, args):
+    """逐只 DataFrame 计算 vs 面板一次性计算"""
+    n_days = args.years * TRADING_DAYS_PER_YEAR
+    closes = synthetic_closes(n_days, args.symbols)
+    dates = pd.bdate_range("2015-01-05", periods=n_days)
+
+    def per_frame():
+        return [app.add_technical_indicators(pd.DataFrame({'日期': dates, '收盘': closes[:, j]}))
+                for j in range(args.symbols)]
+
+    def panel():
+        return app.compute_panel_indicators(closes)
+
+    t_frame, frames = timeit(per_frame, args.repeat)
+    t_panel, result = timeit(panel, args.repeat)
+
+    max_err = 0.0
+    for col in app.INDICATOR_COLUMNS:
+        ref = np.column_stack([f[col].to_numpy() for f in frames])
+        max_err = max(max_err, float(np.nanmax(np.abs(ref - result[col]))))
+
+    print(f"面板指标计算: {args.symbols} 只 × {n_days} 个交易日")
+    print(f"  逐只 add_technical_indicators : {t_frame * 1000:10.1f} ms")
+    print(f"  compute_panel_indicators     : {t_panel * 1000:10.1f} ms")
+    print(f"  加速比                       : {t_frame / t_panel:10.1f} x")
+    print(f"  最大绝对误差                 : {max_err:10.2e}")
+
+
+def synthetic_history(app, n_rows, seed=7):
+    """生成带全部指标列的单只股票历史行情 (与 get_hist_data 的列一致)"""
+    rng = np.random.default_rng(seed)
+    close = synthetic_closes(n_rows, 1, seed)[:, 0]
+    df = pd.DataFrame({
+        '日期': pd.bdate_range("2005-01-04", periods=n_rows),
+        '开盘': close * (1 + rng.normal(0, 0.005, n_rows)),
+        '收盘': close,
+        '最高': close * 1.02,
+        '最低': close * 0.98,
+        '成交量': rng.integers(10_000, 50_000_000, n_rows),
+        '成交额': rng.uniform(1e6, 5e10, n_rows),
+        '振幅': rng.uniform(0, 10, n_rows),
+        '涨跌幅': rng.normal(0, 2, n_rows),
+        '涨跌额': rng.normal(0, 1, n_rows),
+        '换手率': rng.uniform(0.1, 5, n_rows),
+    })
+    return app.add_technical_indicators(df)
+
+
+def legacy_render(app, df, info):
+    """原先逐行/逐单元格的渲染路径"""
+    hist_colors = ['#26a69a' if val >= 0 else '#ef5350' for val in df['Histogram']]
+    vol_colors = ['#ef5350' if c >= o else '#26a69a' for c, o in zip(df['收盘'], df['开盘'])]
+    styler = df.style.format({
+        '开盘': '¥{:.2f}', '收盘': '¥{:.2f}', '最高': '¥{:.2f}', '最低': '¥{:.2f}',
+        '涨跌幅': '{:.2f}%', '换手率': '{:.2f}%',
+        '成交量': lambda x: app.format_value(x, 'volume'),
+        '成交额': lambda x: app.format_value(x, 'amount'),
+    })
+    # st.dataframe 处理 Styler 时同样会计算并展开全部单元格的显示值
+    styler._compute()
+    styler._translate(False, False)
+
+    def smart_format(row):
+        if any(x in row['项目'] for x in app.PROFILE_AMOUNT_ITEMS):
+            return app.format_value(row['数值'], 'amount')
+        if any(x in row['项目'] for x in app.PROFILE_VOLUME_ITEMS):
+            return app.format_value(row['数值'], 'volume')
+        return row['数值']
+    profile = info.apply(smart_format, axis=1)
+    return hist_colors, vol_colors, styler, profile
+
+
+def vectorized_render(app, df, info):
+    """向量化后的渲染路径"""
+    hist_colors = app.sign_colors(df['Histogram'])
+    vol_colors = app.candle_colors(df['收盘'], df['开盘'])
+    table = app.format_history_table(df)
+    profile = app.format_profile_values(info['项目'], info['数值'])
+    return hist_colors, vol_colors, table, profile
+
+
+def bench_render(app, args):
+    """图表配色、历史明细表、企业档案格式化：逐行循环 vs 向量化"""
+    df = synthetic_history(app, args.rows)
+    items = ['总市值', '流通市值', '总股本', '流通股本', '行业', '上市时间']
+    info = pd.DataFrame({
+        '项目': [items[i % len(items)] for i in range(args.rows)],
+        '数值': np.random.default_rng(1).uniform(1e3, 1e13, args.rows),
+    })
+    t_old, _ = timeit(lambda: legacy_render(app, df, info), args.repeat)
+    t_new, _ = timeit(lambda: vectorized_render(app, df, info), args.repeat)
+    print(f"渲染路径格式化: {args.rows} 行")
+    print(f"  逐行/Styler  : {t_old * 1000:10.1f} ms")
+    print(f"  向量化       : {t_new * 1000:10.1f} ms")
+    print(f"  加速比       : {t_old / t_new:10.1f} x")
+
+
+def bench_backtest(app, args):
+    """多只股票 × 全部策略参数网格的回测扫描：单进程 vs spawn 进程池
+
+    与页面相同调用 run_backtest_sweep 按股票分块并行，子进程只导入 backtest 模块；
+    池的启动与预热不计入耗时。
+    """
+    n_days = args.years * TRADING_DAYS_PER_YEAR
+    closes = synthetic_closes(n_days, args.symbols)
+    close_map = {f"{600000 + j:06d}": closes[:, j] for j in range(args.symbols)}
+    workers = min(os.cpu_count() or 1, args.symbols)
+
+    def parallel(pool):
+        return app.run_backtest_sweep(close_map, pool=pool, workers=workers)
+
+    t_serial, result = timeit(lambda: app.run_backtest_sweep(close_map), args.repeat)
+    ctx = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(workers, mp_context=ctx) as pool:
+        parallel(pool)
+        t_parallel, parallel_result = timeit(lambda: parallel(pool), args.repeat)
+    pd.testing.assert_frame_equal(result, parallel_result)
+    print(f"回测参数扫描: {args.symbols} 只 × {n_days} 个交易日，共 {len(result)} 个组合")
+    print(f"  单进程            : {t_serial * 1000:10.1f} ms  ({len(result) / t_serial:8.0f} 组合/秒)")
+    print(f"  {workers:>2} 个子进程       : {t_parallel * 1000:10.1f} ms  ({len(result) / t_parallel:8.0f} 组合/秒)")
+
+
+PIPELINE_SYMBOLS = (1, 10, 100)
+PIPELINE_YEARS = (1, 5, 20)
+PIPELINE_STAGES = ("冷取数", "热取数", "重启取数", "图表", "序列化", "明细表")
+
+
+def run_pipeline(app, store, symbols, start, end):
+    """对每只股票跑一遍 取数→图表→表格，返回各阶段累计耗时 (秒)
+
+    技术指标在写入归档时已预先算好，取数结果直接带指标列。
+    """
+    timings = dict.fromkeys(PIPELINE_STAGES, 0.0)
+
+    def stage(name, func):
+        t0 = time.perf_counter()
+        result = func()
+        timings[name] += time.perf_counter() - t0
+        return result
+
+    for symbol in symbols:
+        stage("冷取数", lambda: store.get(symbol, start, end, "qfq"))
+        stage("热取数", lambda: app.expand_hist_frame(store.get(symbol, start, end, "qfq")))
+        # 新实例没有任何进程内状态，相当于服务重启后或另一个工作进程的首次读取
+        restarted = app.BarStore(store.root, store.fetcher)
+        df = stage("重启取数", lambda: app.expand_hist_frame(restarted.get(symbol, start, end, "qfq")))
+        figs = stage("图表", lambda: (app.create_candlestick_chart(df), app.create_volume_chart(df)))
+        # 图表序列化与表格转 Arrow 是 Streamlit 发送到浏览器前的必经步骤
+        stage("序列化", lambda: [fig.to_json() for fig in figs])
+        stage("明细表", lambda: pa.Table.from_pandas(
+            app.format_history_table(app.history_page(df, *app.history_range(df)))))
+    return timings
+
+
+def bench_pipeline(app, args):
+    """端到端流水线各阶段耗时：股票数量 × 时间跨度"""
+    source = app.ReplaySource(latency=args.latency, error_rate=0.0)
+    fetcher = functools.partial(app.fetch_hist_upstream, source=source)
+    end = datetime.date.today() - datetime.timedelta(days=1)
+    print(f"端到端流水线 (ReplaySource, 注入延迟 {args.latency * 1000:.0f} ms/次)")
+    print(f"  {'股票':>4} {'年':>3} " + " ".join(f"{name:>8}" for name in PIPELINE_STAGES) + f" {'合计':>9}")
+    for n_symbols in PIPELINE_SYMBOLS:
+        symbols = [f"{600000 + i:06d}" for i in range(n_symbols)]
+        for years in PIPELINE_YEARS:
+            start = end - datetime.timedelta(days=365 * years)
+            # 每组使用全新的仓库目录，保证“冷取数”确实触发上游请求
+            with tempfile.TemporaryDirectory() as root:
+                timings = run_pipeline(app, app.BarStore(root, fetcher), symbols, start, end)
+            cells = " ".join(f"{timings[name] * 1000:8.1f}" for name in PIPELINE_STAGES)
+            print(f"  {n_symbols:>4} {years:>3} {cells} {sum(timings.values()) * 1000:9.1f}  ms")
+
+
+def bench_intraday(app, args):
+    """分时缓冲：灌入整日分钟K线、盘中追加一分钟、生成各周期K线的耗时"""
+    source = app.ReplaySource()
+    day = app.intraday_session_day()
+    start = datetime.datetime.combine(day, app.TRADING_SESSIONS[0][0])
+    end = datetime.datetime.combine(day, app.TRADING_SESSIONS[-1][1])
+    symbols = [f"{600000 + i:06d}" for i in range(args.symbols)]
+    # 每只股票先收到前 239 分钟，再收到最后一分钟
+    parts = {}
+    for symbol in symbols:
+        df = app.fetch_minute_upstream(symbol, start, end, source=source)
+        parts[symbol] = [df.iloc[:-1], df.iloc[-1:]]
+    feeds = [app.IntradayFeed(s, lambda sym, a, b: parts[sym].pop(0), lambda sym, d: None) for s in symbols]
+
+    t_fill, _ = timeit(lambda: [feed.refresh(ttl=0) for feed in feeds], 1)
+    t_tick, _ = timeit(lambda: [feed.refresh(ttl=0) for feed in feeds], 1)
+    periods = list(app.INTRADAY_TIMEFRAMES.values())
+    t_frame, _ = timeit(lambda: [feed.frame(k) for feed in feeds for k in periods], args.repeat)
+    print(f"分时缓冲: {args.symbols} 只 × {app.SESSION_MINUTES} 分钟，周期 {periods}")
+    print(f"  灌入整日       : {t_fill * 1000:10.1f} ms  ({t_fill / len(feeds) * 1000:6.2f} ms/只)")
+    print(f"  追加一分钟     : {t_tick * 1000:10.1f} ms  ({t_tick / len(feeds) * 1000:6.2f} ms/只)")
+    print(f"  生成全部周期   : {t_frame * 1000:10.1f} ms  ({t_frame / len(feeds) * 1000:6.2f} ms/只)")
+    print(f"  缓冲占用       : {sum(feed.nbytes for feed in feeds) / 1024:10.1f} KB")
+
+
+BENCHMARKS = {
+    "backtest": bench_backtest,
+    "intraday": bench_intraday,
+    "panel": bench_panel,
+    "pipeline": bench_pipeline,
+    "render": bench_render,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="stock.app.py 性能基准")
+    parser.add_argument("name", choices=sorted(BENCHMARKS), help="要运行的基准")
+    parser.add_argument("--symbols", type=int, default=500, help="股票数量")
+    parser.add_argument("--years", type=int, default=5, help="行情年数")
+    parser.add_argument("--rows", type=int, default=5000, help="单表行数")
+    parser.add_argument("--latency", type=float, default=0.0, help="回放数据源每次调用注入的延迟 (秒)")
+    parser.add_argument("--repeat", type=int, default=3, help="重复次数，取最短耗时")
+    args = parser.parse_args()
+    BENCHMARKS[args.name](load_app(), args)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,54 @@ import streamlit as st
 import akshare as ak
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import datetime
 import time
+import os
+import json
+import logging
+import threading
+import collections
+import re
+import sys
+import shutil
+import functools
+import ast
+import itertools
+import bisect
+import asyncio
+import random
+import contextlib
+import urllib.error
+import urllib.request
+import zlib
+import hashlib
+import hmac
+import io
+import codecs
+import zipfile
+import multiprocessing
+import requests
+from zoneinfo import ZoneInfo
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from streamlit.runtime.scriptrunner_utils.script_run_context import SCRIPT_RUN_CONTEXT_ATTR_NAME
+from pypinyin import lazy_pinyin, Style as PinyinStyle
+
+from backtest import (BACKTEST_FEE, BACKTEST_RULES, BACKTEST_SLIPPAGE, TRADING_DAYS_PER_YEAR,
+                      SignalFeatures, backtest_chunk, backtest_grid, evaluate_positions,
+                      parameter_grid, window_sum)
+
+# 跨进程文件锁仅在 POSIX 平台可用，其他平台的K线归档只做进程内加锁
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger("stock_app")
 
 # ---------------------------------------------------------
 # 自定义 CSS 样式
@@ -263,147 +307,3551 @@ def check_password():
         st.session_state["password_correct"] = True
         return True
 
-    def password_entered():
-        if st.session_state["password"] == app_password:
-            st.session_state["password_correct"] = True
-            st.query_params["auth"] = app_password
-            del st.session_state["password"] 
-        else:
-            st.session_state["password_correct"] = False
+    def password_entered():
+        if st.session_state["password"] == app_password:
+            st.session_state["password_correct"] = True
+            st.query_params["auth"] = app_password
+            del st.session_state["password"] 
+        else:
+            st.session_state["password_correct"] = False
+
+    if "password_correct" not in st.session_state:
+        st.title("🔒 访问受限")
+        st.text_input("请输入访问密码", type="password", on_change=password_entered, key="password")
+        return False
+    elif not st.session_state["password_correct"]:
+        st.title("🔒 访问受限")
+        st.text_input("密码错误，请重试", type="password", on_change=password_entered, key="password")
+        st.error("❌ 密码不正确")
+        return False
+    else:
+        return True
+
+def check_admin():
+    """性能监控面板的管理员验证 (独立于访问密码)，secrets 中未配置 admin_password 时面板不可用"""
+    admin_password = st.secrets.get("admin_password")
+    if not admin_password:
+        st.caption("🔒 未配置 admin_password，性能监控面板已禁用")
+        return False
+    if st.session_state.get("admin_correct"):
+        return True
+
+    def admin_entered():
+        entered = st.session_state.pop("admin_password_input", "")
+        st.session_state["admin_correct"] = hmac.compare_digest(entered.encode(), str(admin_password).encode())
+
+    st.text_input("管理员密码", type="password", on_change=admin_entered, key="admin_password_input")
+    if st.session_state.get("admin_correct") is False:
+        st.error("❌ 管理员密码不正确")
+    return False
+
+# ---------------------------------------------------------
+# 1.1 性能埋点 (分阶段计时与计数)
+# ---------------------------------------------------------
+# 每个阶段保留的最近耗时样本数，分位数按这些样本计算
+METRICS_WINDOW = 2048
+# Prometheus 指标名前缀
+METRICS_PREFIX = "stock_app"
+
+class StageMetrics:
+    """按阶段记录耗时样本、调用次数与失败次数，另有通用事件计数器 (线程安全)"""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self.window = window
+        self.counters = collections.Counter()
+        self._samples = {}
+        # stage -> [调用次数, 累计秒数, 失败次数]，不受样本窗口限制
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, failed=False):
+        with self._lock:
+            if stage not in self._samples:
+                self._samples[stage] = collections.deque(maxlen=self.window)
+                self._totals[stage] = [0, 0.0, 0]
+            self._samples[stage].append(seconds)
+            totals = self._totals[stage]
+            totals[0] += 1
+            totals[1] += seconds
+            totals[2] += int(failed)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        """每个阶段一行：次数、失败、p50/p95/最大耗时 (毫秒) 与累计耗时 (秒)"""
+        with self._lock:
+            stages = sorted(self._samples)
+            samples = [np.fromiter(self._samples[s], dtype=float) for s in stages]
+            totals = [list(self._totals[s]) for s in stages]
+        return pd.DataFrame({
+            '阶段': stages,
+            '次数': [t[0] for t in totals],
+            '失败': [t[2] for t in totals],
+            'p50(ms)': [np.percentile(x, 50) * 1000 for x in samples],
+            'p95(ms)': [np.percentile(x, 95) * 1000 for x in samples],
+            '最大(ms)': [x.max() * 1000 for x in samples],
+            '累计(s)': [t[1] for t in totals],
+        })
+
+    def to_prometheus(self, gauges=None):
+        """导出为 Prometheus 文本格式；gauges 为 {指标名: {标签元组: 数值}} 的附加指标"""
+        name = f"{METRICS_PREFIX}_stage_seconds"
+        lines = [f"# HELP {name} 各阶段耗时 (最近 {self.window} 次的分位数)",
+                 f"# TYPE {name} summary"]
+        with self._lock:
+            for stage in sorted(self._samples):
+                x = np.fromiter(self._samples[stage], dtype=float)
+                count, total, _ = self._totals[stage]
+                for q in (0.5, 0.95):
+                    lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {np.quantile(x, q):.6f}')
+                lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+            errors = {s: t[2] for s, t in self._totals.items()}
+            counters = dict(self.counters)
+        lines += [f"# TYPE {METRICS_PREFIX}_stage_errors_total counter"]
+        lines += [f'{METRICS_PREFIX}_stage_errors_total{{stage="{s}"}} {n}' for s, n in sorted(errors.items())]
+        lines += [f"# TYPE {METRICS_PREFIX}_events_total counter"]
+        lines += [f'{METRICS_PREFIX}_events_total{{event="{e}"}} {n}' for e, n in sorted(counters.items())]
+        for metric, series in (gauges or {}).items():
+            lines.append(f"# TYPE {METRICS_PREFIX}_{metric} gauge")
+            for labels, value in series.items():
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{METRICS_PREFIX}_{metric}{{{label_text}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._totals.clear()
+            self.counters.clear()
+
+@st.cache_resource
+def get_metrics():
+    """进程内共享的性能指标"""
+    return StageMetrics()
+
+@contextlib.contextmanager
+def timed(stage):
+    """把代码块耗时记入 stage，可用作 with 语句或函数装饰器"""
+    start = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        get_metrics().observe(stage, time.perf_counter() - start, failed)
+
+def export_prometheus(text, target):
+    """把 Prometheus 文本写入本地文件，或推送到 Pushgateway (http/https 地址)"""
+    if target.startswith(("http://", "https://")):
+        url = target if "/metrics/job/" in target else target.rstrip("/") + f"/metrics/job/{METRICS_PREFIX}"
+        request = urllib.request.Request(
+            url, data=text.encode("utf-8"), method="PUT",
+            headers={"Content-Type": "text/plain; version=0.0.4"}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return response.status
+    directory = os.path.dirname(os.path.abspath(target))
+    os.makedirs(directory, exist_ok=True)
+    with open(target + ".tmp", "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(target + ".tmp", target)
+    return target
+
+# ---------------------------------------------------------
+# 2. 数据获取函数集
+# ---------------------------------------------------------
+# 上游接口每秒允许的请求数 (按数据源分别限速)；全市场回填单独限速，不占用页面请求的额度
+UPSTREAM_RATE_LIMITS = {"hist": 5, "info": 5, "factors": 2, "minute": 5, "symbols": 1, "spot": 1,
+                        "backfill": 2}
+
+class RateLimiter:
+    """线程安全的令牌桶限速器"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        """尝试取得一个令牌，成功返回 0，否则返回还需等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    async def acquire_async(self):
+        """在事件循环中等待令牌，不占用线程"""
+        while (wait := self.try_acquire()) > 0:
+            await asyncio.sleep(wait)
+
+@st.cache_resource
+def get_rate_limiter(source):
+    """进程内共享的按数据源限速器"""
+    return RateLimiter(UPSTREAM_RATE_LIMITS[source])
+
+# 交易日历：A 股交易时段 (北京时间)，收盘后留出数据落定的缓冲时间
+MARKET_TZ = ZoneInfo("Asia/Shanghai")
+TRADING_SESSIONS = [(datetime.time(9, 30), datetime.time(11, 30)),
+                    (datetime.time(13, 0), datetime.time(15, 0))]
+MARKET_SETTLE = datetime.timedelta(minutes=10)
+
+@st.cache_resource(ttl=86400)
+def get_trade_calendar():
+    """获取交易日历 (交易日集合)，接口不可用时返回 None，退化为按工作日判断"""
+    try:
+        dates = get_data_source().fetch_trade_dates()
+        return frozenset(pd.to_datetime(dates).dt.date) if dates is not None else None
+    except Exception:
+        return None
+
+def market_now():
+    """当前北京时间"""
+    return datetime.datetime.now(MARKET_TZ)
+
+def is_trading_day(day):
+    """判断某天是否为交易日"""
+    calendar = get_trade_calendar()
+    if calendar and min(calendar) <= day <= max(calendar):
+        return day in calendar
+    return day.weekday() < 5
+
+def next_trading_day(day):
+    """返回 day 之后的第一个交易日"""
+    day += datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day += datetime.timedelta(days=1)
+    return day
+
+def live_data_expiry(ttl, now=None):
+    """随行情变动的数据的失效时间戳
+
+    盘中 ttl 秒后失效；开盘前与午间休市冻结到下一时段开盘；
+    收盘 (含落定缓冲) 后冻结到下一个交易日开盘。
+    """
+    now = now or market_now()
+    today = now.date()
+    if is_trading_day(today):
+        for open_t, close_t in TRADING_SESSIONS:
+            session_open = datetime.datetime.combine(today, open_t, MARKET_TZ)
+            session_close = datetime.datetime.combine(today, close_t, MARKET_TZ) + MARKET_SETTLE
+            if now < session_open:
+                return session_open.timestamp()
+            if now < session_close:
+                return min(now.timestamp() + ttl, session_close.timestamp())
+    first_open = TRADING_SESSIONS[0][0]
+    return datetime.datetime.combine(next_trading_day(today), first_open, MARKET_TZ).timestamp()
+
+# 行情缓存：按字节数 LRU 淘汰，过期后在宽限期内先返回旧值并在后台刷新
+CACHE_MAX_BYTES = int(os.environ.get("STOCK_APP_CACHE_MB", "256")) * 1024 * 1024
+CACHE_STALE_GRACE = 60
+LIVE_BAR_TTL = 15
+INFO_LIVE_TTL = 300
+
+def estimate_size(value):
+    """估算缓存对象占用的字节数 (DataFrame 含对象列的实际内容)"""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(value)
+
+class MarketCache:
+    """线程安全的行情缓存
+
+    每个条目带绝对失效时间 (None 表示永不过期)。过期后 stale_grace 秒内的
+    访问直接返回旧值并触发一次后台刷新 (stale-while-revalidate)，超过宽限期
+    才同步重新加载。总字节数超出上限时按最近最少使用淘汰。None 结果不缓存。
+    """
+
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, stale_grace=CACHE_STALE_GRACE):
+        self.max_bytes = max_bytes
+        self.stale_grace = stale_grace
+        self.bytes = 0
+        self.counters = collections.Counter()
+        self._entries = collections.OrderedDict()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self.bytes -= size
+
+    def put(self, key, value, expires_at):
+        """写入缓存，必要时淘汰旧条目"""
+        if value is None:
+            return
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.counters['evictions'] += 1
+
+    def _refresh(self, key, loader, expiry):
+        try:
+            value = loader()
+            self.put(key, value, expiry())
+            self.counters['refreshes'] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def get_or_load(self, key, loader, expiry):
+        """读取缓存，未命中时调用 loader 加载；expiry() 返回新条目的失效时间"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, _, expires_at = entry
+                if expires_at is None or now < expires_at:
+                    self._entries.move_to_end(key)
+                    self.counters['hits'] += 1
+                    return value
+                if now < expires_at + self.stale_grace:
+                    self.counters['stale_hits'] += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        threading.Thread(target=self._refresh, args=(key, loader, expiry),
+                                         daemon=True).start()
+                    return value
+                self._remove(key)
+                self.counters['expired'] += 1
+            self.counters['misses'] += 1
+        value = loader()
+        self.put(key, value, expiry())
+        return value
+
+    def invalidate(self, predicate):
+        """删除键满足 predicate 的全部条目，返回删除数量"""
+        with self._lock:
+            keys = [key for key in self._entries if predicate(key)]
+            for key in keys:
+                self._remove(key)
+        return len(keys)
+
+    def find(self, predicate):
+        """返回键满足 predicate 的任一未过期条目的值，没有则返回 None"""
+        now = time.time()
+        with self._lock:
+            for key, (value, _, expires_at) in self._entries.items():
+                if (expires_at is None or now < expires_at) and predicate(key):
+                    self.counters['range_hits'] += 1
+                    return value
+        return None
+
+    def memory_by_symbol(self):
+        """按股票代码汇总缓存条目占用的字节数"""
+        usage = collections.Counter()
+        with self._lock:
+            for key, (_, size, _) in self._entries.items():
+                if len(key) > 1:
+                    usage[key[1]] += size
+        return dict(usage)
+
+    def stats(self):
+        """命中、未命中、淘汰等计数以及当前占用"""
+        stats = dict(self.counters)
+        stats.update(entries=len(self._entries), bytes=self.bytes, max_bytes=self.max_bytes)
+        return stats
+
+@st.cache_resource
+def get_data_cache():
+    """进程内共享的行情缓存"""
+    return MarketCache()
+
+def market_cached(name, expiry):
+    """用共享行情缓存包装数据获取函数，expiry(*args) 返回结果的失效时间戳"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            value = get_data_cache().get_or_load(
+                (name,) + args, lambda: func(*args), lambda: expiry(*args)
+            )
+            # 浅拷贝，调用方新增列不会污染缓存中的对象
+            return value.copy(deep=False) if isinstance(value, pd.DataFrame) else value
+        return wrapper
+    return decorator
+
+def info_expiry(symbol):
+    """基本面含市值等盘中变动字段，按实时数据处理"""
+    return live_data_expiry(INFO_LIVE_TTL)
+
+def hist_expiry(symbol, start, end, adjust):
+    """已收盘交易日的K线永不过期，含当天的区间按实时数据处理
+
+    前复权价格以当日因子为基准，新的除权除息日会改变此前所有价格，
+    已收盘的前复权区间只缓存到下一个交易时段开始或结束。
+    """
+    if end >= market_now().date():
+        return live_data_expiry(LIVE_BAR_TTL)
+    if adjust == "qfq":
+        return live_data_expiry(float("inf"))
+    return None
+
+# 请求合并：同一键的并发请求只发起一次上游调用，其余调用方共享结果
+class SingleFlight:
+    """single-flight 请求合并器"""
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func):
+        """执行 func；若同一键已有调用在进行中，则等待并返回它的结果"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+        if not leader:
+            self.counters['shared'] += 1
+            return future.result()
+
+        self.counters['leader'] += 1
+        try:
+            result = func()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def find(self, predicate):
+        """返回键满足 predicate 的进行中调用 (Future)，没有则返回 None"""
+        with self._lock:
+            for key, future in self._calls.items():
+                if predicate(key):
+                    return future
+        return None
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['in_flight'] = len(self._calls)
+        return stats
+
+@st.cache_resource
+def get_fetch_flight():
+    """进程内共享的请求合并器"""
+    return SingleFlight()
+
+def covers_range(symbol, start, end, adjust):
+    """生成判断 ("hist", 代码, 起, 止, 复权) 键是否覆盖给定区间的函数"""
+    def predicate(key):
+        return (len(key) == 5 and key[0] == "hist" and key[1] == symbol
+                and key[4] == adjust and key[2] <= start and key[3] >= end)
+    return predicate
+
+def slice_hist(df, start, end):
+    """从更宽区间的行情中切出 [start, end]"""
+    if df is None:
+        return None
+    mask = (df['日期'] >= pd.Timestamp(start)) & (df['日期'] <= pd.Timestamp(end))
+    return df.loc[mask].reset_index(drop=True)
+
+@timed("info")
+@market_cached("info", info_expiry)
+def get_base_info(symbol):
+    """获取个股多维度基本面信息"""
+    source = get_data_source()
+    try:
+        return get_fetch_flight().do(
+            ("info", symbol), lambda: call_upstream("info", source, source.fetch_info, symbol)
+        )
+    except UpstreamError:
+        # 失败结果不进入缓存，下次访问会重新请求
+        return None
+
+# 本地行情仓库目录，可通过环境变量 STOCK_APP_DATA_DIR 覆盖
+DATA_DIR = os.environ.get(
+    "STOCK_APP_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
+)
+
+HIST_NUMERIC_COLS = ['开盘', '收盘', '最高', '最低', '成交量', '成交额', '涨跌幅', '换手率']
+# 紧凑存储：价格与比率 (上游均为两位小数) 用 float32，成交量用 int64，
+# 成交额可达千亿且精确到元，保留 float64；文本列转为 category
+HIST_FLOAT32_COLS = ['开盘', '收盘', '最高', '最低', '振幅', '涨跌幅', '涨跌额', '换手率']
+
+def compact_hist_frame(df):
+    """把行情转换为紧凑的列类型，展示到两位小数时数值不变"""
+    if df is None or df.empty:
+        return df
+    df = df.copy()
+    df['日期'] = pd.to_datetime(df['日期'])
+    for col in df.columns:
+        if col in HIST_FLOAT32_COLS:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float32')
+        elif col == '成交量':
+            volume = pd.to_numeric(df[col], errors='coerce')
+            df[col] = volume.astype('int64') if volume.notna().all() else volume.astype('float64')
+        elif col == '成交额':
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+        elif df[col].dtype == object or pd.api.types.is_string_dtype(df[col]):
+            df[col] = df[col].astype('category')
+    return df
+
+def expand_hist_frame(df):
+    """把紧凑格式还原为 float64 供计算与展示
+
+    float32 列按两位小数取整，恢复与上游完全一致的十进制数值，保证指标、
+    图表和表格的显示结果与未压缩时相同。只在本次渲染中临时存在，不进入缓存。
+    只有这些列生成新数组，其余列 (日期、成交量、技术指标等) 与输入共享内存，
+    不随每次渲染整体复制。
+    """
+    if df is None or df.empty:
+        return df
+    expanded = {col: df[col].to_numpy(dtype=np.float64).round(2) for col in HIST_FLOAT32_COLS
+                if col in df.columns and df[col].dtype == np.float32}
+    return df.assign(**expanded) if expanded else df
+
+def fetch_hist_upstream(symbol, start, end, adjust, source=None, endpoint="hist"):
+    """从数据源拉取指定区间的日线行情 (不做任何缓存)，endpoint 决定使用的限速与熔断额度"""
+    source = source or get_data_source()
+    df = call_upstream(endpoint, source, source.fetch_hist, symbol, start, end, adjust)
+    if df is not None and not df.empty:
+        df['日期'] = pd.to_datetime(df['日期'])
+        for col in HIST_NUMERIC_COLS:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return compact_hist_frame(df)
+
+@timed("hist")
+def get_hist_data(symbol, start, end, adjust):
+    """获取历史行情与技术指标 (从本地归档的内存映射切片，缓存中为紧凑格式，返回前临时还原为 float64)"""
+    return expand_hist_frame(get_hist_compact(symbol, start, end, adjust))
+
+@market_cached("hist", hist_expiry)
+def get_hist_compact(symbol, start, end, adjust):
+    """获取紧凑格式的历史行情 (优先读取本地仓库，仅增量拉取缺失的首尾区间)
+
+    已缓存或正在获取的更宽区间直接切片复用；相同区间的并发请求合并为一次调用。
+    """
+    key = ("hist", symbol, start, end, adjust)
+    covers = covers_range(symbol, start, end, adjust)
+    try:
+        wider = get_data_cache().find(covers)
+        if wider is not None:
+            return slice_hist(wider, start, end)
+        flight = get_fetch_flight()
+        in_flight = flight.find(lambda k: k != key and covers(k))
+        if in_flight is not None:
+            flight.counters['sliced'] += 1
+            return slice_hist(in_flight.result(), start, end)
+        return flight.do(key, lambda: load_hist_bars(symbol, start, end, adjust))
+    except (UpstreamError, OSError, ValueError):
+        # 上游失败或本地仓库读写异常；None 不会写入缓存
+        return None
+
+# ---------------------------------------------------------
+# 2.1 本地K线归档 (内存映射的定长记录文件，按代码与复权方式分区)
+# ---------------------------------------------------------
+# 归档记录中的K线字段，价格与比率沿用紧凑格式的 float32
+ARCHIVE_BAR_FIELDS = ['开盘', '收盘', '最高', '最低', '成交量', '成交额', '振幅', '涨跌幅', '涨跌额', '换手率']
+ARCHIVE_FLOAT64_FIELDS = ['成交量', '成交额']
+# 计算当天K线指标时向前取的已归档K线数，EMA 初值的影响在此长度内衰减到浮点误差以下
+ARCHIVE_WARMUP = 500
+# 首次拉取与首部补数时在请求起点之前多取的自然日 (约 170 个交易日)，只作指标预热不计入覆盖区间；
+# EMA26 初值的影响在此长度内衰减到 1e-6 以下，之后再向前补数不会改变已缓存的指标
+ARCHIVE_HEAD_WARMUP_DAYS = 250
+# 进程内保留的文件映射与当天K线的分区数上限，超出时淘汰最久未用的
+ARCHIVE_MAX_CACHED = 512
+
+@functools.lru_cache(maxsize=None)
+def archive_dtype():
+    """归档记录的定长结构：日期 + K线字段 + 按全部历史预先算好的技术指标"""
+    fields = [('日期', '<M8[D]')]
+    fields += [(col, '<f8' if col in ARCHIVE_FLOAT64_FIELDS else '<f4') for col in ARCHIVE_BAR_FIELDS]
+    fields += [(col, '<f8') for col in INDICATOR_COLUMNS]
+    return np.dtype(fields)
+
+def frame_to_records(df):
+    """含指标列的行情 DataFrame → 归档记录数组，缺失的列记为 NaN"""
+    records = np.empty(len(df), dtype=archive_dtype())
+    records['日期'] = df['日期'].to_numpy(dtype='datetime64[D]')
+    for name in records.dtype.names[1:]:
+        records[name] = df[name].to_numpy(dtype=float) if name in df else np.nan
+    return records
+
+def records_to_frame(records, symbol):
+    """归档记录 → 紧凑格式 DataFrame，数值列直接引用记录所在的内存 (不复制)"""
+    columns = {
+        '日期': records['日期'].astype('datetime64[ns]'),
+        '股票代码': pd.Categorical.from_codes(np.zeros(len(records), dtype=np.int8), categories=[symbol]),
+    }
+    for name in records.dtype.names[1:]:
+        columns[name] = records[name]
+    volume = records['成交量']
+    if np.isfinite(volume).all():
+        columns['成交量'] = volume.astype(np.int64)
+    return pd.DataFrame(columns, copy=False)
+
+class BarStore:
+    """内存映射的K线归档
+
+    每个 (代码, 复权方式) 对应一个定长记录文件，每条记录是一个交易日的K线
+    以及按该分区全部历史预先算好的技术指标。旁边的 JSON 记录已覆盖的日期
+    区间、记录数与当前数据文件名。读取时以只读方式 np.memmap 映射文件，
+    按日期二分查找定位记录偏移后直接切片，数值列引用映射内存而不复制；
+    多个进程映射同一文件时共享操作系统页缓存，进程重启后无需预热。
+
+    查询时只向数据源请求覆盖区间之外的首部或尾部。尾部新增的K线直接追加到
+    文件末尾，已写入的记录不再修改 (指标只依赖此前的K线，追加不会改变旧值)，
+    新增K线的指标从最近 ARCHIVE_WARMUP 根已归档K线恢复状态后增量计算；
+    首部补数时写出新一代文件，再原子替换 JSON 切换过去，已映射旧文件的读者
+    不受影响。首次拉取与首部补数都在请求起点之前多取 ARCHIVE_HEAD_WARMUP_DAYS
+    天作指标预热 (覆盖区间仍从请求起点算起)，所以向前补数重算指标时，已返回
+    过的K线的 EMA 类指标只在浮点误差内变化。
+
+    当天的K线可能仍在变化，不写入归档，而是基于最近 ARCHIVE_WARMUP 根已归档
+    K线单独计算指标。拉到的当天K线按 (代码, 复权方式) 在内存中复用
+    live_ttl(代码) 秒，覆盖今天的不同区间不会各自向上游重新请求；后台轮询在
+    refreshing() 上下文中查询，总是重新拉取并更新这份当天K线。
+
+    文件映射与当天K线都只保留最近使用的 max_cached 个分区。
+
+    fetcher 签名与 fetch_hist_upstream 相同，测试时可替换为桩函数。
+    """
+
+    def __init__(self, root, fetcher, live_ttl=None, max_cached=ARCHIVE_MAX_CACHED):
+        self.root = root
+        self.fetcher = fetcher
+        self.live_ttl = live_ttl or (lambda symbol: LIVE_BAR_TTL)
+        self.max_cached = max_cached
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._cache_guard = threading.Lock()
+        self._maps = collections.OrderedDict()
+        self._live = collections.OrderedDict()
+        self._local = threading.local()
+        os.makedirs(root, exist_ok=True)
+
+    @contextlib.contextmanager
+    def refreshing(self):
+        """当前线程在此上下文内的查询 (含取数函数内嵌套的查询) 都重新拉取当天K线"""
+        previous = getattr(self._local, "refresh", False)
+        self._local.refresh = True
+        try:
+            yield
+        finally:
+            self._local.refresh = previous
+
+    def _recall(self, cache, key):
+        """读取有容量上限的进程内缓存，命中时标记为最近使用"""
+        with self._cache_guard:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _remember(self, cache, key, value):
+        """写入有容量上限的进程内缓存，超出 max_cached 个分区时淘汰最久未用的"""
+        with self._cache_guard:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > self.max_cached:
+                cache.popitem(last=False)
+
+    def _reusable_live(self, symbol, adjust, gaps):
+        """尾部缺口只有今天且复用的当天K线未过期时返回 (当天K线,)，否则返回 None"""
+        now = market_now()
+        if not gaps or gaps[-1][0] < now.date() or getattr(self._local, "refresh", False):
+            return None
+        cached = self._recall(self._live, (symbol, adjust))
+        if cached is None or now.timestamp() >= cached[0]:
+            return None
+        return (cached[1],)
+
+    def _path(self, symbol, adjust, suffix):
+        return os.path.join(self.root, f"{symbol}_{adjust}{suffix}")
+
+    def _lock(self, symbol, adjust):
+        with self._locks_guard:
+            return self._locks.setdefault((symbol, adjust), threading.Lock())
+
+    @contextlib.contextmanager
+    def _file_lock(self, symbol, adjust):
+        """跨进程的分区写锁，没有 fcntl 的平台只依赖进程内锁"""
+        if fcntl is None:
+            yield
+            return
+        with open(self._path(symbol, adjust, ".lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _meta(self, symbol, adjust):
+        try:
+            with open(self._path(symbol, adjust, ".json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, symbol, adjust, meta):
+        meta_path = self._path(symbol, adjust, ".json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @staticmethod
+    def _coverage_of(meta):
+        try:
+            return (datetime.date.fromisoformat(meta["start"]),
+                    datetime.date.fromisoformat(meta["end"]))
+        except (TypeError, ValueError, KeyError):
+            return None
+
+    def coverage(self, symbol, adjust):
+        """返回分区已覆盖的 (起始日, 结束日)，无数据时返回 None"""
+        return self._coverage_of(self._meta(symbol, adjust))
+
+    def records(self, symbol, adjust, meta=None):
+        """只读映射分区的全部记录，同一文件与记录数的映射在进程内复用"""
+        meta = meta if meta is not None else self._meta(symbol, adjust)
+        if not meta or not meta.get("rows") or "file" not in meta:
+            return np.empty(0, dtype=archive_dtype())
+        version = (meta["file"], meta["rows"])
+        cached = self._recall(self._maps, (symbol, adjust))
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with timed("store.map"):
+            records = np.memmap(os.path.join(self.root, meta["file"]), dtype=archive_dtype(),
+                                mode='r', shape=(meta["rows"],))
+        self._remember(self._maps, (symbol, adjust), (version, records))
+        return records
+
+    @staticmethod
+    def _missing(start, end, cov):
+        """计算请求区间相对已覆盖区间缺失的首部与尾部"""
+        if cov is None:
+            return [(start, end)]
+        gaps = []
+        if start < cov[0]:
+            gaps.append((start, cov[0] - datetime.timedelta(days=1)))
+        if end > cov[1]:
+            gaps.append((cov[1] + datetime.timedelta(days=1), end))
+        return gaps
+
+    @staticmethod
+    def _with_warmup(gaps, cov, records):
+        """首部缺口向前延伸 ARCHIVE_HEAD_WARMUP_DAYS 天，已归档的预热K线不再重复拉取"""
+        warmed = []
+        for gap_start, gap_end in gaps:
+            if cov is None or gap_end < cov[0]:
+                gap_start -= datetime.timedelta(days=ARCHIVE_HEAD_WARMUP_DAYS)
+                if len(records):
+                    first = records['日期'][0].astype(datetime.date)
+                    gap_end = min(gap_end, first - datetime.timedelta(days=1))
+            warmed.append((gap_start, gap_end))
+        return warmed
+
+    def _rewrite(self, symbol, adjust, meta, records, cov):
+        """写出新一代数据文件并切换元数据，保留上一代供仍在读取的进程使用"""
+        generation = (meta or {}).get("generation", 0) + 1
+        name = f"{symbol}_{adjust}.{generation}.bars"
+        path = os.path.join(self.root, name)
+        records.tofile(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        self._write_meta(symbol, adjust, {
+            "start": cov[0].isoformat(), "end": cov[1].isoformat(),
+            "file": name, "rows": len(records), "generation": generation,
+        })
+        try:
+            os.remove(self._path(symbol, adjust, f".{generation - 2}.bars"))
+        except OSError:
+            pass
+
+    def _append(self, symbol, adjust, meta, records, cov):
+        """把新记录追加到当前数据文件末尾 (映射中已有的字节不会被改写)"""
+        path = os.path.join(self.root, meta["file"])
+        with open(path, "r+b") as f:
+            # 截掉上次写入中断时可能残留的尾部字节
+            f.seek(meta["rows"] * records.dtype.itemsize)
+            f.write(records.tobytes())
+            f.truncate()
+        self._write_meta(symbol, adjust, dict(
+            meta, start=cov[0].isoformat(), end=cov[1].isoformat(), rows=meta["rows"] + len(records)
+        ))
+
+    @staticmethod
+    def _tail_records(symbol, records, tail):
+        """从最近 ARCHIVE_WARMUP 根已归档K线恢复指标状态，只计算尾部新增K线的指标
+
+        与按全部历史重算的结果在浮点误差内一致 (EMA 初值的影响在预热长度内已衰减)，
+        追加的耗时不随归档长度增长。收盘价含缺失值时返回 None，由调用方全量重算。
+        """
+        recent = expand_hist_frame(records_to_frame(records[-ARCHIVE_WARMUP:], symbol))
+        tail = expand_hist_frame(compact_hist_frame(tail.reset_index(drop=True)))
+        closes = tail['收盘'].to_numpy(dtype=float)
+        if not (np.isfinite(recent['收盘'].to_numpy(dtype=float)).all() and np.isfinite(closes).all()):
+            return None
+        engine = IncrementalIndicators.from_frame(recent)
+        for date, close in zip(tail['日期'].to_numpy(), closes):
+            engine.append(date, close)
+        values = engine.columns()
+        return frame_to_records(tail.assign(**{col: values[col][-len(tail):] for col in INDICATOR_COLUMNS}))
+
+    def _merge(self, symbol, adjust, fetched, start, end):
+        """把拉取到的已收定K线并入归档，返回尚未收定的当天K线"""
+        meta = self._meta(symbol, adjust)
+        cov = self._coverage_of(meta)
+        records = self.records(symbol, adjust, meta)
+        # 以北京时间划分已收定与当天K线，与刷新调度和交易时段判断保持一致
+        yesterday = market_now().date() - datetime.timedelta(days=1)
+        new_cov = (min(start, cov[0]) if cov else start,
+                   min(max(end, cov[1]) if cov else end, yesterday))
+        if fetched is None or fetched.empty:
+            settled = live = None
+        else:
+            is_settled = fetched['日期'] <= pd.Timestamp(new_cov[1])
+            settled, live = fetched.loc[is_settled], fetched.loc[~is_settled]
+        if new_cov[0] > new_cov[1] or (len(records) == 0 and (settled is None or settled.empty)):
+            return live
+
+        archived = records['日期']
+        if settled is not None and len(archived):
+            dates = settled['日期'].to_numpy(dtype='datetime64[D]')
+            head = settled.loc[dates < archived[0]]
+            tail = settled.loc[dates > archived[-1]]
+        else:
+            head, tail = settled, None
+        parts = [part for part in (head, records_to_frame(records, symbol), tail)
+                 if part is not None and not part.empty]
+        appended = (self._tail_records(symbol, records, tail)
+                    if len(records) and (head is None or head.empty) and tail is not None and not tail.empty
+                    else None)
+        if appended is not None:
+            self._append(symbol, adjust, meta, appended, new_cov)
+        elif len(parts) > 1 or len(records) == 0:
+            # 指标按分区的全部历史计算，与单独计算每根K线的结果一致
+            full = add_technical_indicators(expand_hist_frame(
+                compact_hist_frame(pd.concat(parts, ignore_index=True))
+            ))
+            new_records = frame_to_records(full)
+            if len(records) and (head is None or head.empty):
+                self._append(symbol, adjust, meta, new_records[len(records):], new_cov)
+            else:
+                self._rewrite(symbol, adjust, meta, new_records, new_cov)
+        else:
+            self._write_meta(symbol, adjust, dict(
+                meta, start=new_cov[0].isoformat(), end=new_cov[1].isoformat()
+            ))
+        return live
+
+    def _migrate(self, symbol, adjust, meta):
+        """把旧版 Parquet 分区转换为记录归档"""
+        legacy = self._path(symbol, adjust, ".parquet")
+        cov = self._coverage_of(meta)
+        if cov is not None and os.path.exists(legacy):
+            self._merge(symbol, adjust, compact_hist_frame(pd.read_parquet(legacy)), *cov)
+        else:
+            os.remove(self._path(symbol, adjust, ".json"))
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    def _with_indicators(self, symbol, adjust, records, live):
+        """基于最近的已归档K线计算当天K线的指标，盘中刷新时只增量更新最后一根"""
+        recent = expand_hist_frame(compact_hist_frame(pd.concat(
+            [records_to_frame(records[-ARCHIVE_WARMUP:], symbol), live], ignore_index=True
+        )))
+        recent = add_technical_indicators_incremental(recent, (symbol, adjust, "live"))
+        return live.assign(**{col: recent[col].to_numpy()[-len(live):] for col in INDICATOR_COLUMNS})
+
+    def get(self, symbol, start, end, adjust):
+        """返回 [start, end] 区间的日线与技术指标，缺失部分自动补齐"""
+        live = None
+        with self._lock(symbol, adjust):
+            meta = self._meta(symbol, adjust)
+            if meta is not None and "file" not in meta:
+                with self._file_lock(symbol, adjust):
+                    self._migrate(symbol, adjust, meta)
+                meta = self._meta(symbol, adjust)
+            cov = self._coverage_of(meta)
+            gaps = self._missing(start, end, cov)
+            reused = self._reusable_live(symbol, adjust, gaps)
+            if reused is not None:
+                live, gaps = reused[0], gaps[:-1]
+            if gaps:
+                parts = [self.fetcher(symbol, gap_start, gap_end, adjust)
+                         for gap_start, gap_end in self._with_warmup(gaps, cov, self.records(symbol, adjust, meta))
+                         if gap_start <= gap_end]
+                parts = [part for part in parts if part is not None and not part.empty]
+                fetched = compact_hist_frame(pd.concat(parts, ignore_index=True)
+                                             .drop_duplicates(subset='日期', keep='last')
+                                             .sort_values('日期')
+                                             .reset_index(drop=True)) if parts else None
+                # 其他进程可能在拉取期间写入了同一分区，合并前在写锁内重新读取元数据
+                with self._file_lock(symbol, adjust):
+                    merged_live = self._merge(symbol, adjust, fetched, start, end)
+                if reused is None:
+                    live = merged_live
+                    if gaps[-1][1] >= market_now().date():
+                        self._remember(self._live, (symbol, adjust),
+                                       (live_data_expiry(self.live_ttl(symbol)), live))
+                meta = self._meta(symbol, adjust)
+            records = self.records(symbol, adjust, meta)
+
+        if len(records) == 0 and (live is None or live.empty):
+            return None
+        dates = records['日期']
+        lo = np.searchsorted(dates, np.datetime64(start, 'D'), side='left')
+        hi = np.searchsorted(dates, np.datetime64(end, 'D'), side='right')
+        df = records_to_frame(records[lo:hi], symbol)
+        if live is not None and not live.empty:
+            live = self._with_indicators(symbol, adjust, records, live)
+            df = compact_hist_frame(pd.concat([df, live], ignore_index=True))
+        return df
+
+@st.cache_resource
+def get_bar_store():
+    """进程内共享的本地K线归档实例"""
+    return BarStore(DATA_DIR, fetch_hist_derived, live_ttl=live_bar_ttl)
+
+# ---------------------------------------------------------
+# 2.2 后台刷新调度 (进程级统一轮询，替代逐会话 sleep + rerun)
+# ---------------------------------------------------------
+# 轮询最近若干天的K线即可拿到最新一根，回看窗口覆盖长假
+LIVE_LOOKBACK_DAYS = 14
+
+def market_is_live(now=None):
+    """当前是否处于交易时段 (含收盘后的落定缓冲)"""
+    now = now or market_now()
+    if not is_trading_day(now.date()):
+        return False
+    for open_t, close_t in TRADING_SESSIONS:
+        session_open = datetime.datetime.combine(now.date(), open_t, MARKET_TZ)
+        session_close = datetime.datetime.combine(now.date(), close_t, MARKET_TZ) + MARKET_SETTLE
+        if session_open <= now < session_close:
+            return True
+    return False
+
+class RefreshScheduler:
+    """进程级后台刷新调度器
+
+    各会话通过 watch() 登记关注的 (代码, 复权方式) 并续约；后台线程对每个
+    关注项每个刷新周期最多轮询一次上游，并把最新一根K线写入共享快照。
+    快照内容变化时 version 递增，会话据此判断是否需要重绘。休市期间已有
+    快照的关注项不再轮询。超过租期未续约的关注项自动移除。分时行情以
+    INTRADAY_ADJUST 登记，轮询时只增量拉取新的分钟K线。
+    """
+
+    def __init__(self, lease_factor=3):
+        self.lease_factor = lease_factor
+        self.counters = collections.Counter()
+        self._watches = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def watch(self, symbol, adjust, interval):
+        """登记或续约关注项，interval 取所有会话中最短的刷新周期"""
+        key = (symbol, adjust)
+        now = time.time()
+        with self._lock:
+            watch = self._watches.get(key)
+            if watch is None:
+                self._watches[key] = {"interval": interval, "last_seen": now, "next_poll": now}
+                self._wake.set()
+            else:
+                watch["interval"] = min(watch["interval"], interval)
+                watch["last_seen"] = now
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="refresh-scheduler",
+                                                daemon=True)
+                self._thread.start()
+
+    def interval(self, symbol):
+        """关注该股票日线的最短刷新周期 (秒)，未被关注时返回 None"""
+        with self._lock:
+            return min((w["interval"] for (s, adjust), w in self._watches.items()
+                        if s == symbol and adjust != INTRADAY_ADJUST), default=None)
+
+    def snapshot(self, symbol, adjust):
+        """返回关注项的最新快照 (dict)，尚未轮询过时返回 None"""
+        return self._snapshots.get((symbol, adjust))
+
+    def versions(self, keys):
+        """一组关注项当前的快照版本号"""
+        return tuple((self._snapshots.get(key) or {}).get("version") for key in keys)
+
+    def _due(self, now):
+        with self._lock:
+            for key, watch in list(self._watches.items()):
+                if now - watch["last_seen"] > self.lease_factor * watch["interval"] + 30:
+                    del self._watches[key]
+            due = [key for key, watch in self._watches.items() if watch["next_poll"] <= now]
+            for key in due:
+                watch = self._watches[key]
+                watch["next_poll"] = now + watch["interval"]
+            next_wake = min((w["next_poll"] for w in self._watches.values()), default=now + 30)
+        return due, next_wake
+
+    def _publish(self, key, fingerprint, latest):
+        """写入快照，内容有变化时递增版本号并返回 True"""
+        old = self._snapshots.get(key)
+        if old is not None and old["fingerprint"] == fingerprint:
+            old["polled_at"] = time.time()
+            return False
+        self._snapshots[key] = {
+            "version": (old["version"] + 1) if old else 1,
+            "fingerprint": fingerprint,
+            "latest": latest,
+            "polled_at": time.time(),
+        }
+        self.counters['changes'] += 1
+        return True
+
+    def _poll(self, symbol, adjust):
+        if adjust == INTRADAY_ADJUST:
+            # 分时行情只增量拉取新分钟，结果直接留在共享的分钟缓冲里
+            feed = get_intraday_feeds().get(symbol)
+            feed.refresh()
+            self.counters['polls'] += 1
+            latest = feed.summary()
+            if latest is not None:
+                self._publish((symbol, adjust), (feed.day, feed.version), latest)
+            return
+        today = market_now().date()
+        start = today - datetime.timedelta(days=LIVE_LOOKBACK_DAYS)
+        # 轮询总是重新拉取当天K线，页面侧的查询在下次轮询前复用这次的结果
+        with get_bar_store().refreshing():
+            df = load_hist_bars(symbol, start, today, adjust)
+        self.counters['polls'] += 1
+        if df is None or df.empty:
+            return
+        latest = df.iloc[-1]
+        fingerprint = (latest['日期'], latest['收盘'], latest['成交量'])
+        if self._publish((symbol, adjust), fingerprint, latest.to_dict()):
+            # 让覆盖今天的缓存区间失效，会话重绘时拿到的就是新数据
+            get_data_cache().invalidate(
+                lambda k: len(k) == 5 and k[0] == "hist" and k[1] == symbol
+                and k[4] == adjust and k[3] >= today
+            )
+
+    def _run(self):
+        while True:
+            due, next_wake = self._due(time.time())
+            live = market_is_live()
+            for symbol, adjust in due:
+                if not live and (symbol, adjust) in self._snapshots:
+                    self.counters['skipped_closed'] += 1
+                    continue
+                try:
+                    self._poll(symbol, adjust)
+                except Exception:
+                    self.counters['errors'] += 1
+            self._wake.wait(timeout=min(max(next_wake - time.time(), 0.5), 30))
+            self._wake.clear()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(watches=len(self._watches), snapshots=len(self._snapshots))
+        return stats
+
+@st.cache_resource
+def get_refresh_scheduler():
+    """进程内唯一的后台刷新调度器"""
+    return RefreshScheduler()
+
+def live_bar_ttl(symbol):
+    """归档层复用当天K线的秒数：调度器轮询该股票时跟随其刷新周期，否则为 LIVE_BAR_TTL"""
+    return max(LIVE_BAR_TTL, get_refresh_scheduler().interval(symbol) or 0)
+
+# ---------------------------------------------------------
+# 2.3 数据源接口 (akshare 实盘 / 离线回放)
+# ---------------------------------------------------------
+class DataSource:
+    """行情数据源接口，返回与 akshare 对应接口相同结构的原始 DataFrame"""
+
+    name = "base"
+    # 是否需要经过上游限速器
+    rate_limited = True
+
+    def fetch_hist(self, symbol, start, end, adjust):
+        """日线行情，adjust 取 "qfq" / "hfq" / "None" """
+        raise NotImplementedError
+
+    def fetch_info(self, symbol):
+        """个股基本面 (item / value 两列)"""
+        raise NotImplementedError
+
+    def fetch_minute(self, symbol, start, end):
+        """[start, end] 内的 1 分钟K线 (北京时间，与 stock_zh_a_hist_min_em 列名一致)"""
+        raise NotImplementedError
+
+    def fetch_adjust_factors(self, symbol):
+        """后复权因子 (date / hfq_factor 两列，每个除权除息日一行)，不支持时返回 None"""
+        return None
+
+    def fetch_trade_dates(self):
+        """交易日列表，不支持时返回 None"""
+        return None
+
+    def fetch_symbols(self):
+        """全部 A 股代码与简称 (code / name 两列)，不支持时返回 None"""
+        return None
+
+    def fetch_spot(self):
+        """全市场当日行情快照 (与 stock_zh_a_spot_em 列名一致)"""
+        raise NotImplementedError
+
+def exchange_symbol(symbol):
+    """6 位代码 → 新浪接口使用的带交易所前缀的代码"""
+    if symbol.startswith(("4", "8", "92")):
+        return "bj" + symbol
+    if symbol.startswith(("6", "9")):
+        return "sh" + symbol
+    return "sz" + symbol
+
+class AkshareSource(DataSource):
+    """akshare 实盘数据源"""
+
+    name = "akshare"
+
+    def fetch_hist(self, symbol, start, end, adjust):
+        return ak.stock_zh_a_hist(
+            symbol=symbol,
+            period="daily",
+            start_date=start.strftime("%Y%m%d"),
+            end_date=end.strftime("%Y%m%d"),
+            adjust="" if adjust == "None" else adjust
+        )
+
+    def fetch_info(self, symbol):
+        return ak.stock_individual_info_em(symbol=symbol)
+
+    def fetch_minute(self, symbol, start, end):
+        try:
+            return ak.stock_zh_a_hist_min_em(
+                symbol=symbol,
+                start_date=start.strftime("%Y-%m-%d %H:%M:%S"),
+                end_date=end.strftime("%Y-%m-%d %H:%M:%S"),
+                period="1",
+                adjust=""
+            )
+        except ValueError:
+            # 停牌等没有分时数据时接口返回空表，列名无法对齐
+            return pd.DataFrame(columns=['时间', '开盘', '收盘', '最高', '最低', '成交量', '成交额', '均价'])
+
+    def fetch_adjust_factors(self, symbol):
+        try:
+            return ak.stock_zh_a_daily(symbol=exchange_symbol(symbol), adjust="hfq-factor")
+        except ValueError:
+            # 新浪对从未除权除息的股票不返回因子
+            return pd.DataFrame(columns=['date', 'hfq_factor'])
+
+    def fetch_trade_dates(self):
+        return ak.tool_trade_date_hist_sina()['trade_date']
+
+    def fetch_symbols(self):
+        return ak.stock_info_a_code_name()
+
+    def fetch_spot(self):
+        return ak.stock_zh_a_spot_em()
+
+class ReplaySource(DataSource):
+    """确定性的本地回放数据源
+
+    优先读取 record_dir 下录制的 {代码}_{复权}.parquet / {代码}_factor.csv / {代码}_info.csv / symbols.csv
+    (见 record_replay_data)，没有录制文件时按代码生成确定性的合成行情：
+    同一代码每次得到完全相同的K线，并按年模拟分红除权，以便前/后复权
+    有所区别。latency / jitter 为每次调用注入的延迟 (秒)，error_rate 为
+    注入 ConnectionError 的概率，随机数由 seed 决定，可复现。
+    """
+
+    name = "replay"
+    rate_limited = False
+    FIRST_DAY = datetime.date(1991, 1, 2)
+
+    def __init__(self, record_dir=None, latency=0.0, jitter=0.0, error_rate=0.0, seed=0):
+        self.record_dir = record_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self._rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock()
+        # 合成行情按代码缓存，数量有上限 (全市场回放时避免占用过多内存)
+        self._series = collections.OrderedDict()
+        self._series_lock = threading.Lock()
+
+    def _simulate_call(self):
+        with self._rng_lock:
+            delay = self.latency + self.jitter * self._rng.random()
+            failed = self._rng.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        if failed:
+            raise ConnectionError("replay: 注入的上游错误")
+
+    def _recorded(self, filename):
+        if not self.record_dir:
+            return None
+        path = os.path.join(self.record_dir, filename)
+        if not os.path.exists(path):
+            return None
+        return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path, dtype=str)
+
+    SERIES_CACHE_SIZE = 256
+
+    @staticmethod
+    @functools.lru_cache(maxsize=4)
+    def _business_days(last_day):
+        """FIRST_DAY 至 last_day 的工作日 (datetime64[D])"""
+        days = np.arange(ReplaySource.FIRST_DAY, last_day + datetime.timedelta(days=1), dtype='datetime64[D]')
+        return days[np.is_busday(days)]
+
+    def _synthetic(self, symbol):
+        """生成并缓存某只股票自 FIRST_DAY 起的完整不复权K线与复权因子"""
+        with self._series_lock:
+            series = self._series.get(symbol)
+            if series is not None:
+                self._series.move_to_end(symbol)
+                return series
+        rng = np.random.default_rng(zlib.crc32(symbol.encode()))
+        dates = self._business_days(market_now().date())
+        n = len(dates)
+        # 每约 250 个交易日分红一次，除权日价格下跳、后复权因子上升
+        factor = np.cumprod(np.where(np.arange(n) % 250 == 249, 1.02, 1.0))
+        adj_close = 10 * np.exp(np.cumsum(rng.normal(0.0003, 0.02, n)))
+        close = np.round(adj_close / factor, 2)
+        open_ = np.round(close * (1 + rng.normal(0, 0.006, n)), 2)
+        high = np.round(np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.008, n))), 2)
+        low = np.round(np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.008, n))), 2)
+        volume = rng.integers(20_000, 2_000_000, n)
+        series = {
+            "dates": dates, "open": open_, "high": high, "low": low, "close": close,
+            "volume": volume, "amount": np.round(volume * close * 100, 0),
+            "turnover": np.round(rng.uniform(0.1, 5, n), 2), "factor": factor,
+        }
+        with self._series_lock:
+            self._series[symbol] = series
+            while len(self._series) > self.SERIES_CACHE_SIZE:
+                self._series.popitem(last=False)
+        return series
+
+    def fetch_hist(self, symbol, start, end, adjust):
+        self._simulate_call()
+        recorded = self._recorded(f"{symbol}_{adjust}.parquet")
+        if recorded is not None:
+            dates = pd.to_datetime(recorded['日期'])
+            return recorded[(dates >= pd.Timestamp(start)) & (dates <= pd.Timestamp(end))].reset_index(drop=True)
+        if not re.fullmatch(r"\d{6}", symbol):
+            raise ValueError(f"replay: 无效代码 {symbol}")
+
+        s = self._synthetic(symbol)
+        if adjust == "hfq":
+            scale = s["factor"]
+        elif adjust == "qfq":
+            scale = s["factor"] / s["factor"][-1]
+        else:
+            scale = np.ones_like(s["factor"])
+        # 先定位区间再计算，只处理请求范围内的K线 (多取一根用于昨收)
+        lo = np.searchsorted(s["dates"], np.datetime64(start, 'D'))
+        hi = np.searchsorted(s["dates"], np.datetime64(end, 'D'), side='right')
+        first = max(lo - 1, 0)
+        window = slice(first, hi)
+        factor, scale = s["factor"][window], scale[window]
+        close = np.round(s["close"][window] * scale, 2)
+        # 除权日的昨收按除权比例调整 (与交易所公布的前收盘一致)，复权序列上比例为 1
+        ratio = (factor[:-1] / factor[1:]) * (scale[1:] / scale[:-1])
+        prev_close = np.round(np.r_[close[0], close[:-1] * ratio], 2)
+        high = np.round(s["high"][window] * scale, 2)
+        low = np.round(s["low"][window] * scale, 2)
+        df = pd.DataFrame({
+            '日期': s["dates"][window].astype(object),
+            '股票代码': symbol,
+            '开盘': np.round(s["open"][window] * scale, 2),
+            '收盘': close,
+            '最高': high,
+            '最低': low,
+            '成交量': s["volume"][window],
+            '成交额': s["amount"][window],
+            '振幅': np.round((high - low) / prev_close * 100, 2),
+            '涨跌幅': np.round((close / prev_close - 1) * 100, 2),
+            '涨跌额': np.round(close - prev_close, 2),
+            '换手率': s["turnover"][window],
+        })
+        return df.iloc[lo - first:].reset_index(drop=True)
+
+    def fetch_adjust_factors(self, symbol):
+        self._simulate_call()
+        recorded = self._recorded(f"{symbol}_factor.csv")
+        if recorded is not None:
+            return recorded
+        if self.record_dir and os.path.exists(os.path.join(self.record_dir, f"{symbol}_None.parquet")):
+            # 录制了不复权K线却没有因子，只能按复权方式分别回放
+            return None
+        if not re.fullmatch(r"\d{6}", symbol):
+            raise ValueError(f"replay: 无效代码 {symbol}")
+        s = self._synthetic(symbol)
+        changed = np.flatnonzero(np.diff(s["factor"], prepend=0.0))
+        return pd.DataFrame({'date': s["dates"][changed].astype(object), 'hfq_factor': s["factor"][changed]})
+
+    def _synthetic_minutes(self, symbol, s, i):
+        """把第 i 根合成日线拆成 1 分钟K线：从开盘价出发的布朗桥，收于当日收盘价"""
+        day = s["dates"][i].astype(object)
+        rng = np.random.default_rng(zlib.crc32(f"{symbol}{day}".encode()))
+        n = SESSION_MINUTES
+        walk = np.cumsum(rng.normal(0, 1, n))
+        bridge = walk - np.linspace(1 / n, 1, n) * walk[-1]
+        spread = (s["high"][i] - s["low"][i]) / 4 / max(np.abs(bridge).max(), 1e-9)
+        path = s["open"][i] + (s["close"][i] - s["open"][i]) * np.linspace(1 / n, 1, n) + bridge * spread
+        close = np.round(np.clip(path, s["low"][i], s["high"][i]), 2)
+        open_ = np.r_[s["open"][i], close[:-1]]
+        noise = np.abs(rng.normal(0, 0.0005, (2, n)))
+        high = np.round(np.minimum(np.maximum(open_, close) * (1 + noise[0]), s["high"][i]), 2)
+        low = np.round(np.maximum(np.minimum(open_, close) * (1 - noise[1]), s["low"][i]), 2)
+        weights = rng.gamma(2.0, size=n)
+        volume = np.round(s["volume"][i] * weights / weights.sum())
+        return pd.DataFrame({
+            '时间': session_minutes(day).astype('datetime64[ns]'),
+            '开盘': open_, '收盘': close, '最高': high, '最低': low,
+            '成交量': volume, '成交额': np.round(volume * close * 100, 0),
+        })
+
+    def fetch_minute(self, symbol, start, end):
+        """合成日线拆分出的分钟K线，回放“今天”时只返回已走完的时刻"""
+        self._simulate_call()
+        if not re.fullmatch(r"\d{6}", symbol):
+            raise ValueError(f"replay: 无效代码 {symbol}")
+        s = self._synthetic(symbol)
+        lo = np.searchsorted(s["dates"], np.datetime64(start.date(), 'D'))
+        hi = np.searchsorted(s["dates"], np.datetime64(end.date(), 'D'), side='right')
+        if lo >= hi:
+            return pd.DataFrame(columns=['时间', '开盘', '收盘', '最高', '最低', '成交量', '成交额'])
+        df = pd.concat([self._synthetic_minutes(symbol, s, i) for i in range(lo, hi)], ignore_index=True)
+        until = min(pd.Timestamp(end), pd.Timestamp(market_now().replace(tzinfo=None)))
+        return df[(df['时间'] >= pd.Timestamp(start)) & (df['时间'] <= until)].reset_index(drop=True)
+
+    def fetch_info(self, symbol):
+        self._simulate_call()
+        recorded = self._recorded(f"{symbol}_info.csv")
+        if recorded is not None:
+            return recorded
+        if not re.fullmatch(r"\d{6}", symbol):
+            raise ValueError(f"replay: 无效代码 {symbol}")
+        s = self._synthetic(symbol)
+        shares = float(zlib.crc32(symbol.encode()) % 9000 + 1000) * 1e6
+        return pd.DataFrame({
+            'item': ['最新', '股票代码', '股票简称', '总股本', '流通股本', '总市值', '流通市值', '行业', '上市时间'],
+            'value': [s["close"][-1], symbol, f"回放{symbol}", shares, shares * 0.8,
+                      shares * s["close"][-1], shares * 0.8 * s["close"][-1], '回放行业', 19910102],
+        })
+
+    # 合成代码表覆盖的号段：(前缀, 起始序号, 结束序号)
+    SYNTHETIC_BOARDS = [("000", 1, 999), ("002", 1, 999), ("300", 1, 999),
+                        ("600", 0, 999), ("601", 0, 999), ("603", 0, 999), ("688", 1, 599)]
+
+    def fetch_symbols(self):
+        self._simulate_call()
+        recorded = self._recorded("symbols.csv")
+        if recorded is not None:
+            return recorded
+        codes = [f"{prefix}{i:03d}" for prefix, lo, hi in self.SYNTHETIC_BOARDS for i in range(lo, hi + 1)]
+        return pd.DataFrame({'code': codes, 'name': [f"回放{code}" for code in codes]})
+
+    def fetch_spot(self):
+        """以合成代码表中每只股票最后一根不复权K线作为当日快照"""
+        self._simulate_call()
+        recorded = self._recorded("spot.csv")
+        if recorded is not None:
+            return recorded
+        rows = []
+        for code in self.fetch_symbols()['code']:
+            s = self._synthetic(code)
+            # 除权日的昨收按除权比例调整，与 fetch_hist 的昨收口径一致
+            prev = round(s["close"][-2] * s["factor"][-2] / s["factor"][-1], 2)
+            rows.append((code, f"回放{code}", s["close"][-1], s["open"][-1], s["high"][-1], s["low"][-1],
+                         s["volume"][-1], s["amount"][-1], s["turnover"][-1],
+                         round((s["close"][-1] / prev - 1) * 100, 2), prev))
+        return pd.DataFrame(rows, columns=['代码', '名称', '最新价', '今开', '最高', '最低',
+                                           '成交量', '成交额', '换手率', '涨跌幅', '昨收'])
+
+def record_replay_data(symbols, start, end, out_dir, adjusts=("qfq", "hfq", "None"), source=None):
+    """把实盘数据录制为 ReplaySource 可读取的文件"""
+    source = source or AkshareSource()
+    os.makedirs(out_dir, exist_ok=True)
+    for symbol in symbols:
+        for adjust in adjusts:
+            source.fetch_hist(symbol, start, end, adjust).to_parquet(
+                os.path.join(out_dir, f"{symbol}_{adjust}.parquet"), index=False)
+        factors = source.fetch_adjust_factors(symbol)
+        if factors is not None:
+            factors.to_csv(os.path.join(out_dir, f"{symbol}_factor.csv"), index=False)
+        source.fetch_info(symbol).to_csv(os.path.join(out_dir, f"{symbol}_info.csv"), index=False)
+    source.fetch_symbols().to_csv(os.path.join(out_dir, "symbols.csv"), index=False)
+
+def make_data_source(name=None):
+    """按名称 (或环境变量 STOCK_APP_DATA_SOURCE) 创建数据源
+
+    回放模式的参数：STOCK_APP_REPLAY_DIR、STOCK_APP_REPLAY_LATENCY、
+    STOCK_APP_REPLAY_JITTER、STOCK_APP_REPLAY_ERROR_RATE、STOCK_APP_REPLAY_SEED。
+    """
+    name = name or os.environ.get("STOCK_APP_DATA_SOURCE", "akshare")
+    if name == "replay":
+        env = os.environ.get
+        return ReplaySource(
+            record_dir=env("STOCK_APP_REPLAY_DIR"),
+            latency=float(env("STOCK_APP_REPLAY_LATENCY", "0")),
+            jitter=float(env("STOCK_APP_REPLAY_JITTER", "0")),
+            error_rate=float(env("STOCK_APP_REPLAY_ERROR_RATE", "0")),
+            seed=int(env("STOCK_APP_REPLAY_SEED", "0")),
+        )
+    if name == "akshare":
+        return AkshareSource()
+    raise ValueError(f"未知数据源: {name}")
+
+@st.cache_resource
+def get_data_source():
+    """进程内共享的数据源"""
+    return make_data_source()
+
+# ---------------------------------------------------------
+# 2.4 异步上游请求层 (超时 / 退避重试 / 熔断)
+# ---------------------------------------------------------
+# 单次上游调用的超时 (秒)
+UPSTREAM_TIMEOUTS = {"hist": 20.0, "info": 10.0, "factors": 20.0, "minute": 10.0, "symbols": 60.0, "spot": 60.0,
+                     "backfill": 20.0}
+# 每次请求最多尝试的次数 (含首次)
+UPSTREAM_ATTEMPTS = 3
+# 指数退避的基数与上限 (秒)，实际等待时间在 [0, 上限] 内随机抖动
+UPSTREAM_BACKOFF_BASE = 0.5
+UPSTREAM_BACKOFF_MAX = 8.0
+# 连续失败多少次后熔断，熔断后多久放行一次试探请求 (秒)
+BREAKER_THRESHOLD = 5
+BREAKER_COOLDOWN = 30.0
+UPSTREAM_MAX_WORKERS = 16
+
+class UpstreamError(Exception):
+    """上游请求最终失败 (重试耗尽或超时)"""
+
+class CircuitOpenError(UpstreamError):
+    """端点处于熔断状态，请求未发出"""
+
+class UpstreamRejectedError(UpstreamError):
+    """上游有响应但结果不可用 (参数或数据错误)，重试无益，不计入熔断"""
+
+def is_transient_error(exc):
+    """超时、连接错误与 5xx 响应视为临时故障，值得重试并计入熔断
+
+    其余 OSError (文件不存在、无权限等本地错误) 与 4xx 响应重试也不会成功，不算临时故障。
+    """
+    if isinstance(exc, urllib.error.HTTPError):
+        return exc.code >= 500
+    if isinstance(exc, requests.HTTPError):
+        status = getattr(exc.response, "status_code", None)
+        return isinstance(status, int) and status >= 500
+    # 没有响应码的 URLError 是 DNS、连接被拒等网络层失败
+    return isinstance(exc, (TimeoutError, ConnectionError, urllib.error.URLError,
+                            requests.ConnectionError, requests.Timeout))
+
+class CircuitBreaker:
+    """按端点统计连续失败的熔断器：closed → open → half-open → closed"""
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        """是否放行本次请求；冷却结束后只放行一个试探请求"""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, ok):
+        with self._lock:
+            self._probing = False
+            if ok:
+                self.failures = 0
+                self.opened_at = None
+                return
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+class AsyncUpstream:
+    """在后台事件循环上执行阻塞的数据源调用
+
+    阻塞调用放进线程池 (run_in_executor)，由事件循环负责超时、带抖动的
+    指数退避重试和按端点熔断。超时只是不再等待结果，线程本身无法中断，
+    会在上游返回后自行释放。
+    """
+
+    def __init__(self, max_workers=UPSTREAM_MAX_WORKERS):
+        self.counters = collections.Counter()
+        self._breakers = collections.defaultdict(CircuitBreaker)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="upstream")
+        # 页面侧的并发任务 (如同时获取基本面与行情) 使用独立线程池，
+        # 避免任务等待上游结果时占满上游线程而互相等待
+        self._tasks = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fetch-task")
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="upstream-loop").start()
+
+    def breaker(self, endpoint):
+        return self._breakers[endpoint]
+
+    async def call(self, endpoint, func, *args, limiter=None):
+        """带限速、超时、重试与熔断地执行 func(*args)，最终失败时抛出 UpstreamError
+
+        每次尝试 (包括重试) 先等到 limiter 的令牌再开始计时，排队时间不算作超时。
+        只有临时故障 (is_transient_error) 会重试并计入熔断；参数或数据错误
+        直接以 UpstreamRejectedError 抛出。
+        """
+        breaker = self.breaker(endpoint)
+        timeout = UPSTREAM_TIMEOUTS.get(endpoint, 15.0)
+        last_error = None
+        for attempt in range(UPSTREAM_ATTEMPTS):
+            if not breaker.allow():
+                self.counters['rejected'] += 1
+                raise CircuitOpenError(f"{endpoint} 接口熔断中，稍后重试") from last_error
+            if limiter is not None:
+                await limiter.acquire_async()
+            try:
+                result = await asyncio.wait_for(
+                    self.loop.run_in_executor(self._executor, func, *args), timeout
+                )
+            except asyncio.TimeoutError:
+                self.counters['timeouts'] += 1
+                last_error = TimeoutError(f"{endpoint} 接口 {timeout:g} 秒未响应")
+            except Exception as exc:
+                if not is_transient_error(exc):
+                    # 上游已经响应，熔断器按成功处理 (同时结束半开状态的试探)
+                    breaker.record(True)
+                    self.counters['invalid'] += 1
+                    raise UpstreamRejectedError(f"{endpoint} 接口返回错误: {exc}") from exc
+                self.counters['failures'] += 1
+                last_error = exc
+            else:
+                breaker.record(True)
+                self.counters['successes'] += 1
+                return result
+            breaker.record(False)
+            if attempt + 1 < UPSTREAM_ATTEMPTS:
+                self.counters['retries'] += 1
+                cap = min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, cap))
+        raise UpstreamError(f"{endpoint} 接口请求失败: {last_error}") from last_error
+
+    def run(self, endpoint, func, *args, limiter=None):
+        """在调用线程中阻塞等待 call 的结果"""
+        return asyncio.run_coroutine_threadsafe(self.call(endpoint, func, *args, limiter=limiter),
+                                                self.loop).result()
+
+    def submit(self, func, *args):
+        """在后台线程执行 func (携带当前会话上下文)，返回 concurrent.futures.Future
+
+        线程池的线程会被其他会话的任务复用，任务结束后恢复线程原有的上下文，
+        不让已结束的会话留在线程上。
+        """
+        ctx = get_script_run_ctx()
+        def task():
+            thread = threading.current_thread()
+            previous = getattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, None)
+            add_script_run_ctx(thread, ctx)
+            try:
+                return func(*args)
+            finally:
+                # add_script_run_ctx 传入 None 时不会清除属性，只能直接删除
+                if previous is not None:
+                    setattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME, previous)
+                elif hasattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME):
+                    delattr(thread, SCRIPT_RUN_CONTEXT_ATTR_NAME)
+        return self._tasks.submit(task)
+
+    def open_endpoints(self):
+        return sorted(e for e, b in self._breakers.items() if b.state != "closed")
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update({f"breaker_open.{e}": int(b.state != "closed") for e, b in self._breakers.items()})
+        return stats
+
+@st.cache_resource
+def get_upstream():
+    """进程内共享的异步上游请求层"""
+    return AsyncUpstream()
+
+def call_upstream(endpoint, source, func, *args):
+    """经限速、超时、重试与熔断调用数据源方法"""
+    limiter = get_rate_limiter(endpoint) if source.rate_limited else None
+    with timed(f"upstream.{endpoint}"):
+        return get_upstream().run(endpoint, func, *args, limiter=limiter)
+
+def submit_symbol_data(symbol, start, end, adjust):
+    """同时发出单只股票的基本面与历史行情请求，返回 (info_future, hist_future)
+
+    页面先等行情渲染图表与指标，基本面到达后再填充对应占位。
+    """
+    upstream = get_upstream()
+    info_future = upstream.submit(get_base_info, symbol)
+    hist_future = upstream.submit(get_hist_data, symbol, start, end, adjust)
+    return info_future, hist_future
+
+# ---------------------------------------------------------
+# 2.5 证券代码目录 (本地缓存 + 前缀检索，代码校验不再触达上游)
+# ---------------------------------------------------------
+# 目录刷新周期 (秒)，本地缓存文件超过该时长视为过期
+SYMBOL_DIRECTORY_TTL = 86400
+SYMBOL_DIRECTORY_PATH = os.path.join(DATA_DIR, "symbols.parquet")
+
+def name_initials(name):
+    """证券简称的拼音首字母 (小写)"""
+    return "".join(lazy_pinyin(name, style=PinyinStyle.FIRST_LETTER)).lower().replace(" ", "")
+
+class SymbolDirectory:
+    """A 股代码表及其前缀索引
+
+    代码、简称、拼音首字母统一放进一个排好序的 (检索键, 行号) 列表，
+    前缀查询用两次二分定位区间，耗时为微秒级。
+    """
+
+    def __init__(self, frame):
+        self.codes = frame['code'].astype(str).str.zfill(6).tolist()
+        self.names = frame['name'].astype(str).str.replace(" ", "").tolist()
+        self._by_code = dict(zip(self.codes, range(len(self.codes))))
+        entries = []
+        for i, (code, name) in enumerate(zip(self.codes, self.names)):
+            entries.append((code, i))
+            entries.append((name.lower(), i))
+            initials = name_initials(name)
+            if initials:
+                entries.append((initials, i))
+        entries.sort()
+        self._keys = [key for key, _ in entries]
+        self._rows = [row for _, row in entries]
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self._by_code
+
+    def name(self, code):
+        row = self._by_code.get(code)
+        return None if row is None else self.names[row]
+
+    def search(self, query, limit=20):
+        """按代码/简称/拼音首字母前缀检索，返回 [(代码, 简称)]，代码完全匹配的排在最前"""
+        query = query.strip().lower().replace(" ", "")
+        if not query:
+            return []
+        lo = bisect.bisect_left(self._keys, query)
+        hi = bisect.bisect_left(self._keys, query + "￿", lo)
+        rows = []
+        if query in self._by_code:
+            rows.append(self._by_code[query])
+        for row in self._rows[lo:hi]:
+            if row not in rows:
+                rows.append(row)
+                if len(rows) >= limit:
+                    break
+        return [(self.codes[row], self.names[row]) for row in rows]
+
+class SymbolDirectoryService:
+    """持有当前代码目录：启动时读取本地缓存，过期后在后台线程按天刷新
+
+    上游与本地缓存都不可用时 directory 为 None，校验退化为只检查格式。
+    """
+
+    def __init__(self, path=SYMBOL_DIRECTORY_PATH, ttl=SYMBOL_DIRECTORY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.directory = None
+        self.updated_at = None
+        self.counters = collections.Counter()
+        self._load_local()
+        threading.Thread(target=self._run, daemon=True, name="symbol-directory").start()
+
+    def _load_local(self):
+        try:
+            frame = pd.read_parquet(self.path)
+            self.updated_at = os.path.getmtime(self.path)
+        except (OSError, ValueError):
+            return
+        self.directory = SymbolDirectory(frame)
+
+    def refresh(self):
+        """从数据源拉取代码表，成功后原子替换本地缓存与内存索引"""
+        source = get_data_source()
+        frame = call_upstream("symbols", source, source.fetch_symbols)
+        if frame is None or frame.empty:
+            return False
+        frame = frame[['code', 'name']].astype(str)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        frame.to_parquet(self.path + ".tmp", index=False)
+        os.replace(self.path + ".tmp", self.path)
+        self.directory = SymbolDirectory(frame)
+        self.updated_at = time.time()
+        self.counters['refreshes'] += 1
+        return True
+
+    def _run(self):
+        while True:
+            age = time.time() - self.updated_at if self.updated_at else float("inf")
+            if age >= self.ttl:
+                try:
+                    self.refresh()
+                except Exception:
+                    self.counters['errors'] += 1
+                # 失败时一小时后重试，成功后等到下一个刷新周期
+                age = time.time() - self.updated_at if self.updated_at else self.ttl - 3600
+            time.sleep(max(self.ttl - age, 60))
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['symbols'] = len(self.directory) if self.directory else 0
+        return stats
+
+@st.cache_resource
+def get_symbol_directory():
+    """进程内共享的证券代码目录"""
+    return SymbolDirectoryService()
+
+def validate_symbol(symbol):
+    """本地校验证券代码：格式必须为6位数字，目录可用时还须存在于目录中"""
+    if not re.fullmatch(r"\d{6}", symbol):
+        return False
+    directory = get_symbol_directory().directory
+    return directory is None or symbol in directory
+
+# ---------------------------------------------------------
+# 2.6 全市场日线面板 (日期×代码 宽表，收盘后增量追加)
+# ---------------------------------------------------------
+# 面板字段：全市场快照列名 -> 面板字段名 (与日线行情列名一致)
+SPOT_FIELDS = {'最新价': '收盘', '今开': '开盘', '最高': '最高', '最低': '最低',
+               '成交量': '成交量', '成交额': '成交额', '换手率': '换手率', '涨跌幅': '涨跌幅'}
+PANEL_FIELDS = list(SPOT_FIELDS.values())
+# 除权除息时随前复权缩放的面板字段
+PANEL_PRICE_FIELDS = ['收盘', '开盘', '最高', '最低']
+# 面板保留的交易日数，足够计算 MA120 等长周期条件
+PANEL_MAX_DAYS = 250
+PANEL_DIR = os.path.join(DATA_DIR, "panel")
+# 后台线程检查是否需要更新的间隔 (秒)
+PANEL_CHECK_INTERVAL = 600
+# 回填每完成一块 (只数) 落盘一次，中断重启后从已完成的块继续
+PANEL_BACKFILL_CHUNK = 100
+
+class MarketPanel:
+    """不可变的全市场面板快照：dates 为交易日列表，codes 为代码列表，
+    fields 为 {字段: 日期×代码 的 float32 数组}"""
+
+    def __init__(self, dates, codes, fields, names=None):
+        self.dates = list(dates)
+        self.codes = list(codes)
+        self.fields = fields
+        self.names = names or {}
+        self._indicators = None
+        self._lock = threading.Lock()
+
+    def indicators(self):
+        """全部技术指标 (compute_panel_indicators)，面板不可变，首次计算后复用"""
+        with self._lock:
+            if self._indicators is None:
+                self._indicators = compute_panel_indicators(self.fields['收盘'].astype(np.float64))
+            return self._indicators
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], {f: np.empty((0, 0), dtype=np.float32) for f in PANEL_FIELDS})
+
+    def __len__(self):
+        return len(self.dates)
+
+    @property
+    def nbytes(self):
+        return sum(arr.nbytes for arr in self.fields.values())
+
+    def append(self, day, frame, names=None):
+        """追加 (或覆盖) 一个交易日的截面，frame 以代码为索引、包含 PANEL_FIELDS 列"""
+        fields = {field: frame[field].to_numpy(dtype=np.float32)[None, :] for field in PANEL_FIELDS}
+        return self.extend(MarketPanel([day], list(frame.index), fields, names))
+
+    def extend(self, other):
+        """并入另一个面板的交易日 (相同日期以 other 为准)，保留最近 PANEL_MAX_DAYS 个交易日"""
+        codes = self.codes + sorted(set(other.codes) - set(self.codes))
+        replaced = set(other.dates)
+        keep = [i for i, d in enumerate(self.dates) if d not in replaced]
+        dates = [self.dates[i] for i in keep] + other.dates
+        columns = pd.Index(codes).get_indexer(other.codes)
+        fields = {}
+        for field in PANEL_FIELDS:
+            merged = np.full((len(dates), len(codes)), np.nan, dtype=np.float32)
+            merged[:len(keep), :len(self.codes)] = self.fields[field][keep]
+            merged[len(keep):, columns] = other.fields[field]
+            fields[field] = merged
+        order = np.argsort(np.array(dates, dtype='datetime64[D]'), kind='stable')[-PANEL_MAX_DAYS:]
+        fields = {f: arr[order] for f, arr in fields.items()}
+        return MarketPanel([dates[i] for i in order], codes, fields, {**self.names, **other.names})
+
+    def rescaled(self, ratios):
+        """按 {代码: 比例} 缩放各代码已有的价格字段 (除权除息后的前复权调整)"""
+        scale = pd.Series(ratios, dtype=float).reindex(self.codes).fillna(1.0).to_numpy(dtype=np.float32)
+        fields = {f: arr * scale if f in PANEL_PRICE_FIELDS else arr for f, arr in self.fields.items()}
+        return MarketPanel(self.dates, self.codes, fields, self.names)
+
+    def last_close(self):
+        """各代码最近一个有效收盘价 (停牌日沿用之前的收盘)"""
+        return pd.DataFrame(self.fields['收盘'], columns=self.codes).ffill().iloc[-1] \
+            if len(self) else pd.Series(dtype=np.float32)
+
+    @classmethod
+    def from_frames(cls, frames, names=None):
+        """由 {代码: 日线 DataFrame} 构建面板 (回填历史时使用)"""
+        long = pd.concat(
+            [df.assign(代码=code) for code, df in frames.items() if df is not None and not df.empty],
+            ignore_index=True
+        )
+        if long.empty:
+            return cls.empty()
+        long['日期'] = pd.to_datetime(long['日期']).dt.date
+        dates = sorted(long['日期'].unique())[-PANEL_MAX_DAYS:]
+        long = long[long['日期'].isin(dates)]
+        codes = sorted(long['代码'].unique())
+        fields = {
+            field: long.pivot_table(index='日期', columns='代码', values=field, aggfunc='last')
+                       .reindex(index=dates, columns=codes).to_numpy(dtype=np.float32)
+            for field in PANEL_FIELDS
+        }
+        return cls(dates, codes, fields, names)
+
+    def save(self, root):
+        os.makedirs(root, exist_ok=True)
+        for field, arr in self.fields.items():
+            path = os.path.join(root, f"{PANEL_FIELDS.index(field)}.npy")
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, arr)
+            os.replace(path + ".tmp", path)
+        meta_path = os.path.join(root, "meta.json")
+        with open(meta_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dates": [d.isoformat() for d in self.dates], "codes": self.codes,
+                       "fields": PANEL_FIELDS, "names": self.names}, f, ensure_ascii=False)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    @classmethod
+    def load(cls, root):
+        """读取本地面板，不存在或字段不一致时返回 None"""
+        try:
+            with open(os.path.join(root, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta["fields"] != PANEL_FIELDS:
+                return None
+            fields = {field: np.load(os.path.join(root, f"{i}.npy")) for i, field in enumerate(PANEL_FIELDS)}
+        except (OSError, ValueError, KeyError):
+            return None
+        dates = [datetime.date.fromisoformat(d) for d in meta["dates"]]
+        return cls(dates, meta["codes"], fields, meta.get("names", {}))
+
+def spot_to_frame(spot):
+    """全市场快照 -> 以代码为索引、含 PANEL_FIELDS 与昨收的截面，以及 {代码: 简称}"""
+    spot = spot.rename(columns=SPOT_FIELDS)
+    spot['代码'] = spot['代码'].astype(str).str.zfill(6)
+    columns = PANEL_FIELDS + ['昨收'] if '昨收' in spot else PANEL_FIELDS
+    frame = spot.set_index('代码')[columns].apply(pd.to_numeric, errors='coerce')
+    names = dict(zip(spot['代码'], spot['名称'].astype(str))) if '名称' in spot else {}
+    return frame[~frame.index.duplicated()], names
+
+class MarketPanelService:
+    """维护全市场面板 (前复权)：首次启动时逐只回填近 PANEL_MAX_DAYS 个交易日，
+    之后每个交易日收盘落定后用一次全市场快照追加当天截面
+
+    快照的昨收与面板最近收盘不一致即为除权除息，该代码此前的价格按比例
+    整体缩放，面板始终保持前复权，均线、突破等条件不会在除权日误触发。
+    服务停机错过的交易日按交易日历找出，逐只补齐这段区间。
+    """
+
+    def __init__(self, root=PANEL_DIR):
+        self.root = root
+        self.panel = MarketPanel.load(root) or MarketPanel.empty()
+        self.counters = collections.Counter()
+        self.backfill_progress = None
+        # 已确认补齐到的交易日：日历退化为按工作日判断时，节假日不会被反复当作缺失
+        self._filled_through = None
+        self._wake = threading.Event()
+        threading.Thread(target=self._run, daemon=True, name="market-panel").start()
+
+    def request_update(self):
+        """立即检查一次是否需要回填或追加"""
+        self._wake.set()
+
+    def _backfill(self, since=None):
+        """逐只拉取前复权日线构建面板；since 为面板最后一个交易日时只补齐其后缺失的交易日"""
+        source = get_data_source()
+        spot, names = spot_to_frame(call_upstream("spot", source, source.fetch_spot))
+        # 盘中回填不含当天未收盘的K线，当天截面留给收盘后的追加
+        end = self._settled_through(market_now())
+        staging = os.path.join(self.root, "backfill")
+        plan = self._backfill_plan(staging, end, since)
+        if plan is None:
+            # 补齐时从面板最后一天取起，用重叠的一天检测期间的除权除息；
+            # 全量回填按自然日估算起点，多取一些以覆盖节假日
+            start = since or end - datetime.timedelta(days=int(PANEL_MAX_DAYS * 1.5) + 10)
+            plan = {"start": start.isoformat(), "end": end.isoformat(), "codes": list(spot.index),
+                    "since": since and since.isoformat()}
+            shutil.rmtree(staging, ignore_errors=True)
+            os.makedirs(staging)
+            with open(os.path.join(staging, "plan.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump(plan, f)
+            os.replace(os.path.join(staging, "plan.json.tmp"), os.path.join(staging, "plan.json"))
+        start = datetime.date.fromisoformat(plan["start"])
+        codes = plan["codes"]
+        frames = {}
+        self.backfill_progress = (0, len(codes))
+        for offset in range(0, len(codes), PANEL_BACKFILL_CHUNK):
+            path = os.path.join(staging, f"{offset // PANEL_BACKFILL_CHUNK:05d}.parquet")
+            if os.path.exists(path):
+                frames.update(self._read_chunk(path))
+                self.counters['backfill_resumed'] += 1
+            else:
+                chunk = {}
+                for i, code in enumerate(codes[offset:offset + PANEL_BACKFILL_CHUNK], offset + 1):
+                    try:
+                        chunk[code] = fetch_hist_upstream(code, start, end, "qfq", endpoint="backfill")
+                    except Exception:
+                        # 单只失败不影响整体回填，面板中缺少该代码
+                        self.counters['backfill_errors'] += 1
+                        logger.warning("全市场回填 %s 失败", code, exc_info=True)
+                    self.backfill_progress = (i, len(codes))
+                self._write_chunk(path, chunk)
+                frames.update(chunk)
+            self.backfill_progress = (min(offset + PANEL_BACKFILL_CHUNK, len(codes)), len(codes))
+        fetched = MarketPanel.from_frames(frames, names)
+        if since is None:
+            panel = fetched
+        else:
+            # 重叠日的前复权收盘与面板不一致，说明期间发生了除权除息
+            ratios = {}
+            if since in fetched.dates:
+                overlap = fetched.fields['收盘'][fetched.dates.index(since)]
+                ratios = self._ex_rights(pd.Series(overlap, index=fetched.codes))
+            panel = self.panel.rescaled(ratios).extend(fetched)
+            self.counters['gap_fills'] += 1
+        panel.save(self.root)
+        panel.indicators()
+        self.panel = panel
+        self._filled_through = end
+        shutil.rmtree(staging, ignore_errors=True)
+        self.backfill_progress = None
+        self.counters['backfills'] += 1
+
+    @staticmethod
+    def _backfill_plan(staging, end, since):
+        """读取未完成的回填计划，截止日 (跨过了交易日) 或补齐起点不同时作废"""
+        try:
+            with open(os.path.join(staging, "plan.json"), encoding="utf-8") as f:
+                plan = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if plan.get("end") != end.isoformat() or plan.get("since") != (since and since.isoformat()):
+            return None
+        return plan
+
+    def _ex_rights(self, reference):
+        """reference 为新数据中各代码的上一收盘 (快照昨收或重叠日的前复权收盘)
+
+        与面板最近收盘相差超过舍入误差的代码发生了除权除息，返回 {代码: 缩放比例}。
+        """
+        last = self.panel.last_close()
+        reference = reference.reindex(last.index).astype(float)
+        changed = np.abs(reference - last) > EX_RIGHTS_TOLERANCE
+        return (reference / last)[changed]
+
+    @staticmethod
+    def _write_chunk(path, frames):
+        long = pd.concat([df.assign(代码=code) for code, df in frames.items() if df is not None and not df.empty]
+                         or [pd.DataFrame({'代码': pd.Series(dtype=str)})], ignore_index=True)
+        long.to_parquet(path + ".tmp", index=False)
+        os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def _read_chunk(path):
+        long = pd.read_parquet(path)
+        return {code: df.drop(columns='代码') for code, df in long.groupby('代码')}
+
+    def _append_today(self):
+        source = get_data_source()
+        frame, names = spot_to_frame(call_upstream("spot", source, source.fetch_spot))
+        panel = self.panel
+        if '昨收' in frame:
+            ratios = self._ex_rights(frame['昨收'])
+            panel = panel.rescaled(ratios)
+            self.counters['ex_rights'] += len(ratios)
+        panel = panel.append(market_now().date(), frame, names)
+        panel.save(self.root)
+        panel.indicators()
+        self.panel = panel
+        self.counters['appends'] += 1
+
+    @staticmethod
+    def _settled(now):
+        """今天是交易日且已收盘落定"""
+        close = datetime.datetime.combine(now.date(), TRADING_SESSIONS[-1][1], MARKET_TZ) + MARKET_SETTLE
+        return is_trading_day(now.date()) and now >= close
+
+    def _settled_through(self, now):
+        """最近一个已收盘落定的日期 (今天收盘前为昨天)"""
+        return now.date() if self._settled(now) else now.date() - datetime.timedelta(days=1)
+
+    def _missing_days(self, now):
+        """面板最后一个交易日之后、已收盘落定的交易日 (含服务停机期间错过的)"""
+        end = self._settled_through(now)
+        day = max(self.panel.dates[-1], self._filled_through or self.panel.dates[-1])
+        missing = []
+        while (day := next_trading_day(day)) <= end:
+            missing.append(day)
+        return missing
+
+    def _run(self):
+        # 预先计算指标，首次筛选无需等待
+        self.panel.indicators()
+        while True:
+            try:
+                now = market_now()
+                missing = self._missing_days(now) if len(self.panel) else None
+                if not len(self.panel) or len(missing) >= PANEL_MAX_DAYS:
+                    self._backfill()
+                elif missing == [now.date()]:
+                    # 只缺今天：一次全市场快照即可
+                    self._append_today()
+                elif missing:
+                    self._backfill(since=self.panel.dates[-1])
+            except Exception:
+                self.counters['errors'] += 1
+                logger.exception("全市场面板更新失败")
+            self._wake.wait(timeout=PANEL_CHECK_INTERVAL)
+            self._wake.clear()
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(days=len(self.panel), codes=len(self.panel.codes), bytes=self.panel.nbytes)
+        return stats
+
+@st.cache_resource
+def get_market_panel_handle():
+    """全市场面板服务的进程级句柄，服务创建后写入 "service"
+
+    创建服务会启动全市场回填，监控等只读场景通过句柄查看已存在的实例，不触发创建。
+    """
+    return {}
+
+@st.cache_resource
+def get_market_panel():
+    """进程内共享的全市场面板服务"""
+    service = MarketPanelService()
+    get_market_panel_handle()["service"] = service
+    return service
+
+# ---------------------------------------------------------
+# 2.7 复权因子 (只存不复权K线，前/后复权在本地派生)
+# ---------------------------------------------------------
+RAW_ADJUST = "None"
+# 随复权缩放的价格字段；涨跌幅、振幅、换手率与成交量不受复权影响
+ADJUST_PRICE_COLS = ['开盘', '收盘', '最高', '最低', '涨跌额']
+# 昨收与前一日收盘相差超过该值 (元) 视为除权除息，容忍两位小数的舍入误差
+EX_RIGHTS_TOLERANCE = 0.015
+
+def factor_at(factors, dates):
+    """按除权日阶梯取各日期适用的后复权因子，首个除权日之前为 1"""
+    ex_dates, values = factors
+    idx = np.searchsorted(ex_dates, dates, side='right')
+    return np.r_[1.0, values][idx]
+
+def ex_rights_events(df):
+    """从不复权K线中找出除权除息日：当日昨收 (收盘 - 涨跌额) 与前一日收盘不一致
+
+    返回 (除权日, 前一日收盘 / 当日昨收)，后者即该日后复权因子的增长比例。
+    """
+    close = df['收盘'].to_numpy(dtype=float)
+    preclose = close[1:] - df['涨跌额'].to_numpy(dtype=float)[1:]
+    is_event = np.abs(preclose - close[:-1]) > EX_RIGHTS_TOLERANCE
+    dates = df['日期'].to_numpy(dtype='datetime64[D]')[1:]
+    return dates[is_event], close[:-1][is_event] / preclose[is_event]
+
+def backward_adjust(df, factors):
+    """不复权K线 × 各日后复权因子 → 后复权K线 (价格保留两位小数，去掉指标列)"""
+    df = expand_hist_frame(df.drop(columns=INDICATOR_COLUMNS, errors='ignore'))
+    scale = factor_at(factors, df['日期'].to_numpy(dtype='datetime64[D]'))
+    for col in ADJUST_PRICE_COLS:
+        if col in df:
+            df[col] = np.round(df[col].to_numpy(dtype=float) * scale, 2)
+    return compact_hist_frame(df)
+
+def forward_adjust(df, factors):
+    """后复权K线与指标整体除以最新因子 → 前复权，一次乘法，无需另建分区"""
+    if df is None or df.empty:
+        return df
+    df = expand_hist_frame(df)
+    scale = 1.0 / factor_at(factors, np.datetime64(market_now().date(), 'D'))
+    for col in ADJUST_PRICE_COLS:
+        if col in df:
+            df[col] = np.round(df[col].to_numpy(dtype=float) * scale, 2)
+    # 均线、EMA、标准差都是价格的线性函数，随价格同比例缩放；RSI 与缩放无关
+    for col in INDICATOR_COLUMNS:
+        if col in df and col != 'RSI':
+            df[col] = df[col].to_numpy(dtype=float) * scale
+    return compact_hist_frame(df)
+
+class AdjustFactorStore:
+    """后复权因子的本地缓存
+
+    每只股票的除权除息日与对应因子保存为 {代码}_factor.json。只有在不复权
+    K线中发现晚于已知最后一个除权日的除权事件时才向上游刷新；上游尚未收录
+    的事件，用当日昨收与前一日收盘之比推算因子接续，之后不再重复刷新。
+
+    fetcher(symbol) 返回 date / hfq_factor 两列，数据源不支持时返回 None。
+    """
+
+    def __init__(self, root, fetcher):
+        self.root = root
+        self.fetcher = fetcher
+        self._factors = {}
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self.counters = collections.Counter()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, symbol):
+        return os.path.join(self.root, f"{symbol}_factor.json")
+
+    def _lock(self, symbol):
+        with self._locks_guard:
+            return self._locks.setdefault(symbol, threading.Lock())
+
+    def _load(self, symbol):
+        try:
+            with open(self._path(symbol), encoding="utf-8") as f:
+                saved = json.load(f)
+            return (np.array(saved["dates"], dtype='datetime64[D]'),
+                    np.array(saved["factors"], dtype=float))
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, symbol, factors):
+        path = self._path(symbol)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"dates": factors[0].astype(str).tolist(), "factors": factors[1].tolist()}, f)
+        os.replace(path + ".tmp", path)
+
+    def _fetch(self, symbol):
+        raw = self.fetcher(symbol)
+        self.counters['fetches'] += 1
+        if raw is None:
+            return None
+        frame = (pd.DataFrame({'date': pd.to_datetime(raw['date']),
+                               'factor': pd.to_numeric(raw['hfq_factor'], errors='coerce')})
+                 .dropna().sort_values('date').drop_duplicates('date', keep='last'))
+        return frame['date'].to_numpy(dtype='datetime64[D]'), frame['factor'].to_numpy(dtype=float)
+
+    @staticmethod
+    def _pending(factors, events):
+        """events 中晚于已知最后一个除权日的事件"""
+        last = factors[0][-1] if len(factors[0]) else np.datetime64(0, 'D')
+        return events[0] > last
+
+    def get(self, symbol, events=None):
+        """返回 (除权日, 后复权因子) 两个数组，数据源不提供因子时返回 None
+
+        events 为 ex_rights_events 的结果，其中晚于已知最后一个除权日的事件
+        会触发一次刷新。
+        """
+        with self._lock(symbol):
+            factors = self._factors.get(symbol) or self._load(symbol)
+            if factors is None:
+                factors = self._fetch(symbol)
+                if factors is None:
+                    return None
+                self._save(symbol, factors)
+            if events is not None and self._pending(factors, events).any():
+                try:
+                    refreshed = self._fetch(symbol)
+                except UpstreamError:
+                    # 刷新失败时同样按K线推算接续，不让整段后复权K线失败
+                    refreshed = None
+                self.counters['refreshes'] += 1
+                if refreshed is not None:
+                    factors = refreshed
+                # 上游尚未收录的除权事件，按K线推算的比例接续因子
+                pending = self._pending(factors, events)
+                if pending.any():
+                    base = factors[1][-1] if len(factors[1]) else 1.0
+                    factors = (np.r_[factors[0], events[0][pending]],
+                               np.r_[factors[1], base * np.cumprod(events[1][pending])])
+                    self.counters['implied'] += int(pending.sum())
+                self._save(symbol, factors)
+            self._factors[symbol] = factors
+            return factors
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats['symbols'] = len(self._factors)
+        return stats
+
+def fetch_factors_upstream(symbol):
+    """从数据源拉取后复权因子 (不做任何缓存)"""
+    source = get_data_source()
+    return call_upstream("factors", source, source.fetch_adjust_factors, symbol)
+
+@st.cache_resource
+def get_factor_store():
+    """进程内共享的复权因子缓存"""
+    return AdjustFactorStore(DATA_DIR, fetch_factors_upstream)
+
+def fetch_hist_derived(symbol, start, end, adjust):
+    """K线归档的取数函数：不复权K线向上游请求，后复权K线由不复权K线与因子在本地派生
+
+    数据源不提供复权因子时退回按复权方式直接请求上游。
+    """
+    if adjust != "hfq":
+        return fetch_hist_upstream(symbol, start, end, adjust)
+    store = get_bar_store()
+    raw = store.get(symbol, start, end, RAW_ADJUST)
+    if raw is None or raw.empty:
+        return raw
+    # 带上归档中区间前一根K线，区间首日的除权事件也能被检测到
+    records = store.records(symbol, RAW_ADJUST)
+    i = np.searchsorted(records['日期'], np.datetime64(start, 'D'))
+    checked = expand_hist_frame(pd.concat([records_to_frame(records[max(i - 1, 0):i], symbol), raw],
+                                          ignore_index=True))
+    try:
+        factors = get_factor_store().get(symbol, ex_rights_events(checked))
+    except UpstreamError:
+        factors = None
+    if factors is None:
+        return fetch_hist_upstream(symbol, start, end, adjust)
+    return backward_adjust(raw, factors)
+
+def load_hist_bars(symbol, start, end, adjust):
+    """从本地归档读取日线与指标：前复权由后复权整体缩放得到，不单独占用分区
+
+    前复权以当日因子为基准，后复权归档先补到今天，区间之后的除权事件也会在
+    派生时刷新因子；因子不可用 (数据源不支持或上游失败) 时直接归档前复权K线。
+    """
+    store = get_bar_store()
+    if adjust != "qfq":
+        return store.get(symbol, start, end, adjust)
+    factor_store = get_factor_store()
+    try:
+        factors = factor_store.get(symbol)
+    except UpstreamError as exc:
+        logger.warning("复权因子不可用，%s 改为直接获取前复权K线: %s", symbol, exc)
+        factors = None
+    if factors is not None:
+        try:
+            df = store.get(symbol, start, max(end, market_now().date()), "hfq")
+        except UpstreamError:
+            # 补到今天失败时按已知因子缩放归档中的区间
+            df = store.get(symbol, start, end, "hfq")
+        # 派生后复权K线时可能刚刚刷新过因子，缩放前重新读取
+        return forward_adjust(slice_hist(df, start, end), factor_store.get(symbol))
+    return store.get(symbol, start, end, adjust)
+
+# ---------------------------------------------------------
+# 2.8 分时行情 (分钟K线环形缓冲，盘中增量合并为多周期)
+# ---------------------------------------------------------
+# 分时看板支持的周期 (分钟)；60 分钟K线按 A 股惯例止于 10:30 / 11:30 / 14:00 / 15:00
+INTRADAY_TIMEFRAMES = {"1分钟": 1, "5分钟": 5, "15分钟": 15, "30分钟": 30, "60分钟": 60}
+# 调度器与快照中代表分时行情的“复权方式”，分钟K线本身不复权
+INTRADAY_ADJUST = "minute"
+# 进程内最多同时保留的分时股票数
+INTRADAY_MAX_FEEDS = 64
+# 环形缓冲的记录格式，与日线的列名一致，图表与指标函数可直接复用
+MINUTE_DTYPE = np.dtype([('日期', '<M8[m]'), ('开盘', 'f8'), ('收盘', 'f8'), ('最高', 'f8'),
+                         ('最低', 'f8'), ('成交量', 'f8'), ('成交额', 'f8')])
+
+def _minute_of_day(t):
+    return t.hour * 60 + t.minute
+
+# 一个交易日的连续竞价分钟数 (240)
+SESSION_MINUTES = sum(_minute_of_day(c) - _minute_of_day(o) for o, c in TRADING_SESSIONS)
+
+def session_minute_index(ts):
+    """分钟K线 (记为结束时刻) 在交易日内的序号，从 0 起
+
+    09:30 的集合竞价并入首分钟，午间休市与收盘后的时刻归入相邻时段的边界。
+    """
+    m = _minute_of_day(ts)
+    offset = 0
+    for open_t, close_t in TRADING_SESSIONS:
+        o, c = _minute_of_day(open_t), _minute_of_day(close_t)
+        if m <= c:
+            return offset + min(max(m - o - 1, 0), c - o - 1)
+        offset += c - o
+    return offset - 1
+
+def session_minute_time(day, index):
+    """序号 → 该分钟K线的结束时刻"""
+    for open_t, close_t in TRADING_SESSIONS:
+        length = _minute_of_day(close_t) - _minute_of_day(open_t)
+        if index < length:
+            return datetime.datetime.combine(day, open_t) + datetime.timedelta(minutes=index + 1)
+        index -= length
+    return datetime.datetime.combine(day, TRADING_SESSIONS[-1][1])
+
+def session_minutes(day):
+    """某交易日全部 1 分钟K线的结束时刻 (datetime64[m])"""
+    base = np.datetime64(day, 'm')
+    return np.concatenate([base + np.arange(_minute_of_day(o) + 1, _minute_of_day(c) + 1)
+                           for o, c in TRADING_SESSIONS])
+
+def intraday_session_day(now=None):
+    """分时看板对应的交易日：交易日开盘后为当天，否则为上一个交易日"""
+    now = now or market_now()
+    day = now.date()
+    if is_trading_day(day) and now.time() >= TRADING_SESSIONS[0][0]:
+        return day
+    day -= datetime.timedelta(days=1)
+    while not is_trading_day(day):
+        day -= datetime.timedelta(days=1)
+    return day
+
+class MinuteRing:
+    """定长的K线环形缓冲 (结构化数组)，追加与修改最后一根都是 O(1)
+
+    写满后覆盖最早的记录，占用的内存只取决于容量。
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=MINUTE_DTYPE)
+        self.n = 0
+
+    def __len__(self):
+        return min(self.n, self.capacity)
+
+    def append(self, bar):
+        self.data[self.n % self.capacity] = bar
+        self.n += 1
+
+    def update_last(self, bar):
+        self.data[(self.n - 1) % self.capacity] = bar
+
+    def last(self):
+        return self.data[(self.n - 1) % self.capacity] if self.n else None
+
+    def view(self):
+        """按时间顺序排列的记录 (仅在绘图时复制一次)"""
+        if self.n <= self.capacity:
+            return self.data[:self.n].copy()
+        head = self.n % self.capacity
+        return np.concatenate((self.data[head:], self.data[:head]))
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+class BarAggregator:
+    """把 1 分钟K线增量合并为 k 分钟K线，并同步推进增量指标引擎
+
+    当前周期拆成“除最后一分钟外的合并结果”与“最后一分钟”两部分，
+    最后一分钟盘中反复变动时只需重新合并这两部分，每次推入都是 O(1)。
+    缓冲容量恰为一个交易日的周期数，当日K线不会被覆盖。
+    """
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.bars = MinuteRing(-(-SESSION_MINUTES // minutes))
+        self.indicators = IncrementalIndicators()
+        self._bucket = None
+        self._base = None
+        self._last = None
+
+    @staticmethod
+    def _merge(first, second):
+        if first is None:
+            return second
+        return (first[0], first[1], second[2], max(first[3], second[3]), min(first[4], second[4]),
+                first[5] + second[5], first[6] + second[6])
+
+    def push(self, day, index, bar, replace=False):
+        """推入序号为 index 的一根 1 分钟K线；replace=True 表示修改的是上一根"""
+        bucket = index // self.minutes
+        new_bar = bucket != self._bucket
+        if new_bar:
+            self._bucket, self._base = bucket, None
+        elif not replace:
+            self._base = self._merge(self._base, self._last)
+        self._last = bar
+        merged = self._merge(self._base, self._last)
+        end = min((bucket + 1) * self.minutes, SESSION_MINUTES) - 1
+        merged = (np.datetime64(session_minute_time(day, end), 'm'),) + merged[1:]
+        if new_bar:
+            self.bars.append(merged)
+            self.indicators.append(merged[0], merged[2])
+        else:
+            self.bars.update_last(merged)
+            self.indicators.update_last(merged[2])
+
+    def frame(self):
+        """当日 k 分钟K线与技术指标"""
+        bars = self.bars.view()
+        columns = {name: bars[name] for name in MINUTE_DTYPE.names}
+        columns['日期'] = columns['日期'].astype('datetime64[ns]')
+        return pd.DataFrame({**columns, **self.indicators.columns()})
+
+    @property
+    def nbytes(self):
+        return self.bars.nbytes + self.indicators.nbytes
+
+class IntradayFeed:
+    """单只股票当日的分时行情
+
+    每次刷新只向上游请求上次最后一分钟 (可能仍在变动) 之后的K线，逐根推入
+    各周期的合并器；图表与指标直接从缓冲生成，不重新拉取全天数据。
+    换日时清空缓冲。
+    """
+
+    def __init__(self, symbol, fetcher, prev_close_loader):
+        self.symbol = symbol
+        self.fetcher = fetcher
+        self.prev_close_loader = prev_close_loader
+        self.lock = threading.Lock()
+        self.version = 0
+        self.fetched_at = 0.0
+        self.counters = collections.Counter()
+        self._reset(None)
+
+    def _reset(self, day):
+        self.day = day
+        self.prev_close = None
+        self._last_ts = None
+        self._last_bar = None
+        self.aggregators = {k: BarAggregator(k) for k in INTRADAY_TIMEFRAMES.values()}
+
+    def _complete(self):
+        return (self._last_ts is not None
+                and self._last_ts >= datetime.datetime.combine(self.day, TRADING_SESSIONS[-1][1]))
+
+    def refresh(self, ttl=LIVE_BAR_TTL):
+        """拉取并合并新的分钟K线，返回是否有变化；距上次拉取不足 ttl 秒或当日已收盘时跳过"""
+        with self.lock:
+            day = intraday_session_day()
+            if day != self.day:
+                self._reset(day)
+                self.prev_close = self.prev_close_loader(self.symbol, day)
+            elif self._complete() or time.time() - self.fetched_at < ttl:
+                return False
+            start = self._last_ts or datetime.datetime.combine(day, TRADING_SESSIONS[0][0])
+            end = datetime.datetime.combine(day, TRADING_SESSIONS[-1][1])
+            df = self.fetcher(self.symbol, start, end)
+            self.fetched_at = time.time()
+            self.counters['fetches'] += 1
+            changed = self._ingest(df)
+            if changed:
+                self.version += 1
+            return changed
+
+    def _ingest(self, df):
+        if df is None or df.empty:
+            return False
+        changed = False
+        for row in df.itertuples(index=False):
+            ts = row.日期.to_pydatetime()
+            if self._last_ts is not None and ts < self._last_ts:
+                continue
+            replace = ts == self._last_ts
+            bar = (np.datetime64(ts, 'm'), row.开盘, row.收盘, row.最高, row.最低, row.成交量, row.成交额)
+            if replace and bar == self._last_bar:
+                continue
+            index = session_minute_index(ts)
+            for aggregator in self.aggregators.values():
+                aggregator.push(self.day, index, bar, replace)
+            self._last_ts, self._last_bar = ts, bar
+            self.counters['updates' if replace else 'minutes'] += 1
+            changed = True
+        return changed
+
+    def frame(self, minutes):
+        """当日 minutes 分钟K线与技术指标 (DataFrame，列名与日线一致)"""
+        with self.lock:
+            return self.aggregators[minutes].frame()
+
+    def summary(self):
+        """当日汇总：开盘、最高、最低、最新价、成交量、成交额与昨收，尚无数据时返回 None"""
+        with self.lock:
+            bars = self.aggregators[max(INTRADAY_TIMEFRAMES.values())].bars.view()
+            if not len(bars):
+                return None
+            return {
+                '日期': pd.Timestamp(bars['日期'][-1]),
+                '开盘': float(bars['开盘'][0]),
+                '最高': float(bars['最高'].max()),
+                '最低': float(bars['最低'].min()),
+                '收盘': float(bars['收盘'][-1]),
+                '成交量': float(bars['成交量'].sum()),
+                '成交额': float(bars['成交额'].sum()),
+                '昨收': self.prev_close,
+            }
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in self.aggregators.values())
+
+class IntradayFeedRegistry:
+    """按代码保存分时行情，超出容量时淘汰最久未用的"""
+
+    def __init__(self, fetcher, prev_close_loader, capacity=INTRADAY_MAX_FEEDS):
+        self.fetcher = fetcher
+        self.prev_close_loader = prev_close_loader
+        self.capacity = capacity
+        self._feeds = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, symbol):
+        with self._lock:
+            feed = self._feeds.get(symbol)
+            if feed is None:
+                feed = IntradayFeed(symbol, self.fetcher, self.prev_close_loader)
+                self._feeds[symbol] = feed
+                while len(self._feeds) > self.capacity:
+                    self._feeds.popitem(last=False)
+            self._feeds.move_to_end(symbol)
+            return feed
+
+    def memory_by_symbol(self):
+        """按股票代码汇总分时缓冲占用的字节数"""
+        with self._lock:
+            return {symbol: feed.nbytes for symbol, feed in self._feeds.items()}
+
+    def stats(self):
+        with self._lock:
+            feeds = list(self._feeds.values())
+        stats = sum((feed.counters for feed in feeds), collections.Counter())
+        stats.update(feeds=len(feeds), bytes=sum(feed.nbytes for feed in feeds))
+        return dict(stats)
+
+def fetch_minute_upstream(symbol, start, end, source=None):
+    """从数据源拉取 [start, end] 内的 1 分钟K线 (不做任何缓存)"""
+    source = source or get_data_source()
+    df = call_upstream("minute", source, source.fetch_minute, symbol, start, end)
+    if df is None or df.empty:
+        return None
+    df = df.rename(columns={'时间': '日期'})
+    df['日期'] = pd.to_datetime(df['日期'])
+    for col in MINUTE_DTYPE.names[1:]:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df[list(MINUTE_DTYPE.names)].sort_values('日期', ignore_index=True)
+
+def previous_close(symbol, day):
+    """day 之前最后一个交易日的不复权收盘价，取不到时返回 None"""
+    try:
+        df = load_hist_bars(symbol, day - datetime.timedelta(days=LIVE_LOOKBACK_DAYS),
+                            day - datetime.timedelta(days=1), RAW_ADJUST)
+    except (UpstreamError, OSError, ValueError):
+        return None
+    if df is None or df.empty:
+        return None
+    # 归档中的收盘价为 float32，经 expand_hist_frame 还原为两位小数的 float64，避免涨跌幅带入舍入误差
+    return float(expand_hist_frame(df.iloc[-1:])['收盘'].iloc[0])
+
+@st.cache_resource
+def get_intraday_feeds():
+    """进程内共享的分时行情表"""
+    return IntradayFeedRegistry(fetch_minute_upstream, previous_close)
+
+# ---------------------------------------------------------
+# 3. 技术指标计算函数
+# ---------------------------------------------------------
+def calculate_ma(df, periods=[5, 10, 20, 60]):
+    """计算移动平均线"""
+    for period in periods:
+        df[f'MA{period}'] = df['收盘'].rolling(window=period).mean()
+    return df
+
+def calculate_macd(df, fast=12, slow=26, signal=9):
+    """计算MACD指标"""
+    exp1 = df['收盘'].ewm(span=fast, adjust=False).mean()
+    exp2 = df['收盘'].ewm(span=slow, adjust=False).mean()
+    df['MACD'] = exp1 - exp2
+    df['Signal'] = df['MACD'].ewm(span=signal, adjust=False).mean()
+    df['Histogram'] = df['MACD'] - df['Signal']
+    return df
+
+def calculate_rsi(df, period=14):
+    """计算RSI指标"""
+    delta = df['收盘'].diff()
+    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
+    rs = gain / loss
+    df['RSI'] = 100 - (100 / (1 + rs))
+    return df
+
+def calculate_bollinger_bands(df, period=20, std_dev=2):
+    """计算布林带"""
+    df['BB_Middle'] = df['收盘'].rolling(window=period).mean()
+    std = df['收盘'].rolling(window=period).std()
+    df['BB_Upper'] = df['BB_Middle'] + (std * std_dev)
+    df['BB_Lower'] = df['BB_Middle'] - (std * std_dev)
+    return df
+
+@timed("indicators")
+def add_technical_indicators(df):
+    """添加所有技术指标"""
+    df = calculate_ma(df)
+    df = calculate_macd(df)
+    df = calculate_rsi(df)
+    df = calculate_bollinger_bands(df)
+    return df
+
+def format_value(val, unit_type='amount'):
+    """金额和数量的单位自动转换及保留两位小数"""
+    try:
+        val = float(val)
+    except (ValueError, TypeError):
+        return "-"
+    
+    if unit_type == 'amount':
+        if abs(val) >= 1e12:
+            return f"{val/1e12:.2f} 万亿"
+        elif abs(val) >= 1e8:
+            return f"{val/1e8:.2f} 亿"
+        elif abs(val) >= 1e4:
+            return f"{val/1e4:.2f} 万"
+        else:
+            return f"{val:.2f} 元"
+    elif unit_type == 'volume':
+        if abs(val) >= 1e12:
+            return f"{val/1e12:.2f} 万亿股"
+        elif abs(val) >= 1e8:
+            return f"{val/1e8:.2f} 亿股"
+        elif abs(val) >= 1e4:
+            return f"{val/1e4:.2f} 万股"
+        else:
+            return f"{val:.2f} 股"
+    return f"{val:.2f}"
+
+# ---------------------------------------------------------
+# 3.1 增量指标引擎 (自动刷新时只更新最新K线)
+# ---------------------------------------------------------
+INDICATOR_COLUMNS = ['MA5', 'MA10', 'MA20', 'MA60', 'MACD', 'Signal', 'Histogram',
+                     'RSI', 'BB_Middle', 'BB_Upper', 'BB_Lower']
+
+class IncrementalIndicators:
+    """有状态的技术指标引擎
+
+    保存各指标的滚动状态：MA/布林带的窗口和与平方和、MACD/Signal 的上一期
+    EMA 值、RSI 窗口内的涨跌幅合计。追加一根K线或修改最后一根K线对每个指标
+    都是 O(1)，结果与 add_technical_indicators 的 pandas 实现在浮点误差内一致。
+    参数固定为 add_technical_indicators 使用的默认参数。
+    """
+
+    MA_PERIODS = (5, 10, 20, 60)
+    FAST, SLOW, SIGNAL = 12, 26, 9
+    RSI_PERIOD = 14
+    BB_PERIOD, BB_STD = 20, 2
+
+    def __init__(self):
+        self.n = 0
+        self.lock = threading.Lock()
+        self._dates = np.empty(0, dtype='datetime64[ns]')
+        self._closes = np.empty(0)
+        self._out = {col: np.empty(0) for col in INDICATOR_COLUMNS}
+        self._window = collections.deque(maxlen=max(self.MA_PERIODS + (self.BB_PERIOD,)))
+        self._sums = {p: 0.0 for p in self.MA_PERIODS}
+        self._bb_sum = 0.0
+        self._bb_sumsq = 0.0
+        self._ema_fast = None
+        self._ema_slow = None
+        self._ema_signal = None
+        self._prev_close = None
+        self._gains = collections.deque(maxlen=self.RSI_PERIOD)
+        self._losses = collections.deque(maxlen=self.RSI_PERIOD)
+        self._gain_sum = 0.0
+        self._loss_sum = 0.0
+        self._undo = None
+
+    # --- 状态维护 ---
+    def _state(self):
+        return (collections.deque(self._window, self._window.maxlen), dict(self._sums), self._bb_sum, self._bb_sumsq,
+                self._ema_fast, self._ema_slow, self._ema_signal, self._prev_close,
+                collections.deque(self._gains, self.RSI_PERIOD),
+                collections.deque(self._losses, self.RSI_PERIOD),
+                self._gain_sum, self._loss_sum)
+
+    def _restore(self, state):
+        (self._window, self._sums, self._bb_sum, self._bb_sumsq,
+         self._ema_fast, self._ema_slow, self._ema_signal, self._prev_close,
+         self._gains, self._losses, self._gain_sum, self._loss_sum) = state
+
+    def _reserve(self, size):
+        if size <= len(self._closes):
+            return
+        # 按 1/8 增长，避免长历史的引擎因倍增预留而多占一倍内存
+        cap = max(size, len(self._closes) + len(self._closes) // 8, 256)
+        for name in ('_dates', '_closes'):
+            old = getattr(self, name)
+            buf = np.empty(cap, dtype=old.dtype)
+            buf[:self.n] = old[:self.n]
+            setattr(self, name, buf)
+        for col, old in self._out.items():
+            buf = np.full(cap, np.nan)
+            buf[:self.n] = old[:self.n]
+            self._out[col] = buf
+
+    @staticmethod
+    def _ema(prev, x, span):
+        if prev is None:
+            return x
+        alpha = 2 / (span + 1)
+        return prev + alpha * (x - prev)
+
+    def _step(self, x):
+        """把一根新K线推入状态，返回该K线的全部指标值"""
+        out = {}
+        bars = self.n + 1
+
+        # 移动平均线与布林带：窗口和、平方和
+        for p in self.MA_PERIODS:
+            self._sums[p] += x
+            if len(self._window) >= p:
+                self._sums[p] -= self._window[-p]
+        self._bb_sum += x
+        self._bb_sumsq += x * x
+        if len(self._window) >= self.BB_PERIOD:
+            old = self._window[-self.BB_PERIOD]
+            self._bb_sum -= old
+            self._bb_sumsq -= old * old
+        self._window.append(x)
+        for p in self.MA_PERIODS:
+            out[f'MA{p}'] = self._sums[p] / p if bars >= p else np.nan
+        if bars >= self.BB_PERIOD:
+            mid = self._bb_sum / self.BB_PERIOD
+            var = (self._bb_sumsq - self._bb_sum * mid) / (self.BB_PERIOD - 1)
+            std = np.sqrt(max(var, 0.0))
+            out['BB_Middle'] = mid
+            out['BB_Upper'] = mid + std * self.BB_STD
+            out['BB_Lower'] = mid - std * self.BB_STD
+        else:
+            out['BB_Middle'] = out['BB_Upper'] = out['BB_Lower'] = np.nan
+
+        # MACD：只需上一期的 EMA
+        self._ema_fast = self._ema(self._ema_fast, x, self.FAST)
+        self._ema_slow = self._ema(self._ema_slow, x, self.SLOW)
+        macd = self._ema_fast - self._ema_slow
+        self._ema_signal = self._ema(self._ema_signal, macd, self.SIGNAL)
+        out['MACD'] = macd
+        out['Signal'] = self._ema_signal
+        out['Histogram'] = macd - self._ema_signal
+
+        # RSI：与 calculate_rsi 一致，首根K线的涨跌计为 0
+        delta = 0.0 if self._prev_close is None else x - self._prev_close
+        self._prev_close = x
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+        if len(self._gains) == self.RSI_PERIOD:
+            self._gain_sum -= self._gains[0]
+            self._loss_sum -= self._losses[0]
+        self._gains.append(gain)
+        self._losses.append(loss)
+        self._gain_sum += gain
+        self._loss_sum += loss
+        if len(self._gains) == self.RSI_PERIOD:
+            # 窗口内没有上涨/下跌时直接取 0，避免累加误差留下极小残值
+            avg_gain = self._gain_sum / self.RSI_PERIOD if any(self._gains) else 0.0
+            avg_loss = self._loss_sum / self.RSI_PERIOD if any(self._losses) else 0.0
+            if avg_loss == 0:
+                out['RSI'] = 100.0 if avg_gain > 0 else np.nan
+            else:
+                out['RSI'] = 100 - 100 / (1 + avg_gain / avg_loss)
+        else:
+            out['RSI'] = np.nan
+        return out
+
+    # --- 对外接口 ---
+    def append(self, date, close):
+        """追加一根新K线"""
+        self._undo = self._state()
+        out = self._step(float(close))
+        self._reserve(self.n + 1)
+        self._dates[self.n] = np.datetime64(date, 'ns')
+        self._closes[self.n] = close
+        for col, val in out.items():
+            self._out[col][self.n] = val
+        self.n += 1
+
+    def update_last(self, close):
+        """修改最后一根K线的收盘价 (盘中实时K线)"""
+        if self._undo is None:
+            raise ValueError("没有可以更新的K线")
+        date = self._dates[self.n - 1]
+        self._restore(self._undo)
+        self.n -= 1
+        self.append(date, close)
+
+    @classmethod
+    def from_frame(cls, df):
+        """用 pandas 全量计算结果初始化引擎，并从尾部恢复滚动状态"""
+        engine = cls()
+        n = len(df)
+        if n == 0:
+            return engine
+        closes = df['收盘'].to_numpy(dtype=float)
+        full = add_technical_indicators(df[['收盘']].copy())
+        engine._reserve(n)
+        engine._dates[:n] = df['日期'].to_numpy(dtype='datetime64[ns]')
+        engine._closes[:n] = closes
+        for col in INDICATOR_COLUMNS:
+            engine._out[col][:n] = full[col].to_numpy(dtype=float)
+
+        # 状态恢复到倒数第二根K线，再正常推入最后一根，以便后续 update_last
+        head = closes[:-1]
+        m = len(head)
+        if m:
+            engine._window.extend(head[-engine._window.maxlen:])
+            for p in cls.MA_PERIODS:
+                engine._sums[p] = float(head[-p:].sum())
+            tail = head[-cls.BB_PERIOD:]
+            engine._bb_sum = float(tail.sum())
+            engine._bb_sumsq = float((tail * tail).sum())
+            s = pd.Series(head)
+            engine._ema_fast = float(s.ewm(span=cls.FAST, adjust=False).mean().iloc[-1])
+            engine._ema_slow = float(s.ewm(span=cls.SLOW, adjust=False).mean().iloc[-1])
+            engine._ema_signal = float(full['Signal'].iloc[m - 1])
+            engine._prev_close = float(head[-1])
+            deltas = np.diff(head, prepend=head[0])
+            deltas = deltas[-cls.RSI_PERIOD:]
+            engine._gains.extend(np.maximum(deltas, 0.0).tolist())
+            engine._losses.extend(np.maximum(-deltas, 0.0).tolist())
+            engine._gain_sum = float(sum(engine._gains))
+            engine._loss_sum = float(sum(engine._losses))
+        engine.n = m
+        engine.append(engine._dates[m], closes[-1])
+        # 最后一根保留 pandas 的精确结果
+        for col in INDICATOR_COLUMNS:
+            engine._out[col][n - 1] = full[col].iloc[-1]
+        return engine
+
+    def sync(self, df, max_new=64):
+        """让引擎追上 df：仅最后一根变化或尾部新增时增量更新，否则返回 False"""
+        n_new = len(df)
+        if self.n == 0 or n_new < self.n or n_new - self.n > max_new:
+            return False
+        dates = df['日期'].to_numpy(dtype='datetime64[ns]')
+        closes = df['收盘'].to_numpy(dtype=float)
+        k = self.n - 1
+        if not np.isfinite(closes[k:]).all():
+            return False
+        if not (np.array_equal(dates[:self.n], self._dates[:self.n])
+                and np.array_equal(closes[:k], self._closes[:k])):
+            return False
+        if closes[k] != self._closes[k]:
+            self.update_last(closes[k])
+        for i in range(self.n, n_new):
+            self.append(dates[i], closes[i])
+        return True
+
+    @property
+    def nbytes(self):
+        """引擎缓冲区占用的字节数"""
+        return (self._dates.nbytes + self._closes.nbytes
+                + sum(buf.nbytes for buf in self._out.values()))
+
+    def columns(self):
+        """各指标列的当前值 (副本)"""
+        return {col: self._out[col][:self.n].copy() for col in INDICATOR_COLUMNS}
+
+    def attach(self, df):
+        """把引擎中的指标列拼接到 df (返回新的 DataFrame)"""
+        df = df.copy()
+        for col in INDICATOR_COLUMNS:
+            df[col] = self._out[col][:self.n].copy()
+        return df
+
+class IndicatorEngineRegistry:
+    """按 (代码, 复权方式, ...) 保存增量引擎，超出容量时淘汰最久未用的"""
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self._engines = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None:
+                self._engines.move_to_end(key)
+            return engine
+
+    def memory_by_symbol(self):
+        """按股票代码汇总引擎占用的字节数"""
+        usage = collections.Counter()
+        with self._lock:
+            for key, engine in self._engines.items():
+                usage[key[0]] += engine.nbytes
+        return dict(usage)
+
+    def put(self, key, engine):
+        with self._lock:
+            self._engines[key] = engine
+            self._engines.move_to_end(key)
+            while len(self._engines) > self.capacity:
+                self._engines.popitem(last=False)
+
+@st.cache_resource
+def get_indicator_registry():
+    """进程内共享的增量指标引擎表"""
+    return IndicatorEngineRegistry()
+
+@timed("indicators.incremental")
+def add_technical_indicators_incremental(df, key):
+    """与 add_technical_indicators 结果一致，但复用 key 对应的引擎只计算新增K线"""
+    registry = get_indicator_registry()
+    engine = registry.get(key)
+    if engine is not None:
+        with engine.lock:
+            if engine.sync(df):
+                get_metrics().count("indicator_engine.hits")
+                return engine.attach(df)
+    get_metrics().count("indicator_engine.misses")
+    engine = IncrementalIndicators.from_frame(df)
+    registry.put(key, engine)
+    return engine.attach(df)
+
+# ---------------------------------------------------------
+# 3.2 面板指标计算 (日期×代码 二维数组，多标的向量化)
+# ---------------------------------------------------------
+# 停牌等原因造成的缺失值会先按列“挤紧”，使每只股票只在自己的有效K线上
+# 计算，结果与对单只股票调用 add_technical_indicators 一致。
+def _pack_panel(values):
+    """把每列有效值按时间顺序移到顶部，返回 (紧凑数组, 行号排列, 每列有效个数)"""
+    valid = np.isfinite(values)
+    order = np.argsort(~valid, axis=0, kind='stable')
+    packed = np.take_along_axis(values, order, axis=0)
+    counts = valid.sum(axis=0)
+    packed[np.arange(len(values))[:, None] >= counts] = 0.0
+    return packed, order, counts
+
+def _unpack_panel(packed, order, counts):
+    """_pack_panel 的逆操作，无效位置填 NaN"""
+    packed = np.where(np.arange(len(packed))[:, None] < counts, packed, np.nan)
+    out = np.empty_like(packed)
+    np.put_along_axis(out, order, packed, axis=0)
+    return out
+
+def _ema_columns(x, span):
+    """按列计算 EMA (adjust=False)，对时间做递推、对所有列同时向量化"""
+    alpha = 2 / (span + 1)
+    out = np.empty_like(x)
+    if len(x):
+        out[0] = x[0]
+    for t in range(1, len(x)):
+        out[t] = out[t - 1] + alpha * (x[t] - out[t - 1])
+    return out
+
+def compute_panel_indicators(closes, ma_periods=(5, 10, 20, 60), fast=12, slow=26,
+                             signal=9, rsi_period=14, bb_period=20, bb_std=2):
+    """对 日期×代码 的收盘价二维数组一次性计算全部技术指标
+
+    返回 {指标名: 与 closes 同形状的二维数组}，指标名与 add_technical_indicators
+    生成的列名一致。
+    """
+    closes = np.asarray(closes, dtype=float)
+    if closes.ndim != 2:
+        raise ValueError("closes 必须是 日期×代码 的二维数组")
+    x, order, counts = _pack_panel(closes)
+    # 以每列首个价格为基准做平移，降低平方和相减时的精度损失
+    base = x[:1]
+    shifted = x - base
+    result = {}
+
+    for period in ma_periods:
+        result[f'MA{period}'] = window_sum(shifted, period) / period + base
+
+    ema_fast = _ema_columns(x, fast)
+    ema_slow = _ema_columns(x, slow)
+    macd = ema_fast - ema_slow
+    sig = _ema_columns(macd, signal)
+    result['MACD'] = macd
+    result['Signal'] = sig
+    result['Histogram'] = macd - sig
+
+    delta = np.zeros_like(x)
+    delta[1:] = np.diff(x, axis=0)
+    gain = window_sum(np.maximum(delta, 0.0), rsi_period)
+    loss = window_sum(np.maximum(-delta, 0.0), rsi_period)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        result['RSI'] = 100 - 100 / (1 + gain / loss)
+
+    s1 = window_sum(shifted, bb_period)
+    s2 = window_sum(shifted * shifted, bb_period)
+    mid = s1 / bb_period
+    std = np.sqrt(np.maximum((s2 - s1 * mid) / (bb_period - 1), 0.0))
+    result['BB_Middle'] = mid + base
+    result['BB_Upper'] = result['BB_Middle'] + std * bb_std
+    result['BB_Lower'] = result['BB_Middle'] - std * bb_std
+
+    return {name: _unpack_panel(arr, order, counts) for name, arr in result.items()}
+
+def panel_first_valid(values):
+    """每列第一个有效值 (整列无效时为 0)，形状为 (1, 列数)"""
+    valid = np.isfinite(values)
+    first = values[np.argmax(valid, axis=0), np.arange(values.shape[1])]
+    return np.where(valid.any(axis=0), first, 0.0)[None, :]
+
+def panel_last_valid(values, reference):
+    """取每列在 reference 最后一个有效位置上的值"""
+    valid = np.isfinite(reference)
+    last = len(reference) - 1 - np.argmax(valid[::-1], axis=0)
+    out = values[last, np.arange(values.shape[1])]
+    return np.where(valid.any(axis=0), out, np.nan)
+
+# ---------------------------------------------------------
+# 3.3 向量化格式化与配色 (整列一次处理，替代逐行/逐单元格循环)
+# ---------------------------------------------------------
+# 进程内缓存的渲染结果 (图表、格式化后的表格) 总字节数上限
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("STOCK_APP_RENDER_CACHE_MB", "64")) * 1024 * 1024
+
+def content_fingerprint(*values):
+    """按内容计算参数指纹：DataFrame / Series / ndarray 哈希其数据，其余参数取 repr"""
+    digest = hashlib.blake2b(digest_size=16)
+    for value in values:
+        if isinstance(value, pd.DataFrame):
+            digest.update(repr(list(value.columns)).encode())
+            digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        elif isinstance(value, pd.Series):
+            digest.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        elif isinstance(value, np.ndarray):
+            digest.update(str(value.dtype).encode())
+            digest.update(np.ascontiguousarray(value).tobytes())
+        else:
+            digest.update(repr(value).encode())
+    return digest.hexdigest()
+
+class RenderCache:
+    """按 (构建函数, 数据与选项指纹) 缓存已构建的图表与表格
+
+    写入时用 estimate_size 估算每个条目的字节数，总量超出 max_bytes 时
+    淘汰最久未用的条目 (与 MarketCache 相同)。图表以序列化后的 JSON 字符串
+    缓存；表格等其他对象在会话之间共享，调用方只能读取、不能修改。
+    """
+
+    def __init__(self, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._items = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.counters = collections.Counter()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, item):
+        size = estimate_size(item)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.bytes -= self._items.pop(key)[1]
+            self._items[key] = (item, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.bytes -= evicted
+                self.counters['evictions'] += 1
+
+    def stats(self):
+        stats = dict(self.counters)
+        stats.update(entries=len(self._items), bytes=self.bytes)
+        return stats
+
+@st.cache_resource
+def get_render_cache():
+    """进程内共享的渲染结果缓存"""
+    return RenderCache()
+
+def figure_from_json(spec):
+    """把缓存的图表 JSON 还原为本会话私有的 Figure
+
+    JSON 由已校验过的 Figure 序列化而来，跳过逐属性校验，还原开销约为
+    重新构建图表的几十分之一。
+    """
+    return go.Figure(json.loads(spec), _validate=False)
+
+def render_cached(func):
+    """装饰图表/表格构建函数：数据内容与选项都相同时直接复用上次的结果
+
+    图表只在构建时序列化一次，缓存 JSON 字符串并按其大小计入上限；命中时
+    还原为新的 Figure，会话之间不共享可变的图表对象。
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        key = (func.__name__, content_fingerprint(*args, *sorted(kwargs.items())))
+        cache = get_render_cache()
+        cached = cache.get(key)
+        if cached is None:
+            result = func(*args, **kwargs)
+            cache.put(key, result.to_json() if isinstance(result, go.Figure) else result)
+            return result
+        return figure_from_json(cached) if isinstance(cached, str) else cached
+    return wrapper
+
+UNIT_THRESHOLDS = [1e12, 1e8, 1e4]
+UNIT_SUFFIXES = {
+    'amount': [' 万亿', ' 亿', ' 万', ' 元'],
+    'volume': [' 万亿股', ' 亿股', ' 万股', ' 股'],
+}
+UP_COLOR, DOWN_COLOR = '#ef5350', '#26a69a'
+
+def format_values(values, unit_type='amount'):
+    """format_value 的向量化版本，返回字符串数组
+
+    单位的选择用 np.select 对整列一次完成；数字转文本走一次列表推导
+    (实测比 np.char.mod 更快)。无法转换为数字的值显示为 "-"。
+    """
+    vals = pd.to_numeric(pd.Series(values), errors='coerce').to_numpy(dtype=float)
+    if unit_type in UNIT_SUFFIXES:
+        magnitude = np.abs(vals)
+        conditions = [magnitude >= t for t in UNIT_THRESHOLDS]
+        divisor = np.select(conditions, UNIT_THRESHOLDS, 1.0)
+        suffixes = UNIT_SUFFIXES[unit_type]
+        suffix = np.select(conditions, suffixes[:-1], suffixes[-1])
+    else:
+        divisor = np.ones_like(vals)
+        suffix = np.full(len(vals), '')
+    text = [f"{v:.2f}{s}" for v, s in zip((vals / divisor).tolist(), suffix.tolist())]
+    return np.where(np.isnan(vals), '-', np.array(text, dtype=object))
+
+def sign_colors(values, positive=DOWN_COLOR, negative=UP_COLOR):
+    """按正负号为整列着色 (MACD 柱默认 正绿负红，与原有配色一致)"""
+    return np.where(np.asarray(values, dtype=float) >= 0, positive, negative)
+
+def candle_colors(close, open_):
+    """按K线涨跌为整列着色 (收盘不低于开盘为红)"""
+    return np.where(np.asarray(close, dtype=float) >= np.asarray(open_, dtype=float),
+                    UP_COLOR, DOWN_COLOR)
+
+# 企业档案中需要做单位换算的项目
+PROFILE_AMOUNT_ITEMS = ['总市值', '流通市值', '成交额']
+PROFILE_VOLUME_ITEMS = ['总股本', '流通股本', '成交量']
+
+@timed("table.profile")
+def format_profile_values(items, values):
+    """企业档案数值列的向量化单位换算，其余项目原样转为文本"""
+    items = pd.Series(items).astype(str)
+    is_amount = items.str.contains('|'.join(map(re.escape, PROFILE_AMOUNT_ITEMS))).to_numpy()
+    is_volume = items.str.contains('|'.join(map(re.escape, PROFILE_VOLUME_ITEMS))).to_numpy()
+    raw = pd.Series(values).astype(str).to_numpy(dtype=object)
+    return np.select([is_amount, is_volume],
+                     [format_values(values, 'amount'), format_values(values, 'volume')],
+                     raw)
+
+@render_cached
+@timed("table.history")
+def format_history_table(df):
+    """历史明细展示用的表格：成交量/成交额换算为带单位的文本
+
+    价格与百分比列保持数值类型，由 HISTORY_COLUMN_CONFIG 在前端格式化，
+    这样表头排序仍按数值进行。
+    """
+    df = df.copy()
+    df['成交量'] = format_values(df['成交量'], 'volume')
+    df['成交额'] = format_values(df['成交额'], 'amount')
+    return df
+
+# 历史明细每页行数
+HISTORY_PAGE_SIZE = 50
+
+def history_range(df, start=None, end=None):
+    """在按日期升序的行情上二分查找筛选区间，返回行号范围 [lo, hi)"""
+    index = pd.DatetimeIndex(df['日期'])
+    lo = index.searchsorted(pd.Timestamp(start), 'left') if start is not None else 0
+    hi = index.searchsorted(pd.Timestamp(end), 'right') if end is not None else len(index)
+    return lo, max(hi, lo)
+
+def page_count(n_rows, page_size=HISTORY_PAGE_SIZE):
+    """总页数 (空结果也算一页)"""
+    return max(-(-n_rows // page_size), 1)
+
+def history_page(df, lo, hi, descending=True, page=1, page_size=HISTORY_PAGE_SIZE):
+    """取出区间 [lo, hi) 中的一页明细
+
+    降序浏览时从区间尾部倒着切片得到逆序视图，不做排序；
+    之后只有当页的几十行会被复制和格式化。
+    """
+    offset = (min(max(page, 1), page_count(hi - lo, page_size)) - 1) * page_size
+    if descending:
+        return df.iloc[max(hi - offset - page_size, lo):hi - offset].iloc[::-1]
+    return df.iloc[lo + offset:min(lo + offset + page_size, hi)]
+
+HISTORY_COLUMN_CONFIG = {
+    '日期': st.column_config.DateColumn(format="YYYY-MM-DD"),
+    '开盘': st.column_config.NumberColumn(format="¥%.2f"),
+    '收盘': st.column_config.NumberColumn(format="¥%.2f"),
+    '最高': st.column_config.NumberColumn(format="¥%.2f"),
+    '最低': st.column_config.NumberColumn(format="¥%.2f"),
+    '涨跌幅': st.column_config.NumberColumn(format="%.2f%%"),
+    '换手率': st.column_config.NumberColumn(format="%.2f%%"),
+}
+
+# ---------------------------------------------------------
+# 3.4 回测参数扫描 (引擎见 backtest.py，多只股票分块交给进程池)
+# ---------------------------------------------------------
+# 参数扫描进程池的子进程数
+BACKTEST_MAX_WORKERS = min(os.cpu_count() or 1, 8)
+
+@st.cache_resource
+def get_backtest_pool():
+    """参数扫描用的进程池 (进程级单例)
 
-    if "password_correct" not in st.session_state:
-        st.title("🔒 访问受限")
-        st.text_input("请输入访问密码", type="password", on_change=password_entered, key="password")
-        return False
-    elif not st.session_state["password_correct"]:
-        st.title("🔒 访问受限")
-        st.text_input("密码错误，请重试", type="password", on_change=password_entered, key="password")
-        st.error("❌ 密码不正确")
-        return False
-    else:
-        return True
+    使用 spawn 启动：服务进程里有多个线程，fork 可能继承被占用的锁而死锁。
+    子进程只导入 backtest 模块，不会重新执行页面脚本。
+    """
+    return ProcessPoolExecutor(BACKTEST_MAX_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+@timed("backtest.sweep")
+def run_backtest_sweep(closes, rules=None, fee=BACKTEST_FEE, slippage=BACKTEST_SLIPPAGE,
+                       pool=None, workers=BACKTEST_MAX_WORKERS):
+    """多只股票 × 参数网格的回测扫描，closes 为 {代码: 收盘价数组}
+
+    传入 pool 时按股票分成 workers 块提交到进程池并行计算，结果顺序与逐只
+    计算一致；只有一只股票时直接在当前进程内计算。
+    """
+    symbols = list(closes)
+    workers = min(workers, len(symbols))
+    if pool is None or workers < 2:
+        return backtest_chunk(closes, symbols, rules, fee, slippage)
+    futures = [pool.submit(backtest_chunk, {sym: closes[sym] for sym in part}, list(part),
+                           rules, fee, slippage)
+               for part in np.array_split(np.array(symbols, dtype=object), workers)]
+    return pd.concat([fut.result() for fut in futures], ignore_index=True)
 
 # ---------------------------------------------------------
-# 2. 数据获取函数集
+# 3.5 选股表达式 (AST 白名单求值，整个面板一次向量化计算)
 # ---------------------------------------------------------
-@st.cache_data(ttl=3600)
-def get_base_info(symbol):
-    """获取个股多维度基本面信息"""
-    try:
-        return ak.stock_individual_info_em(symbol=symbol)
-    except:
-        return None
+class ScreenerExpressionError(ValueError):
+    """选股表达式无法解析或包含不支持的语法"""
 
-@st.cache_data(ttl=3600)
-def get_hist_data(symbol, start, end, adjust):
-    """获取历史行情数据"""
+# 表达式中可用的英文字段别名
+SCREENER_ALIASES = {'close': '收盘', 'open': '开盘', 'high': '最高', 'low': '最低',
+                    'volume': '成交量', 'amount': '成交额', 'turnover': '换手率', 'pct_chg': '涨跌幅'}
+
+def _rolling_sum(x, n):
+    """按列滚动求和，窗口内含 NaN 时结果为 NaN (与 pandas rolling 默认一致)"""
+    valid = np.isfinite(x)
+    total = window_sum(np.where(valid, x, 0.0), n)
+    count = window_sum(valid.astype(float), n)
+    return np.where(count == n, total, np.nan)
+
+def _rolling_std(x, n):
+    # 以每列首个有效值为基准平移，降低平方和相减时的精度损失
+    shifted = x - panel_first_valid(x)
+    s1 = _rolling_sum(shifted, n)
+    s2 = _rolling_sum(shifted * shifted, n)
+    return np.sqrt(np.maximum((s2 - s1 * s1 / n) / (n - 1), 0.0)) if n > 1 else np.full_like(x, np.nan)
+
+def _rolling_extreme(reduce):
+    def apply(x, n):
+        out = np.full_like(x, np.nan)
+        if len(x) >= n:
+            out[n - 1:] = reduce(np.lib.stride_tricks.sliding_window_view(x, n, axis=0), axis=-1)
+        return out
+    return apply
+
+def _ref(x, n):
+    """n 个交易日前的值"""
+    out = np.full_like(x, np.nan)
+    if n < len(x):
+        out[n:] = x[:len(x) - n]
+    return out
+
+# 函数名 -> (实现, 是否第二个参数为窗口长度)
+SCREENER_FUNCTIONS = {
+    'mean': (lambda x, n: _rolling_sum(x, n) / n, True), 'ma': (lambda x, n: _rolling_sum(x, n) / n, True),
+    'std': (_rolling_std, True), 'sum': (_rolling_sum, True),
+    'max': (_rolling_extreme(np.max), True), 'min': (_rolling_extreme(np.min), True),
+    'ref': (_ref, True), 'abs': (np.abs, False),
+}
+_SCREENER_BINOPS = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+_SCREENER_COMPARE = {ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater,
+                     ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal}
+
+class ScreenerContext:
+    """表达式求值环境：字段取自面板 (float64)，技术指标按需整体计算一次"""
+
+    def __init__(self, panel):
+        self.panel = panel
+        self._values = {}
+
+    def resolve(self, name):
+        field = SCREENER_ALIASES.get(name, name)
+        if field not in self._values:
+            if field in self.panel.fields:
+                self._values[field] = self.panel.fields[field].astype(np.float64)
+            elif field in INDICATOR_COLUMNS:
+                self._values.update(self.panel.indicators())
+            else:
+                raise ScreenerExpressionError(f"未知字段: {name}")
+        return self._values[field]
+
+    def evaluate(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+            return float(node.value)
+        if isinstance(node, ast.Name):
+            return self.resolve(node.id)
+        if isinstance(node, ast.BoolOp):
+            reduce = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return reduce.reduce([np.asarray(self.evaluate(v)) > 0 for v in node.values])
+        if isinstance(node, ast.UnaryOp):
+            value = self.evaluate(node.operand)
+            if isinstance(node.op, ast.Not):
+                return ~(np.asarray(value) > 0)
+            if isinstance(node.op, ast.USub):
+                return -value
+            if isinstance(node.op, ast.UAdd):
+                return value
+        if isinstance(node, ast.BinOp) and type(node.op) in _SCREENER_BINOPS:
+            return _SCREENER_BINOPS[type(node.op)](self.evaluate(node.left), self.evaluate(node.right))
+        if isinstance(node, ast.Compare) and all(type(op) in _SCREENER_COMPARE for op in node.ops):
+            left, result = self.evaluate(node.left), True
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self.evaluate(comparator)
+                result = np.logical_and(result, _SCREENER_COMPARE[type(op)](left, right))
+                left = right
+            return result
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+            if node.func.id not in SCREENER_FUNCTIONS:
+                raise ScreenerExpressionError(f"不支持的函数: {node.func.id}")
+            func, windowed = SCREENER_FUNCTIONS[node.func.id]
+            if not windowed:
+                if len(node.args) != 1:
+                    raise ScreenerExpressionError(f"{node.func.id}(字段) 需要一个参数")
+                return func(self.evaluate(node.args[0]))
+            if len(node.args) != 2:
+                raise ScreenerExpressionError(f"{node.func.id}(字段, 天数) 需要两个参数")
+            window = node.args[1]
+            if not (isinstance(window, ast.Constant) and type(window.value) is int
+                    and 0 < window.value <= PANEL_MAX_DAYS):
+                raise ScreenerExpressionError(f"{node.func.id} 的天数须为 1~{PANEL_MAX_DAYS} 的整数")
+            return func(np.asarray(self.evaluate(node.args[0]), dtype=float), window.value)
+        raise ScreenerExpressionError(f"不支持的语法: {ast.unparse(node)}")
+
+def evaluate_screener(expr, panel, context=None):
+    """对面板求值表达式，返回最新交易日每只股票的结果 (长度为代码数的一维数组)"""
     try:
-        df = ak.stock_zh_a_hist(
-            symbol=symbol,
-            period="daily",
-            start_date=start.strftime("%Y%m%d"),
-            end_date=end.strftime("%Y%m%d"),
-            adjust="" if adjust == "None" else adjust
-        )
-        if df is not None and not df.empty:
-            df['日期'] = pd.to_datetime(df['日期'])
-            numeric_cols = ['开盘', '收盘', '最高', '最低', '成交量', '成交额', '涨跌幅', '换手率']
-            for col in numeric_cols:
-                df[col] = pd.to_numeric(df[col], errors='coerce')
+        tree = ast.parse(expr.strip(), mode='eval')
+    except SyntaxError as e:
+        raise ScreenerExpressionError(f"语法错误: {e.msg}") from None
+    context = context or ScreenerContext(panel)
+    try:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value = context.evaluate(tree.body)
+    except ScreenerExpressionError:
+        raise
+    except (TypeError, ValueError) as e:
+        # 白名单之外遗漏的参数或形状错误，统一按表达式错误提示，不让页面崩溃
+        raise ScreenerExpressionError(f"表达式无法求值: {e}") from None
+    value = np.asarray(value)
+    if value.ndim == 0:
+        return np.full(len(panel.codes), value)
+    return value[-1]
+
+@timed("screener")
+def run_screener(panel, condition, rank_by="涨跌幅", ascending=False, limit=100):
+    """按条件筛选最新交易日的全市场股票，按 rank_by 表达式排序
+
+    返回 (前 limit 只的结果表, 满足条件的总数)。
+    """
+    if not len(panel):
+        return pd.DataFrame(), 0
+    context = ScreenerContext(panel)
+    mask = evaluate_screener(condition, panel, context) > 0
+    score = evaluate_screener(rank_by, panel, context).astype(float)
+    hits = np.flatnonzero(mask)
+    order = hits[np.argsort(score[hits] if ascending else -score[hits], kind='stable')][:limit]
+    latest = {field: context.resolve(field)[-1, order] for field in ('收盘', '涨跌幅', '换手率', '成交额')}
+    return pd.DataFrame({
+        '代码': [panel.codes[i] for i in order],
+        '名称': [panel.names.get(panel.codes[i], '') for i in order],
+        **latest,
+        '排序值': score[order],
+    }), len(hits)
+
+# ---------------------------------------------------------
+# 3.6 多周期K线 (周K/月K/季K 由日线本地合并)
+# ---------------------------------------------------------
+# 周期名称 → (pandas 周期频率, 计数单位, 每年周期数)；日K 不做合并
+TIMEFRAMES = {
+    "日K": (None, "天", TRADING_DAYS_PER_YEAR),
+    "周K": ("W", "周", 52),
+    "月K": ("M", "月", 12),
+    "季K": ("Q", "季", 4),
+}
+
+def period_starts(dates, freq):
+    """按自然周/月/季划分交易日序列，返回每个周期首个交易日的下标
+
+    分组只依据实际出现的交易日，节假日与停牌自然落在各自的周期内，
+    不会产生空周期；最后一个周期截止到最新交易日。
+    """
+    keys = pd.PeriodIndex(dates, freq=freq).asi8
+    return np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+
+@timed("resample")
+def resample_bars(df, freq):
+    """日线合并为 freq 周期的K线，并重新计算技术指标
+
+    开盘取首日、最高/最低取极值、收盘取末日，成交量、成交额与换手率求和，
+    涨跌幅按日涨跌幅连乘 (除权日的涨跌幅已按交易所前收盘计算，不复权
+    序列同样适用)，涨跌额与振幅以周期首日的前收盘为基准。日期记为周期
+    内最后一个交易日。
+    """
+    if df is None or df.empty:
         return df
-    except:
-        return None
+    starts = period_starts(df['日期'], freq)
+    ends = np.r_[starts[1:], len(df)] - 1
+    close = df['收盘'].to_numpy(dtype=float)
+    high = np.fmax.reduceat(df['最高'].to_numpy(dtype=float), starts)
+    low = np.fmin.reduceat(df['最低'].to_numpy(dtype=float), starts)
+    growth = np.multiply.reduceat(1 + np.nan_to_num(df['涨跌幅'].to_numpy(dtype=float)) / 100, starts)
+    prev_close = close[starts] - np.nan_to_num(df['涨跌额'].to_numpy(dtype=float)[starts])
+    out = {
+        '日期': df['日期'].to_numpy()[ends],
+        '开盘': df['开盘'].to_numpy(dtype=float)[starts],
+        '收盘': close[ends],
+        '最高': high,
+        '最低': low,
+        '成交量': np.add.reduceat(np.nan_to_num(df['成交量'].to_numpy(dtype=float)), starts),
+        '成交额': np.add.reduceat(np.nan_to_num(df['成交额'].to_numpy(dtype=float)), starts),
+        '振幅': np.round((high - low) / prev_close * 100, 2),
+        '涨跌幅': np.round((growth - 1) * 100, 2),
+        '涨跌额': np.round(close[ends] - prev_close, 2),
+        '换手率': np.add.reduceat(np.nan_to_num(df['换手率'].to_numpy(dtype=float)), starts),
+    }
+    if '股票代码' in df:
+        out = {'日期': out.pop('日期'), '股票代码': df['股票代码'].to_numpy()[ends], **out}
+    return add_technical_indicators(pd.DataFrame(out))
 
 # ---------------------------------------------------------
-# 3. 技术指标计算函数
+# 3.7 数据导出 (点击下载时才生成；CSV 分块写出，Parquet 按列压缩)
 # ---------------------------------------------------------
-def calculate_ma(df, periods=[5, 10, 20, 60]):
-    """计算移动平均线"""
-    for period in periods:
-        df[f'MA{period}'] = df['收盘'].rolling(window=period).mean()
-    return df
+# 每次写出的行数，整表不会先拼成一个大字符串或大 Arrow 表
+EXPORT_CHUNK_ROWS = 20_000
+EXPORT_PARQUET_COMPRESSION = "zstd"
 
-def calculate_macd(df, fast=12, slow=26, signal=9):
-    """计算MACD指标"""
-    exp1 = df['收盘'].ewm(span=fast, adjust=False).mean()
-    exp2 = df['收盘'].ewm(span=slow, adjust=False).mean()
-    df['MACD'] = exp1 - exp2
-    df['Signal'] = df['MACD'].ewm(span=signal, adjust=False).mean()
-    df['Histogram'] = df['MACD'] - df['Signal']
-    return df
+def export_columns(df, with_indicators=False):
+    """导出列：日期、代码与行情字段，可选附带技术指标"""
+    cols = ['日期', '股票代码', *ARCHIVE_BAR_FIELDS]
+    if with_indicators:
+        cols += INDICATOR_COLUMNS
+    return [c for c in cols if c in df.columns]
 
-def calculate_rsi(df, period=14):
-    """计算RSI指标"""
-    delta = df['收盘'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
-    df['RSI'] = 100 - (100 / (1 + rs))
-    return df
+def write_csv_chunks(df, fh, chunk_rows=EXPORT_CHUNK_ROWS):
+    """分块写出带 BOM 的 UTF-8 CSV (Excel 可直接打开)"""
+    fh.write(codecs.BOM_UTF8)
+    for start in range(0, max(len(df), 1), chunk_rows):
+        df.iloc[start:start + chunk_rows].to_csv(fh, header=(start == 0), index=False, encoding='utf-8')
 
-def calculate_bollinger_bands(df, period=20, std_dev=2):
-    """计算布林带"""
-    df['BB_Middle'] = df['收盘'].rolling(window=period).mean()
-    std = df['收盘'].rolling(window=period).std()
-    df['BB_Upper'] = df['BB_Middle'] + (std * std_dev)
-    df['BB_Lower'] = df['BB_Middle'] - (std * std_dev)
-    return df
+def write_parquet_chunks(df, fh, chunk_rows=EXPORT_CHUNK_ROWS):
+    """分块写出 Parquet，每块一个行组，保留日期与数值类型"""
+    schema = pa.Schema.from_pandas(df.iloc[:0], preserve_index=False)
+    with pq.ParquetWriter(fh, schema, compression=EXPORT_PARQUET_COMPRESSION) as writer:
+        for start in range(0, len(df), chunk_rows):
+            writer.write_table(pa.Table.from_pandas(df.iloc[start:start + chunk_rows],
+                                                    schema=schema, preserve_index=False))
 
-def add_technical_indicators(df):
-    """添加所有技术指标"""
-    df = calculate_ma(df)
-    df = calculate_macd(df)
-    df = calculate_rsi(df)
-    df = calculate_bollinger_bands(df)
-    return df
+# 格式 -> (扩展名, MIME, 写出函数, 打包进 zip 时的压缩方式；Parquet 已压缩，不再重复压缩)
+EXPORT_FORMATS = {
+    "CSV": ("csv", "text/csv", write_csv_chunks, zipfile.ZIP_DEFLATED),
+    "Parquet": ("parquet", "application/vnd.apache.parquet", write_parquet_chunks, zipfile.ZIP_STORED),
+}
 
-def format_value(val, unit_type='amount'):
-    """金额和数量的单位自动转换及保留两位小数"""
-    try:
-        val = float(val)
-    except (ValueError, TypeError):
-        return "-"
-    
-    if unit_type == 'amount':
-        if abs(val) >= 1e12:
-            return f"{val/1e12:.2f} 万亿"
-        elif abs(val) >= 1e8:
-            return f"{val/1e8:.2f} 亿"
-        elif abs(val) >= 1e4:
-            return f"{val/1e4:.2f} 万"
-        else:
-            return f"{val:.2f} 元"
-    elif unit_type == 'volume':
-        if abs(val) >= 1e12:
-            return f"{val/1e12:.2f} 万亿股"
-        elif abs(val) >= 1e8:
-            return f"{val/1e8:.2f} 亿股"
-        elif abs(val) >= 1e4:
-            return f"{val/1e4:.2f} 万股"
-        else:
-            return f"{val:.2f} 股"
-    return f"{val:.2f}"
+@timed("export.frame")
+def export_frame(df, fmt, with_indicators=False):
+    """把一只股票的行情写成导出文件内容"""
+    buf = io.BytesIO()
+    EXPORT_FORMATS[fmt][2](df[export_columns(df, with_indicators)], buf)
+    return buf.getvalue()
+
+@timed("export.bulk")
+def export_bulk(symbols, start, end, adjust, fmt, with_indicators=False):
+    """逐只取数并直接写进 zip 归档 (每只一个文件)，任一时刻只持有一只股票的行情"""
+    ext, _, writer, compression = EXPORT_FORMATS[fmt]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w', compression=compression) as archive:
+        for sym in symbols:
+            df = get_hist_data(sym, start, end, adjust)
+            if df is None or df.empty:
+                continue
+            with archive.open(f"{sym}.{ext}", 'w') as member:
+                writer(df[export_columns(df, with_indicators)], member)
+            del df
+    return buf.getvalue()
 
 # ---------------------------------------------------------
 # 4. 图表创建函数
 # ---------------------------------------------------------
-def create_candlestick_chart(df, show_ma=True, show_bb=False):
-    """创建K线图"""
+# 单个图表最多下发的K线/数据点数，超过后按周、月或固定宽度分桶
+CHART_MAX_POINTS = 1000
+# 分钟K线的横轴隐藏两个交易时段之间的休市空档 (以小时计)
+INTRADAY_RANGEBREAKS = [
+    dict(bounds=[_minute_of_day(close_t) / 60, _minute_of_day(open_t) / 60], pattern="hour")
+    for (_, close_t), (open_t, _) in zip(TRADING_SESSIONS, TRADING_SESSIONS[1:])
+]
+
+@render_cached
+@timed("chart.candlestick")
+def create_candlestick_chart(df, show_ma=True, show_bb=False, max_points=CHART_MAX_POINTS, intraday=False):
+    """创建K线图 (超过 max_points 根时K线自动分桶、指标线用 LTTB 降采样；intraday 为分钟K线)"""
+    candles, bucket_label = bucket_ohlcv(df, max_points)
     fig = make_subplots(
         rows=3, cols=1, 
         shared_xaxes=True,
         vertical_spacing=0.03,
         row_heights=[0.5, 0.25, 0.25],
-        subplot_titles=('价格走势', 'MACD', 'RSI')
+        subplot_titles=(f'价格走势 ({bucket_label})' if bucket_label else '价格走势', 'MACD', 'RSI')
     )
     
     # K线图
     fig.add_trace(go.Candlestick(
-        x=df['日期'],
-        open=df['开盘'],
-        high=df['最高'],
-        low=df['最低'],
-        close=df['收盘'],
+        x=candles['日期'],
+        open=candles['开盘'],
+        high=candles['最高'],
+        low=candles['最低'],
+        close=candles['收盘'],
         name='K线',
         increasing_line_color='#ef5350',
         decreasing_line_color='#26a69a'
@@ -414,9 +3862,10 @@ def create_candlestick_chart(df, show_ma=True, show_bb=False):
         colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A']
         for i, period in enumerate([5, 10, 20, 60]):
             if f'MA{period}' in df.columns:
+                x, y = lttb_series(df, [f'MA{period}'], max_points)[f'MA{period}']
                 fig.add_trace(go.Scatter(
-                    x=df['日期'],
-                    y=df[f'MA{period}'],
+                    x=x,
+                    y=y,
                     name=f'MA{period}',
                     line=dict(color=colors[i], width=1.5),
                     opacity=0.7
@@ -424,17 +3873,18 @@ def create_candlestick_chart(df, show_ma=True, show_bb=False):
     
     # 布林带
     if show_bb and 'BB_Upper' in df.columns:
+        bands = lttb_series(df, ['BB_Upper', 'BB_Lower'], max_points, ref='BB_Middle')
         fig.add_trace(go.Scatter(
-            x=df['日期'],
-            y=df['BB_Upper'],
+            x=bands['BB_Upper'][0],
+            y=bands['BB_Upper'][1],
             name='布林上轨',
             line=dict(color='rgba(250, 128, 114, 0.5)', width=1),
             showlegend=False
         ), row=1, col=1)
         
         fig.add_trace(go.Scatter(
-            x=df['日期'],
-            y=df['BB_Lower'],
+            x=bands['BB_Lower'][0],
+            y=bands['BB_Lower'][1],
             name='布林下轨',
             line=dict(color='rgba(250, 128, 114, 0.5)', width=1),
             fill='tonexty',
@@ -444,24 +3894,25 @@ def create_candlestick_chart(df, show_ma=True, show_bb=False):
     
     # MACD
     if 'MACD' in df.columns:
+        macd_lines = lttb_series(df, ['MACD', 'Signal'], max_points)
         fig.add_trace(go.Scatter(
-            x=df['日期'],
-            y=df['MACD'],
+            x=macd_lines['MACD'][0],
+            y=macd_lines['MACD'][1],
             name='MACD',
             line=dict(color='#2196F3', width=1.5)
         ), row=2, col=1)
         
         fig.add_trace(go.Scatter(
-            x=df['日期'],
-            y=df['Signal'],
+            x=macd_lines['Signal'][0],
+            y=macd_lines['Signal'][1],
             name='Signal',
             line=dict(color='#FF9800', width=1.5)
         ), row=2, col=1)
         
-        colors = ['#26a69a' if val >= 0 else '#ef5350' for val in df['Histogram']]
+        colors = sign_colors(candles['Histogram'])
         fig.add_trace(go.Bar(
-            x=df['日期'],
-            y=df['Histogram'],
+            x=candles['日期'],
+            y=candles['Histogram'],
             name='Histogram',
             marker_color=colors,
             opacity=0.5
@@ -469,9 +3920,10 @@ def create_candlestick_chart(df, show_ma=True, show_bb=False):
     
     # RSI
     if 'RSI' in df.columns:
+        x, y = lttb_series(df, ['RSI'], max_points)['RSI']
         fig.add_trace(go.Scatter(
-            x=df['日期'],
-            y=df['RSI'],
+            x=x,
+            y=y,
             name='RSI',
             line=dict(color='#9C27B0', width=2)
         ), row=3, col=1)
@@ -511,13 +3963,17 @@ def create_candlestick_chart(df, show_ma=True, show_bb=False):
     
     fig.update_xaxes(showgrid=True, gridwidth=1, gridcolor='rgba(128,128,128,0.2)')
     fig.update_yaxes(showgrid=True, gridwidth=1, gridcolor='rgba(128,128,128,0.2)')
+    if intraday:
+        fig.update_xaxes(rangebreaks=INTRADAY_RANGEBREAKS)
     
     return fig
 
-def create_volume_chart(df):
-    """创建成交量图表"""
-    colors = ['#ef5350' if c >= o else '#26a69a' 
-              for c, o in zip(df['收盘'], df['开盘'])]
+@render_cached
+@timed("chart.volume")
+def create_volume_chart(df, max_points=CHART_MAX_POINTS, intraday=False):
+    """创建成交量图表 (超过 max_points 根时按与K线相同的周期合并；intraday 为分钟K线)"""
+    df, _ = bucket_ohlcv(df, max_points)
+    colors = candle_colors(df['收盘'], df['开盘'])
     
     fig = go.Figure(data=[go.Bar(
         x=df['日期'],
@@ -531,7 +3987,7 @@ def create_volume_chart(df):
         height=300,
         template='plotly_white',
         margin=dict(t=10, b=30, l=50, r=100), # 增加右边距
-        xaxis_title='日期',
+        xaxis_title='时间' if intraday else '日期',
         yaxis_title='成交量',
         # 移至右侧
         legend=dict(
@@ -550,13 +4006,559 @@ def create_volume_chart(df):
             spikethickness=1
         )
     )
+    if intraday:
+        fig.update_xaxes(rangebreaks=INTRADAY_RANGEBREAKS)
     
     return fig
 
+@render_cached
+@timed("chart.equity")
+def create_equity_chart(dates, equity, benchmark):
+    """策略净值与买入持有净值对比图 (附回撤面积)"""
+    drawdown = equity / np.maximum.accumulate(equity) - 1
+    fig = make_subplots(rows=2, cols=1, shared_xaxes=True, vertical_spacing=0.05,
+                        row_heights=[0.7, 0.3])
+    fig.add_trace(go.Scatter(x=dates, y=equity, name='策略净值',
+                             line=dict(color='#667eea', width=2)), row=1, col=1)
+    fig.add_trace(go.Scatter(x=dates, y=benchmark, name='买入持有',
+                             line=dict(color='#94a3b8', width=1.5, dash='dot')), row=1, col=1)
+    fig.add_trace(go.Scatter(x=dates, y=drawdown * 100, name='回撤(%)', fill='tozeroy',
+                             line=dict(color=UP_COLOR, width=1)), row=2, col=1)
+    fig.update_layout(
+        height=450,
+        template='plotly_white',
+        hovermode='x unified',
+        margin=dict(t=10, b=30, l=50, r=100),
+        legend=dict(orientation="v", yanchor="top", y=1, xanchor="left", x=1.02)
+    )
+    fig.update_yaxes(title_text="净值", row=1, col=1)
+    fig.update_yaxes(title_text="回撤(%)", row=2, col=1)
+    return fig
+
+# ---------------------------------------------------------
+# 4.1 自选股监控 (多标的并发获取与汇总)
+# ---------------------------------------------------------
+WATCHLIST_MAX_WORKERS = 8
+
+def parse_watchlist(text):
+    """解析自选股输入 (换行、空格或逗号分隔)，返回 (有效代码, 无效输入)"""
+    tokens = [t for t in re.split(r"[\s,，;；]+", text) if t]
+    valid, invalid = [], []
+    for token in tokens:
+        target = valid if validate_symbol(token) else invalid
+        if token not in target:
+            target.append(token)
+    return valid, invalid
+
+def fetch_watchlist(symbols, start, end, adjust, on_progress=None):
+    """通过有界线程池并发获取多只股票的历史行情与基本面
+
+    上游限速在 fetch_hist_upstream / get_base_info 内按数据源统一控制，
+    这里只负责把请求并发发出去。返回 (历史行情字典, 基本面字典)。
+    """
+    ctx = get_script_run_ctx()
+    hist_map, info_map = {}, {}
+    with ThreadPoolExecutor(max_workers=WATCHLIST_MAX_WORKERS,
+                            initializer=add_script_run_ctx,
+                            initargs=(None, ctx)) as pool:
+        futures = {}
+        for sym in symbols:
+            futures[pool.submit(get_hist_data, sym, start, end, adjust)] = ("hist", sym)
+            futures[pool.submit(get_base_info, sym)] = ("info", sym)
+        for done, fut in enumerate(as_completed(futures), 1):
+            kind, sym = futures[fut]
+            try:
+                result = fut.result()
+            except Exception:
+                # 单只股票的任何异常只让该行显示为失败，不中断整个自选股页
+                logger.warning("自选股 %s 获取%s失败", sym, "行情" if kind == "hist" else "基本面",
+                               exc_info=True)
+                result = None
+            (hist_map if kind == "hist" else info_map)[sym] = result
+            if on_progress:
+                on_progress(done / len(futures))
+    return hist_map, info_map
+
+def build_watchlist_summary(hist_map, info_map):
+    """把多只股票拼成 日期×代码 的宽表，用面板接口一次性计算指标并生成汇总表"""
+    frames = {sym: df.set_index('日期') for sym, df in hist_map.items()
+              if df is not None and not df.empty}
+    if not frames:
+        return pd.DataFrame()
+    closes = pd.DataFrame({sym: f['收盘'] for sym, f in frames.items()}).sort_index()
+    changes = pd.DataFrame({sym: f['涨跌幅'] for sym, f in frames.items()}).sort_index()
+
+    close_arr = closes.to_numpy(dtype=float)
+    panel = compute_panel_indicators(close_arr)
+    last = lambda arr: panel_last_valid(arr, close_arr)
+    last_close = last(close_arr)
+    ma20 = last(panel['MA20'])
+    summary = pd.DataFrame({
+        '代码': closes.columns,
+        '名称': [dict(zip(info_map[s]['item'], info_map[s]['value'])).get('股票简称', '-')
+                 if info_map.get(s) is not None else '-' for s in closes.columns],
+        '最新价': last_close,
+        '涨跌幅': last(changes.to_numpy(dtype=float)),
+        'RSI': last(panel['RSI']),
+        'MACD状态': np.where(last(panel['MACD']) > last(panel['Signal']), '多头', '空头'),
+        'MA20偏离': (last_close - ma20) / ma20 * 100,
+        '最新日期': closes.apply(pd.Series.last_valid_index).dt.date.to_numpy(),
+    })
+    return summary.sort_values('涨跌幅', ascending=False, ignore_index=True)
+
+def render_watchlist_view(symbols, start, end, adjust):
+    """渲染自选股监控页"""
+    progress = st.progress(0.0, text=f"🔄 正在并发同步 {len(symbols)} 只股票...")
+    hist_map, info_map = fetch_watchlist(
+        symbols, start, end, adjust,
+        on_progress=lambda p: progress.progress(p, text=f"🔄 同步进度 {p:.0%}")
+    )
+    progress.empty()
+
+    failed = [s for s in symbols if hist_map.get(s) is None or hist_map[s].empty]
+    if failed:
+        st.warning(f"⚠️ 以下代码未能获取行情: {', '.join(failed)}")
+
+    summary = build_watchlist_summary(hist_map, info_map)
+    if summary.empty:
+        st.error("❌ 数据调取异常：自选股均未获取到行情。")
+        return
+
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("监控标的", f"{len(summary)} 只")
+    with col2:
+        st.metric("上涨家数", f"{int((summary['涨跌幅'] > 0).sum())} 只")
+    with col3:
+        st.metric("下跌家数", f"{int((summary['涨跌幅'] < 0).sum())} 只")
+    with col4:
+        st.metric("平均涨跌幅", f"{summary['涨跌幅'].mean():.2f}%")
+
+    st.dataframe(
+        summary,
+        use_container_width=True,
+        hide_index=True,
+        height=min(38 + 35 * len(summary), 800),
+        column_config={
+            '最新价': st.column_config.NumberColumn(format="¥%.2f"),
+            '涨跌幅': st.column_config.NumberColumn(format="%.2f%%"),
+            'RSI': st.column_config.NumberColumn(format="%.2f"),
+            'MA20偏离': st.column_config.NumberColumn(format="%.2f%%", help="最新价相对 MA20 的偏离"),
+        }
+    )
+
+    # 策略参数扫描：自选股 × 参数网格，按股票分块交给进程池并行计算
+    with st.expander("🔬 策略参数扫描", expanded=False):
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            strategies = st.multiselect("策略", list(BACKTEST_RULES), default=list(BACKTEST_RULES)[:1],
+                                        key="sweep_strategies")
+        with col2:
+            run_sweep = st.button("开始扫描", use_container_width=True, key="sweep_run",
+                                  disabled=not strategies)
+        if run_sweep:
+            closes = {sym: hist_map[sym]['收盘'].to_numpy(dtype=float) for sym in summary['代码']}
+            rules = {name: parameter_grid(BACKTEST_RULES[name][2]) for name in strategies}
+            with st.spinner(f"🔄 正在扫描 {len(closes)} 只股票的参数组合..."):
+                sweep = run_backtest_sweep(closes, rules, pool=get_backtest_pool())
+            pct_cols = ['总收益', '年化收益', '最大回撤', '胜率', '持仓占比']
+            best = sweep.sort_values('总收益', ascending=False).drop_duplicates('代码')
+            best[pct_cols] *= 100
+            st.dataframe(
+                best,
+                hide_index=True,
+                use_container_width=True,
+                column_config={
+                    **{col: st.column_config.NumberColumn(format="%.2f%%") for col in pct_cols},
+                    '夏普比率': st.column_config.NumberColumn(format="%.2f"),
+                    '年换手(倍)': st.column_config.NumberColumn(format="%.1f"),
+                }
+            )
+            st.caption(f"每只股票展示总收益最高的参数组合 (共评估 {len(sweep)} 个组合)。"
+                       "⚠️ 回测基于历史数据，结果不代表未来表现。")
+
+    # 批量导出：点击下载时才逐只写入 zip
+    exported = summary['代码'].tolist()
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        export_fmt = st.selectbox("导出格式", list(EXPORT_FORMATS), key="bulk_export_fmt")
+    with col2:
+        export_ind = st.checkbox("包含技术指标", value=True, key="bulk_export_ind")
+    with col3:
+        st.download_button(
+            f"📦 批量导出 {len(exported)} 只 ({export_fmt}, zip)",
+            data=lambda: export_bulk(exported, start, end, adjust, export_fmt, export_ind),
+            file_name=f"watchlist_{datetime.date.today()}.zip",
+            mime="application/zip",
+            use_container_width=True
+        )
+
+# ---------------------------------------------------------
+# 4.2 自动刷新监视器
+# ---------------------------------------------------------
+def render_live_monitor(keys, interval):
+    """用定时 fragment 检查共享快照版本，只有数据变化时才触发整页重绘
+
+    上游轮询由进程级调度器负责，本会话每次检查只是一次字典查询，
+    不再占用线程 sleep，也不会在数据未变时重跑整个脚本。
+    """
+    scheduler = get_refresh_scheduler()
+    state_key = ("live_versions",) + tuple(keys)
+
+    def monitor():
+        for symbol, adjust in keys:
+            scheduler.watch(symbol, adjust, interval)
+        versions = scheduler.versions(keys)
+        seen = st.session_state.get(state_key)
+        st.session_state[state_key] = versions
+        if seen is not None and any(old is not None and old != new
+                                    for old, new in zip(seen, versions)):
+            st.rerun()
+
+        polled = [s["polled_at"] for s in (scheduler.snapshot(*k) for k in keys) if s]
+        last_poll = (datetime.datetime.fromtimestamp(max(polled), MARKET_TZ).strftime("%H:%M:%S")
+                     if polled else "-")
+        if market_is_live():
+            st.caption(f"🟢 自动刷新中：后台每 {interval} 秒同步一次，最近同步 {last_poll}")
+        else:
+            st.caption(f"⏸️ 当前休市，行情已冻结 (最近同步 {last_poll})")
+
+    st.fragment(monitor, run_every=min(interval, 15))()
+
+# ---------------------------------------------------------
+# 4.3 长区间图表降采样 (K线分桶 + LTTB)
+# ---------------------------------------------------------
+def bucket_ohlcv(df, max_points=CHART_MAX_POINTS):
+    """K线过多时合并为更大周期，返回 (合并后的 DataFrame, 周期说明)
+
+    依次尝试周K、月K，仍超过 max_points 时按固定根数分桶。开盘取首根、
+    最高/最低取极值、收盘取末根，成交量与成交额求和，其余列取末根的值。
+    未超过阈值时原样返回，周期说明为 None。
+    """
+    n = len(df)
+    if n <= max_points:
+        return df, None
+    dates = df['日期']
+    for label, freq in (("周K", "W"), ("月K", "M")):
+        starts = period_starts(dates, freq)
+        if len(starts) <= max_points:
+            break
+    else:
+        size = -(-n // max_points)
+        starts = np.arange(0, n, size)
+        label = f"{size}日K"
+    ends = np.r_[starts[1:], n] - 1
+
+    out = {}
+    for col in df.columns:
+        values = df[col].to_numpy()
+        if col == '开盘':
+            out[col] = values[starts]
+        elif col == '最高':
+            out[col] = np.fmax.reduceat(values.astype(float), starts)
+        elif col == '最低':
+            out[col] = np.fmin.reduceat(values.astype(float), starts)
+        elif col in ('成交量', '成交额'):
+            out[col] = np.add.reduceat(np.nan_to_num(values.astype(float)), starts)
+        else:
+            out[col] = values[ends]
+    return pd.DataFrame(out), label
+
+def lttb_indices(y, n_out):
+    """Largest-Triangle-Three-Buckets 降采样，返回保留点的下标 (横轴取等距序号)"""
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.arange(n, dtype=float)
+    bounds = np.floor(np.arange(n_out - 1) * (n - 2) / (n_out - 2)).astype(np.int64) + 1
+    bounds = np.r_[bounds, n]
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = bounds[i], bounds[i + 1]
+        nxt_lo, nxt_hi = bounds[i + 1], bounds[i + 2]
+        avg_x = x[nxt_lo:nxt_hi].mean()
+        avg_y = y[nxt_lo:nxt_hi].mean()
+        area = np.abs((x[a] - avg_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (avg_y - y[a]))
+        a = lo + int(np.argmax(area))
+        keep[i + 1] = a
+    return keep
+
+def lttb_series(df, cols, max_points=CHART_MAX_POINTS, ref=None):
+    """对指标线降采样，返回 {列名: (x, y)}
+
+    多列共用以 ref (默认第一列) 计算出的下标，保证布林带上下轨等需要
+    逐点对齐的线仍然对齐。未超过阈值时原样返回。
+    """
+    if len(df) <= max_points:
+        return {col: (df['日期'], df[col]) for col in cols}
+    ref_values = df[ref or cols[0]].to_numpy(dtype=float)
+    valid = np.flatnonzero(np.isfinite(ref_values))
+    keep = valid[lttb_indices(ref_values[valid], max_points)]
+    dates = df['日期'].to_numpy()[keep]
+    return {col: (dates, df[col].to_numpy()[keep]) for col in cols}
+
+def box_selected_range(event, first_day, last_day):
+    """从图表的框选事件中取出日期区间 (截到 [first_day, last_day])，没有框选时返回 None"""
+    boxes = ((event or {}).get("selection") or {}).get("box") or []
+    if not boxes or len(boxes[-1].get("x") or []) < 2:
+        return None
+    # 框选端点由浏览器给出，时间部分的精度不固定，逐个解析
+    try:
+        start, end = sorted(pd.Timestamp(x).date() for x in boxes[-1]["x"][:2])
+    except (TypeError, ValueError):
+        return None
+    start, end = max(start, first_day), min(end, last_day)
+    return (start, end) if start <= end else None
+
+# ---------------------------------------------------------
+# 4.4 缓存占用面板
+# ---------------------------------------------------------
+def render_cache_usage():
+    """展示行情缓存、指标引擎与分时缓冲按股票代码的内存占用"""
+    cache = get_data_cache()
+    data_usage = cache.memory_by_symbol()
+    engine_usage = get_indicator_registry().memory_by_symbol()
+    intraday_usage = get_intraday_feeds().memory_by_symbol()
+    symbols = sorted(set(data_usage) | set(engine_usage) | set(intraday_usage))
+    if not symbols:
+        st.caption("暂无缓存数据")
+        return
+    usage = pd.DataFrame({
+        '代码': symbols,
+        '行情(KB)': [data_usage.get(s, 0) / 1024 for s in symbols],
+        '指标(KB)': [engine_usage.get(s, 0) / 1024 for s in symbols],
+        '分时(KB)': [intraday_usage.get(s, 0) / 1024 for s in symbols],
+    })
+    st.caption(f"共 {cache.bytes / 1024 / 1024:.2f} MB / 上限 {cache.max_bytes / 1024 / 1024:.0f} MB")
+    st.dataframe(
+        usage,
+        hide_index=True,
+        use_container_width=True,
+        column_config={
+            '行情(KB)': st.column_config.NumberColumn(format="%.1f"),
+            '指标(KB)': st.column_config.NumberColumn(format="%.1f"),
+            '分时(KB)': st.column_config.NumberColumn(format="%.1f"),
+        }
+    )
+
+# ---------------------------------------------------------
+# 4.5 性能监控面板 (URL 参数 admin=1 时显示)
+# ---------------------------------------------------------
+# Prometheus 导出目标，可为本地文件路径或 Pushgateway 地址；只由部署环境配置，页面上不可修改
+METRICS_EXPORT_TARGET = os.environ.get(
+    "STOCK_APP_METRICS_EXPORT", os.path.join(DATA_DIR, "metrics.prom")
+)
+
+def hit_rate(hits, misses):
+    return hits / (hits + misses) if hits + misses else float("nan")
+
+def collect_component_stats():
+    """汇总行情缓存、请求合并器、刷新调度器的计数，作为 Prometheus gauge"""
+    panel = get_market_panel_handle().get("service")
+    components = {
+        "data_cache": get_data_cache().stats(),
+        "fetch_flight": get_fetch_flight().stats(),
+        "refresh_scheduler": get_refresh_scheduler().stats(),
+        "upstream": get_upstream().stats(),
+        "symbol_directory": get_symbol_directory().stats(),
+        "market_panel": panel.stats() if panel else {},
+        "render_cache": get_render_cache().stats(),
+        "adjust_factors": get_factor_store().stats(),
+        "intraday": get_intraday_feeds().stats(),
+    }
+    return {"component_stat": {
+        (("component", component), ("stat", stat)): value
+        for component, stats in components.items()
+        for stat, value in stats.items()
+    }}
+
+def render_admin_panel():
+    """分阶段耗时分位数、缓存命中率与指标导出"""
+    metrics = get_metrics()
+    cache_stats = get_data_cache().stats()
+    flight_stats = get_fetch_flight().stats()
+
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        cache_hits = cache_stats.get('hits', 0) + cache_stats.get('stale_hits', 0)
+        rate = hit_rate(cache_hits, cache_stats.get('misses', 0))
+        st.metric("行情缓存命中率", f"{rate:.1%}", f"{cache_hits} 命中 / {cache_stats.get('misses', 0)} 未命中")
+    with col2:
+        merged = flight_stats.get('shared', 0) + flight_stats.get('sliced', 0)
+        rate = hit_rate(merged, flight_stats.get('leader', 0))
+        st.metric("并发请求合并率", f"{rate:.1%}", f"{flight_stats.get('leader', 0)} 次上游调用")
+    with col3:
+        engine_hits = metrics.counters['indicator_engine.hits']
+        rate = hit_rate(engine_hits, metrics.counters['indicator_engine.misses'])
+        st.metric("增量指标复用率", f"{rate:.1%}", f"{engine_hits} 次增量更新")
+
+    summary = metrics.summary()
+    if summary.empty:
+        st.caption("暂无埋点数据")
+    else:
+        st.dataframe(
+            summary,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                col: st.column_config.NumberColumn(format="%.2f")
+                for col in ['p50(ms)', 'p95(ms)', '最大(ms)', '累计(s)']
+            }
+        )
+
+    text = metrics.to_prometheus(collect_component_stats())
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        st.caption(f"导出目标: {METRICS_EXPORT_TARGET} (环境变量 STOCK_APP_METRICS_EXPORT)")
+    with col2:
+        if st.button("📤 导出指标", use_container_width=True):
+            try:
+                st.success(f"已导出: {export_prometheus(text, METRICS_EXPORT_TARGET)}")
+            except Exception as e:
+                st.error(f"导出失败: {e}")
+    with col3:
+        if st.button("🧹 清空埋点", use_container_width=True):
+            metrics.reset()
+            st.rerun()
+    st.download_button("📥 下载 Prometheus 文本", data=text.encode("utf-8"),
+                       file_name="stock_app_metrics.prom", mime="text/plain")
+
+# ---------------------------------------------------------
+# 4.6 全市场选股页
+# ---------------------------------------------------------
+SCREENER_EXAMPLES = {
+    "RSI 超卖且站上 MA60": "RSI < 30 and close > MA60",
+    "放量 (换手率超过20日均值2倍)": "turnover > mean(turnover, 20) * 2",
+    "创20日新高": "close > max(ref(high, 1), 20)",
+    "MACD 金叉": "MACD > Signal and ref(MACD, 1) <= ref(Signal, 1)",
+    "跌破布林下轨": "close < BB_Lower",
+}
+
+def render_screener_view():
+    """渲染全市场选股页"""
+    service = get_market_panel()
+    panel = service.panel
+    if not len(panel):
+        progress = service.backfill_progress
+        if progress:
+            st.progress(progress[0] / max(progress[1], 1),
+                        text=f"⏳ 正在回填全市场历史行情 {progress[0]}/{progress[1]}，完成后即可筛选")
+        else:
+            st.info("⏳ 全市场面板尚未建立，后台正在准备数据，请稍后刷新。")
+        return
+
+    st.caption(f"面板: {len(panel.codes)} 只 × {len(panel)} 个交易日 "
+               f"({panel.dates[0]} ~ {panel.dates[-1]}，前复权)，每个交易日收盘后自动追加，"
+               "除权除息日自动调整此前价格")
+
+    example = st.selectbox("常用条件", list(SCREENER_EXAMPLES))
+    col1, col2, col3, col4 = st.columns([4, 2, 1, 1])
+    with col1:
+        condition = st.text_input(
+            "筛选条件", value=SCREENER_EXAMPLES[example],
+            help="字段: close/open/high/low/volume/amount/turnover/pct_chg (或中文列名)、"
+                 "MA5/MA10/MA20/MA60/MACD/Signal/RSI/BB_Upper/BB_Lower 等；"
+                 "函数: mean/std/sum/max/min(字段, 天数)、ref(字段, 天数)、abs；"
+                 "支持 and / or / not 与比较运算"
+        )
+    with col2:
+        rank_by = st.text_input("排序依据", value="turnover / mean(turnover, 20)")
+    with col3:
+        ascending = st.selectbox("排序", ["降序", "升序"]) == "升序"
+    with col4:
+        limit = st.number_input("显示数量", 10, 1000, 100, 10)
+
+    started = time.perf_counter()
+    try:
+        result, total = run_screener(panel, condition, rank_by, ascending, int(limit))
+    except ScreenerExpressionError as e:
+        st.error(f"❌ 表达式错误: {e}")
+        return
+    elapsed = (time.perf_counter() - started) * 1000
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.metric("满足条件", f"{total} 只", f"共 {len(panel.codes)} 只", delta_color="off")
+    with col2:
+        st.metric("筛选耗时", f"{elapsed:.0f} ms")
+    st.dataframe(
+        result,
+        use_container_width=True,
+        hide_index=True,
+        height=min(38 + 35 * max(len(result), 1), 800),
+        column_config={
+            '收盘': st.column_config.NumberColumn(format="¥%.2f"),
+            '涨跌幅': st.column_config.NumberColumn(format="%.2f%%"),
+            '换手率': st.column_config.NumberColumn(format="%.2f%%"),
+            '成交额': st.column_config.NumberColumn(format="%.0f"),
+            '排序值': st.column_config.NumberColumn(format="%.3f"),
+        }
+    )
+
+# ---------------------------------------------------------
+# 4.7 分时看板 (分钟K线，图表与指标取自内存中的分钟缓冲)
+# ---------------------------------------------------------
+def render_intraday_view(symbol, minutes, show_ma=True, show_bb=False):
+    """渲染单股分时看板"""
+    feed = get_intraday_feeds().get(symbol)
+    try:
+        with st.spinner('🔄 正在同步分时行情...'):
+            feed.refresh()
+    except UpstreamError:
+        if feed.summary() is None:
+            st.error("❌ 分时行情调取异常：请确认代码是否正确，或稍后再试。")
+            return
+        st.warning("⚠️ 分时行情同步失败，以下为上次同步的数据。")
+
+    summary = feed.summary()
+    if summary is None:
+        st.info(f"💡 {feed.day} 暂无分时成交 (可能停牌或尚未开盘)。")
+        return
+    df = feed.frame(minutes)
+
+    st.caption(f"{feed.day} 分时行情 · {minutes} 分钟K线 {len(df)} 根 · "
+               f"最新 {summary['日期']:%H:%M}")
+    prev_close = summary['昨收']
+    col1, col2, col3, col4, col5, col6 = st.columns(6)
+    with col1:
+        st.metric(
+            "最新价",
+            f"¥{summary['收盘']:.2f}",
+            f"{(summary['收盘'] / prev_close - 1) * 100:.2f}%" if prev_close else None,
+            delta_color="normal"
+        )
+    with col2:
+        st.metric("今日开盘", f"¥{summary['开盘']:.2f}")
+    with col3:
+        st.metric("今日最高", f"¥{summary['最高']:.2f}")
+    with col4:
+        st.metric("今日最低", f"¥{summary['最低']:.2f}")
+    with col5:
+        st.metric("成交额", format_value(summary['成交额']))
+    with col6:
+        # 成交量单位为手
+        vwap = summary['成交额'] / (summary['成交量'] * 100) if summary['成交量'] else np.nan
+        st.metric("均价", f"¥{vwap:.2f}", help="当日成交额 / 成交股数")
+
+    fig = create_candlestick_chart(df, show_ma, show_bb, intraday=True)
+    with timed("render.chart"):
+        st.plotly_chart(
+            fig,
+            use_container_width=True,
+            config={'scrollZoom': True, 'displaylogo': False}
+        )
+    fig = create_volume_chart(df, intraday=True)
+    with timed("render.chart"):
+        st.plotly_chart(fig, use_container_width=True, config={'displaylogo': False})
+
 # ---------------------------------------------------------
 # 5. 主程序区
 # ---------------------------------------------------------
-if check_password():
+# 仅在 streamlit 运行脚本时渲染页面，便于 benchmark.py 等工具直接导入本模块
+if __name__ == "__main__" and check_password():
+    script_started = time.perf_counter()
     st.set_page_config(
         page_title="金融数据深度查询终端",
         page_icon="📈",
@@ -571,19 +4573,46 @@ if check_password():
     with st.sidebar:
         st.header("⚙️ 终端控制台")
         
-        # 股票代码输入
-        symbol = st.text_input(
-            "证券代码",
-            value="600519",
-            help="请输入6位 A 股数字代码"
-        )
+        view_mode = st.radio("看板模式", ["单股看板", "自选股监控", "全市场选股"], horizontal=True)
+
+        if view_mode == "全市场选股":
+            symbol = ""
+        elif view_mode == "自选股监控":
+            watchlist_text = st.text_area(
+                "自选股列表",
+                value="600519\n000858\n601318\n000333\n600036",
+                height=150,
+                help="每行一个6位代码，也可用空格或逗号分隔"
+            )
+            symbol = ""
+        else:
+            # 股票代码输入 (也可输入简称或拼音首字母检索)
+            symbol = st.text_input(
+                "证券代码",
+                value="600519",
+                help="请输入6位 A 股数字代码，或输入简称 / 拼音首字母检索"
+            ).strip()
+            # 在本地代码目录中校验，无效输入不会发往上游
+            if symbol and not validate_symbol(symbol):
+                directory = get_symbol_directory().directory
+                matches = directory.search(symbol) if directory else []
+                if matches:
+                    symbol = st.selectbox(
+                        "匹配证券",
+                        matches,
+                        format_func=lambda m: f"{m[0]} {m[1]}"
+                    )[0]
+                else:
+                    st.warning("⚠️ 未找到该证券，请检查代码或简称")
+                    symbol = ""
         
         # 日期选择
         col1, col2 = st.columns(2)
         with col1:
             start_date = st.date_input(
                 "起始时间",
-                datetime.date.today() - datetime.timedelta(days=365)
+                datetime.date.today() - datetime.timedelta(days=365),
+                min_value=datetime.date(1990, 12, 19)
             )
         with col2:
             end_date = st.date_input(
@@ -599,6 +4628,13 @@ if check_password():
             help="前复权保持现价连续，适合技术分析。"
         )
         adjust_type = adj_options[adjust_display]
+
+        # K线周期：周/月/季K 由已缓存的日线在本地合并，不产生额外请求；
+        # 分钟K线为最近一个交易日的分时行情
+        timeframe = st.selectbox("K线周期", [*TIMEFRAMES, *INTRADAY_TIMEFRAMES],
+                                 help="周K/月K/季K 由日线合并计算；分钟K线展示当日分时 (单股看板)")
+        intraday_minutes = INTRADAY_TIMEFRAMES.get(timeframe)
+        freq, bar_unit, bars_per_year = TIMEFRAMES.get(timeframe, TIMEFRAMES["日K"])
         
         # 图表选项
         st.divider()
@@ -614,26 +4650,40 @@ if check_password():
         st.divider()
         btn_query = st.button("🔄 手动更新行情", type="primary", use_container_width=True)
         
+        # 内容在页面末尾填充，以反映本次加载后的缓存状态
+        cache_usage_panel = st.expander("🗄️ 缓存占用", expanded=False)
+
         st.divider()
         if st.button("🔒 安全登出", use_container_width=True):
             st.session_state["password_correct"] = False
+            st.session_state.pop("admin_correct", None)
             st.query_params.clear()
             st.rerun()
 
     # 主界面
     st.title("📈 证券行情深度看板")
     
-    if btn_query or symbol:
+    if view_mode == "自选股监控":
+        watch_symbols, invalid_codes = parse_watchlist(watchlist_text)
+        if invalid_codes:
+            st.warning(f"⚠️ 已忽略无效代码: {', '.join(invalid_codes)}")
+        if watch_symbols:
+            render_watchlist_view(watch_symbols, start_date, end_date, adjust_type)
+        else:
+            st.info("💡 请在左侧输入至少一个6位证券代码。")
+    elif view_mode == "全市场选股":
+        render_screener_view()
+    elif symbol and intraday_minutes:
+        render_intraday_view(symbol, intraday_minutes, show_ma, show_bb)
+    elif symbol:
+        info_future, hist_future = submit_symbol_data(symbol, start_date, end_date, adjust_type)
         with st.spinner('🔄 正在同步最新行情数据...'):
-            info_df = get_base_info(symbol)
-            hist_df = get_hist_data(symbol, start_date, end_date, adjust_type)
+            hist_df = hist_future.result()
 
-        if info_df is not None and hist_df is not None and not hist_df.empty:
-            # 添加技术指标
-            hist_df = add_technical_indicators(hist_df)
-            
+        if hist_df is not None and not hist_df.empty:
             # 数据预处理
-            info_dict = dict(zip(info_df['item'], info_df['value']))
+            if freq is not None:
+                hist_df = resample_bars(hist_df, freq)
             latest = hist_df.iloc[-1]
             
             # 显示更新时间
@@ -658,11 +4708,9 @@ if check_password():
             col1, col2, col3, col4 = st.columns(4)
             
             with col1:
-                st.metric(
-                    "公司简称",
-                    info_dict.get("股票简称", "未知"),
-                    help=f"代码: {symbol}"
-                )
+                # 基本面可能晚于行情到达，先占位，页面末尾再填充
+                company_slot = st.empty()
+                company_slot.metric("公司简称", "加载中…", help=f"代码: {symbol}")
             
             with col2:
                 price_delta = latest['涨跌幅']
@@ -687,20 +4735,21 @@ if check_password():
                     help="当日成交量占流通股本比例"
                 )
 
-            # 第二行：盘中价格
+            # 第二行：盘中价格 (周/月/季K 时为本周期与上一周期)
+            this_bar, prev_bar = ("今日", "昨日") if freq is None else (f"本{bar_unit}", f"上{bar_unit}")
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("今日开盘", f"¥{latest['开盘']:.2f}")
+                st.metric(f"{this_bar}开盘", f"¥{latest['开盘']:.2f}")
             with col2:
-                st.metric("今日最高", f"¥{latest['最高']:.2f}")
+                st.metric(f"{this_bar}最高", f"¥{latest['最高']:.2f}")
             with col3:
-                st.metric("今日最低", f"¥{latest['最低']:.2f}")
+                st.metric(f"{this_bar}最低", f"¥{latest['最低']:.2f}")
             with col4:
                 if len(hist_df) > 1:
                     prev_close = hist_df.iloc[-2]['收盘']
-                    st.metric("昨日收盘", f"¥{prev_close:.2f}")
+                    st.metric(f"{prev_bar}收盘", f"¥{prev_close:.2f}")
                 else:
-                    st.metric("昨日收盘", "-")
+                    st.metric(f"{prev_bar}收盘", "-")
             
             
             # 第二行：技术指标
@@ -740,185 +4789,293 @@ if check_password():
                 up_days = len(hist_df[hist_df['涨跌幅'] > 0])
                 total_days = len(hist_df)
                 win_rate = (up_days / total_days * 100) if total_days > 0 else 0
-                st.metric("上涨天数占比", f"{win_rate:.2f}%", f"{up_days}/{total_days}天")
+                st.metric(f"上涨{bar_unit}数占比", f"{win_rate:.2f}%", f"{up_days}/{total_days}{bar_unit}")
 
             # --- 第二部分：深度基本面 ---
             with st.expander("📋 更多维度基本面数据", expanded=False):
-                col_a, col_b, col_c, col_d = st.columns(4)
-                
-                with col_a:
-                    st.write(f"**总市值**: {format_value(info_dict.get('总市值', 0))}")
-                    st.write(f"**流通市值**: {format_value(info_dict.get('流通市值', 0))}")
-                
-                with col_b:
-                    st.write(f"**市盈率 (静)**: {info_dict.get('市盈率-动态', '-')}")
-                    st.write(f"**市净率 (P/B)**: {info_dict.get('市净率', '-')}")
-                
-                with col_c:
-                    st.write(f"**总股本**: {format_value(info_dict.get('总股本', 0), 'volume')}")
-                    st.write(f"**流通股本**: {format_value(info_dict.get('流通股本', 0), 'volume')}")
-                
-                with col_d:
-                    st.write(f"**每股收益**: {info_dict.get('每股收益', '-')}")
-                    st.write(f"**每股净资产**: {info_dict.get('每股净资产', '-')}")
+                fundamentals_slot = st.empty()
+                fundamentals_slot.caption("⏳ 基本面数据加载中…")
 
             # --- 第三部分：可视化与明细 ---
-            tab_chart, tab_volume, tab_raw, tab_profile = st.tabs([
+            # 切换标签时重跑脚本，只执行当前标签的内容；其余标签的图表与表格
+            # 在切回时从渲染缓存取用
+            tab_chart, tab_volume, tab_backtest, tab_raw, tab_profile = st.tabs([
                 "技术分析图表",
                 " 成交量分析", 
+                " 策略回测",
                 " 历史明细",
                 " 企业档案"
-            ])
-
-            with tab_chart:
-                # --- 区间统计数据计算 ---
-                p_high = hist_df['最高'].max()
-                p_low = hist_df['最低'].min()
-                p_start_price = hist_df.iloc[0]['收盘']
-                p_end_price = latest['收盘']
-                p_return = (p_end_price - p_start_price) / p_start_price * 100
-                p_amplitude = (p_high - p_low) / p_start_price * 100
-                p_avg_turnover = hist_df['成交额'].mean()
-
-                # 区间指标展示
-                st.markdown("<div style='margin-bottom: 1rem;'></div>", unsafe_allow_html=True)
-                c1, c2, c3, c4, c5 = st.columns(5)
-                with c1:
-                    st.metric("区间最高", f"¥{p_high:.2f}")
-                with c2:
-                    st.metric("区间最低", f"¥{p_low:.2f}")
-                with c3:
-                    st.metric("区间涨跌", f"{p_return:.2f}%", delta_color="normal")
-                with c4:
-                    st.metric("区间振幅", f"{p_amplitude:.2f}%")
-                with c5:
-                    st.metric("日均成交额", format_value(p_avg_turnover))
+            ], key="detail_tab", on_change="rerun")
+            profile_slot = None
+
+            if tab_chart.open:
+                with tab_chart:
+                    # --- 区间统计数据计算 ---
+                    p_high = hist_df['最高'].max()
+                    p_low = hist_df['最低'].min()
+                    p_start_price = hist_df.iloc[0]['收盘']
+                    p_end_price = latest['收盘']
+                    p_return = (p_end_price - p_start_price) / p_start_price * 100
+                    p_amplitude = (p_high - p_low) / p_start_price * 100
+                    p_avg_turnover = hist_df['成交额'].mean()
+
+                    # 区间指标展示
+                    st.markdown("<div style='margin-bottom: 1rem;'></div>", unsafe_allow_html=True)
+                    c1, c2, c3, c4, c5 = st.columns(5)
+                    with c1:
+                        st.metric("区间最高", f"¥{p_high:.2f}")
+                    with c2:
+                        st.metric("区间最低", f"¥{p_low:.2f}")
+                    with c3:
+                        st.metric("区间涨跌", f"{p_return:.2f}%", delta_color="normal")
+                    with c4:
+                        st.metric("区间振幅", f"{p_amplitude:.2f}%")
+                    with c5:
+                        st.metric("日均成交额", format_value(p_avg_turnover))
                 
-                st.plotly_chart(
-                    create_candlestick_chart(hist_df, show_ma, show_bb),
-                    use_container_width=True,
-                    config={
-                        'scrollZoom': True,
-                        'displaylogo': False,
-                        'modeBarButtonsToAdd': ['drawline', 'drawopenpath', 'eraseshape']
-                    }
-                )
+                    # 长区间默认展示合并后的K线，在图中框选或拖动滑块缩小区间后
+                    # 按新区间重新取数，不超过阈值时即为逐日K线
+                    chart_df = hist_df
+                    select_args = {}
+                    if len(hist_df) > CHART_MAX_POINTS:
+                        first_day = hist_df['日期'].iloc[0].date()
+                        last_day = hist_df['日期'].iloc[-1].date()
+                        zoom_key = f"chart_zoom_{symbol}_{first_day}_{last_day}"
+                        select_key = f"chart_select_{symbol}_{first_day}_{last_day}"
+                        # 框选事件在重跑后仍保留，只在框选区间变化时覆盖滑块，之后仍可拖动滑块
+                        box = box_selected_range(st.session_state.get(select_key), first_day, last_day)
+                        if box is not None and st.session_state.get(select_key + "_applied") != box:
+                            st.session_state[select_key + "_applied"] = box
+                            st.session_state[zoom_key] = box
+                        st.session_state.setdefault(zoom_key, (first_day, last_day))
+                        zoom = st.slider(
+                            "🔍 图表区间",
+                            min_value=first_day,
+                            max_value=last_day,
+                            format="YYYY-MM-DD",
+                            key=zoom_key,
+                            help=f"区间内超过 {CHART_MAX_POINTS} 根K线时自动合并为周K/月K，缩小区间可查看逐日明细"
+                        )
+                        st.caption("💡 在图中框选一段区间即可载入该区间的逐日K线，把滑块拖回两端恢复全区间")
+                        chart_df = slice_hist(hist_df, zoom[0], zoom[1])
+                        select_args = dict(on_select="rerun", selection_mode="box", key=select_key)
+
+                    fig = create_candlestick_chart(chart_df, show_ma, show_bb)
+                    with timed("render.chart"):
+                        st.plotly_chart(
+                            fig,
+                            use_container_width=True,
+                            config={
+                                'scrollZoom': True,
+                                'displaylogo': False,
+                                'modeBarButtonsToAdd': ['drawline', 'drawopenpath', 'eraseshape']
+                            },
+                            **select_args
+                        )
                 
-                # 新手导读
-                with st.expander("📚 投资视角：指标入门导读", expanded=False):
-                    st.markdown("""
-                    ### 🔍 如何解读这些指标？
+                    # 新手导读
+                    with st.expander("📚 投资视角：指标入门导读", expanded=False):
+                        st.markdown("""
+                        ### 🔍 如何解读这些指标？
                     
-                    *   **移动平均线 (MA)**: 趋势的“指南铁”。MA5/MA10 反应短期热度，MA20/MA60 代表中期趋势。
-                        - *金叉*: 短期线上穿长期线，通常视为看多信号。
-                        - *死叉*: 短期线下穿长期线，通常视为风险信号。
+                        *   **移动平均线 (MA)**: 趋势的“指南铁”。MA5/MA10 反应短期热度，MA20/MA60 代表中期趋势。
+                            - *金叉*: 短期线上穿长期线，通常视为看多信号。
+                            - *死叉*: 短期线下穿长期线，通常视为风险信号。
                     
-                    *   **MACD (平滑异同移动平均线)**: 趋势的“加速器”。
-                        - *红柱放量*: 动能增强；*绿柱出现*: 调整开始。
-                        - *金叉/死叉*: 辅助判断趋势的反转点。
+                        *   **MACD (平滑异同移动平均线)**: 趋势的“加速器”。
+                            - *红柱放量*: 动能增强；*绿柱出现*: 调整开始。
+                            - *金叉/死叉*: 辅助判断趋势的反转点。
                     
-                    *   **RSI (相对强弱指标)**: 市场的“温度计”。
-                        - *高于 70*: 处于“超买”状态，警惕回调风险。
-                        - *低于 30*: 处于“超卖”状态，可能存在反弹机会。
+                        *   **RSI (相对强弱指标)**: 市场的“温度计”。
+                            - *高于 70*: 处于“超买”状态，警惕回调风险。
+                            - *低于 30*: 处于“超卖”状态，可能存在反弹机会。
                     
-                    *   **布林带 (Bollinger Bands)**: 价格的“护栏”。
-                        - 股价运行在 **中轨** 之上为强势，触碰 **上轨** 有回踩压力，企稳 **下轨** 有反弹可能。
-                    """)
-
-            with tab_volume:
-                st.plotly_chart(
-                    create_volume_chart(hist_df),
-                    use_container_width=True,
-                    config={'displaylogo': False}
-                )
-                
-                # 成交量统计
-                st.markdown("#### 📊 成交量统计")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    avg_volume = hist_df['成交量'].mean()
-                    st.metric("平均成交量", format_value(avg_volume, 'volume'))
-                with col2:
-                    max_volume = hist_df['成交量'].max()
-                    st.metric("最大成交量", format_value(max_volume, 'volume'))
-                with col3:
-                    avg_amount = hist_df['成交额'].mean()
-                    st.metric("平均成交额", format_value(avg_amount))
-
-            with tab_raw:
-                st.write("#### 📋 历史交易明细")
-                
-                # 数据筛选
-                col1, col2 = st.columns([3, 1])
-                with col1:
-                    search_date = st.date_input("筛选日期", value=None, key="search_date")
-                with col2:
-                    sort_order = st.selectbox("排序", ["降序", "升序"])
-                
-                display_df = hist_df.copy()
-                if search_date:
-                    display_df = display_df[display_df['日期'].dt.date == search_date]
-                
-                ascending = (sort_order == "升序")
-                display_df = display_df.sort_values(by="日期", ascending=ascending)
-                
-                # 格式化显示
-                st.dataframe(
-                    display_df.style.format({
-                        '开盘': '¥{:.2f}',
-                        '收盘': '¥{:.2f}',
-                        '最高': '¥{:.2f}',
-                        '最低': '¥{:.2f}',
-                        '涨跌幅': '{:.2f}%',
-                        '换手率': '{:.2f}%',
-                        '成交量': lambda x: format_value(x, 'volume'),
-                        '成交额': lambda x: format_value(x, 'amount')
-                    }),
-                    use_container_width=True,
-                    height=400
-                )
+                        *   **布林带 (Bollinger Bands)**: 价格的“护栏”。
+                            - 股价运行在 **中轨** 之上为强势，触碰 **上轨** 有回踩压力，企稳 **下轨** 有反弹可能。
+                        """)
+
+            if tab_volume.open:
+                with tab_volume:
+                    fig = create_volume_chart(hist_df)
+                    with timed("render.chart"):
+                        st.plotly_chart(
+                            fig,
+                            use_container_width=True,
+                            config={'displaylogo': False}
+                        )
                 
-                # 下载按钮
-                csv = hist_df.to_csv(index=False).encode('utf-8-sig')
-                st.download_button(
-                    "📥 导出历史数据 (CSV)",
-                    data=csv,
-                    file_name=f"{symbol}_history_{datetime.date.today()}.csv",
-                    mime="text/csv",
-                    use_container_width=True
-                )
+                    # 成交量统计
+                    st.markdown("#### 📊 成交量统计")
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        avg_volume = hist_df['成交量'].mean()
+                        st.metric("平均成交量", format_value(avg_volume, 'volume'))
+                    with col2:
+                        max_volume = hist_df['成交量'].max()
+                        st.metric("最大成交量", format_value(max_volume, 'volume'))
+                    with col3:
+                        avg_amount = hist_df['成交额'].mean()
+                        st.metric("平均成交额", format_value(avg_amount))
+
+            if tab_backtest.open:
+                with tab_backtest:
+                    st.write("#### 🧪 指标策略回测")
+                    col1, col2, col3 = st.columns([2, 1, 1])
+                    with col1:
+                        strategy = st.selectbox("策略", list(BACKTEST_RULES), help="信号在当日收盘产生，次日按收盘价持有")
+                    with col2:
+                        fee = st.number_input("单边佣金 (‰)", 0.0, 5.0, BACKTEST_FEE * 1000, 0.1) / 1000
+                    with col3:
+                        slippage = st.number_input("单边滑点 (‰)", 0.0, 5.0, BACKTEST_SLIPPAGE * 1000, 0.1) / 1000
+
+                    features = SignalFeatures.from_frame(hist_df)
+                    rule, defaults, grid = BACKTEST_RULES[strategy]
+                    with timed("backtest"):
+                        result, equity = evaluate_positions(
+                            features.close, rule(features, **defaults)[:, None], fee, slippage, bars_per_year
+                        )
+                    c1, c2, c3, c4, c5 = st.columns(5)
+                    with c1:
+                        st.metric("策略总收益", f"{result['总收益'][0]:.2%}",
+                                  f"买入持有 {features.close[-1] / features.close[0] - 1:.2%}", delta_color="off")
+                    with c2:
+                        st.metric("最大回撤", f"{result['最大回撤'][0]:.2%}")
+                    with c3:
+                        win = result['胜率'][0]
+                        st.metric("胜率", f"{win:.2%}" if np.isfinite(win) else "-",
+                                  f"{result['交易次数'][0]} 笔交易", delta_color="off")
+                    with c4:
+                        st.metric("年换手", f"{result['年换手(倍)'][0]:.1f} 倍")
+                    with c5:
+                        st.metric("夏普比率", f"{result['夏普比率'][0]:.2f}")
+
+                    fig = create_equity_chart(hist_df['日期'], equity[:, 0],
+                                              features.close / features.close[0])
+                    with timed("render.chart"):
+                        st.plotly_chart(fig, use_container_width=True, config={'displaylogo': False})
 
-            with tab_profile:
-                st.write("#### 🏢 核心基本面清单")
+                    st.markdown("#### 🔬 参数扫描")
+                    with timed("backtest"):
+                        sweep = backtest_grid(features, {strategy: parameter_grid(grid)}, fee, slippage,
+                                              bars_per_year)
+                    pct_cols = ['总收益', '年化收益', '最大回撤', '胜率', '持仓占比']
+                    sweep_table = sweep.drop(columns='策略').sort_values('总收益', ascending=False)
+                    sweep_table[pct_cols] *= 100
+                    st.dataframe(
+                        sweep_table,
+                        hide_index=True,
+                        use_container_width=True,
+                        column_config={
+                            **{col: st.column_config.NumberColumn(format="%.2f%%") for col in pct_cols},
+                            '夏普比率': st.column_config.NumberColumn(format="%.2f"),
+                            '年换手(倍)': st.column_config.NumberColumn(format="%.1f"),
+                        }
+                    )
+                    st.caption("⚠️ 回测基于历史数据，未考虑涨跌停无法成交等情形，结果不代表未来表现。")
+
+            if tab_raw.open:
+                with tab_raw:
+                    st.write("#### 📋 历史交易明细")
                 
-                # 美化展示
-                display_info = info_df.copy()
-                display_info.columns = ['项目', '数值']
+                    # 数据筛选：选一天即按日查找，选两天为区间
+                    col1, col2, col3 = st.columns([3, 1, 1])
+                    with col1:
+                        search_range = st.date_input("筛选日期", value=(), key="search_date")
+                    with col2:
+                        sort_order = st.selectbox("排序", ["降序", "升序"])
+                    search_start = search_range[0] if search_range else None
+                    search_end = search_range[-1] if search_range else None
+
+                    lo, hi = history_range(hist_df, search_start, search_end)
+                    n_pages = page_count(hi - lo)
+                    with col3:
+                        page = st.number_input("页码", min_value=1, max_value=n_pages, value=1, step=1)
+                    page_df = history_page(hist_df, lo, hi, descending=(sort_order == "降序"), page=page)
+                    st.caption(f"共 {hi - lo} 条，第 {page}/{n_pages} 页")
+
+                    # 格式化显示 (只处理当页)
+                    history_table = format_history_table(page_df)
+                    with timed("render.table"):
+                        st.dataframe(
+                            history_table,
+                            column_config=HISTORY_COLUMN_CONFIG,
+                            use_container_width=True,
+                            height=400
+                        )
                 
-                # 对数值列进行单位转换
-                def smart_format(row):
-                    item = row['项目']
-                    val = row['数值']
-                    # 识别需要单位转换的项目
-                    amount_items = ['总市值', '流通市值', '成交额']
-                    volume_items = ['总股本', '流通股本', '成交量']
+                    # 导出筛选区间：点击下载时才生成文件内容
+                    col1, col2, col3 = st.columns([1, 1, 2])
+                    with col1:
+                        export_fmt = st.selectbox("导出格式", list(EXPORT_FORMATS), key="export_fmt")
+                    with col2:
+                        export_ind = st.checkbox("包含技术指标", value=True, key="export_ind")
+                    ext, mime = EXPORT_FORMATS[export_fmt][:2]
+                    with col3:
+                        st.download_button(
+                            f"📥 导出历史数据 ({export_fmt})",
+                            data=lambda: export_frame(hist_df.iloc[lo:hi], export_fmt, export_ind),
+                            file_name=f"{symbol}_history_{datetime.date.today()}.{ext}",
+                            mime=mime,
+                            use_container_width=True
+                        )
+
+            if tab_profile.open:
+                with tab_profile:
+                    st.write("#### 🏢 核心基本面清单")
+                    profile_slot = st.empty()
+                    profile_slot.caption("⏳ 基本面数据加载中…")
+
+            # --- 基本面到达后填充占位 ---
+            info_df = info_future.result()
+            if info_df is not None:
+                info_dict = dict(zip(info_df['item'], info_df['value']))
+                company_slot.metric("公司简称", info_dict.get("股票简称", "未知"), help=f"代码: {symbol}")
+
+                with fundamentals_slot.container():
+                    col_a, col_b, col_c, col_d = st.columns(4)
+                    
+                    with col_a:
+                        st.write(f"**总市值**: {format_value(info_dict.get('总市值', 0))}")
+                        st.write(f"**流通市值**: {format_value(info_dict.get('流通市值', 0))}")
+                    
+                    with col_b:
+                        st.write(f"**市盈率 (静)**: {info_dict.get('市盈率-动态', '-')}")
+                        st.write(f"**市净率 (P/B)**: {info_dict.get('市净率', '-')}")
                     
-                    if any(x in item for x in amount_items):
-                        return format_value(val, 'amount')
-                    elif any(x in item for x in volume_items):
-                        return format_value(val, 'volume')
-                    return val
+                    with col_c:
+                        st.write(f"**总股本**: {format_value(info_dict.get('总股本', 0), 'volume')}")
+                        st.write(f"**流通股本**: {format_value(info_dict.get('流通股本', 0), 'volume')}")
+                    
+                    with col_d:
+                        st.write(f"**每股收益**: {info_dict.get('每股收益', '-')}")
+                        st.write(f"**每股净资产**: {info_dict.get('每股净资产', '-')}")
 
-                display_info['数值'] = display_info.apply(smart_format, axis=1)
-                
-                st.dataframe(
-                    display_info,
-                    use_container_width=True,
-                    height=500,
-                    hide_index=True
-                )
+                # 美化展示 (企业档案标签未打开时跳过)
+                if profile_slot is not None:
+                    display_info = info_df.copy()
+                    display_info.columns = ['项目', '数值']
+
+                    # 对数值列进行单位转换
+                    display_info['数值'] = format_profile_values(display_info['项目'], display_info['数值'])
+
+                    with timed("render.table"):
+                        profile_slot.dataframe(
+                            display_info,
+                            use_container_width=True,
+                            height=500,
+                            hide_index=True
+                        )
+            else:
+                company_slot.metric("公司简称", "未知", help=f"代码: {symbol}")
+                fundamentals_slot.warning("⚠️ 基本面数据暂不可用，行情与图表不受影响。")
+                if profile_slot is not None:
+                    profile_slot.warning("⚠️ 基本面数据暂不可用，请稍后刷新重试。")
         else:
-            st.error("❌ 数据调取异常：请确认代码是否正确，或接口正处于维护状态。")
+            open_endpoints = get_upstream().open_endpoints()
+            if open_endpoints:
+                st.error(f"❌ 上游接口连续失败已暂时熔断 ({', '.join(open_endpoints)})，请稍后再试。")
+            else:
+                st.error("❌ 数据调取异常：请确认代码是否正确，或接口正处于维护状态。")
     else:
         # 欢迎页面
         st.info("💡 请在左侧控制台输入证券代码以获取深度行情。")
@@ -927,9 +5084,10 @@ if check_password():
         ### 🎯 功能特色
         
         - **实时行情**: 获取最新的股票价格和交易数据
+        - **分时行情**: 1/5/15/30/60 分钟K线，盘中逐分钟增量更新
         - **技术分析**: 支持MA、MACD、RSI、布林带等多种技术指标
         - **数据可视化**: 交互式K线图和成交量分析
-        - **数据导出**: 支持历史数据CSV格式导出
+        - **数据导出**: 历史数据可导出为 CSV 或 Parquet，可选附带技术指标；自选股可批量打包为 zip 导出
         - **移动友好**: 响应式设计，支持手机端访问
         
         ### 📖 使用说明
@@ -944,7 +5102,21 @@ if check_password():
     st.divider()
     st.caption("⚠️ 注：本终端数据同步自公开市场，仅供参考，不构成任何投资建议。")
 
-    # 自动刷新逻辑
+    with cache_usage_panel:
+        render_cache_usage()
+
+    get_metrics().observe("script", time.perf_counter() - script_started)
+    if st.query_params.get("admin") == "1":
+        with st.expander("🛠️ 性能监控", expanded=True):
+            if check_admin():
+                render_admin_panel()
+
+    # 自动刷新逻辑：由后台调度器统一轮询，本会话只在数据变化时重绘
     if auto_refresh:
-        time.sleep(refresh_interval)
-        st.rerun()
+        if view_mode == "自选股监控":
+            live_keys = [(s, adjust_type) for s in watch_symbols]
+        else:
+            live_adjust = INTRADAY_ADJUST if intraday_minutes else adjust_type
+            live_keys = [(symbol, live_adjust)] if symbol else []
+        if live_keys:
+            render_live_monitor(live_keys, refresh_interval)
@@ -0,0 +1,83 @@
+"""
+测试公共夹具
+
+用法:
+    python -m pytest -q tests
+
+与 benchmark.py 相同，按文件路径导入 stock.app.py (文件名含点号，无法直接 import)。
+本地仓库目录指向临时目录，数据源使用离线回放，测试不访问任何上游接口。
+"""
+import datetime
+import importlib.util
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "stock.app.py")
+# stock.app.py 与 backtest 等同级模块按仓库根目录导入 (streamlit run 时脚本目录同样在 sys.path 中)
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope="session")
+def app():
+    os.environ["STOCK_APP_DATA_DIR"] = tempfile.mkdtemp(prefix="stock_app_test_")
+    os.environ["STOCK_APP_DATA_SOURCE"] = "replay"
+    spec = importlib.util.spec_from_file_location("stock_app", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def synthetic_bars(symbol, start, end):
+    """[start, end] 内每个工作日一根确定性的K线 (列名与 stock_zh_a_hist 一致)"""
+    days = pd.bdate_range(start, end)
+    ordinal = np.array([d.toordinal() for d in days.date], dtype=float)
+    close = np.round(20 + 5 * np.sin(ordinal / 7) + (ordinal % 13) / 10, 2)
+    prev = np.round(20 + 5 * np.sin((ordinal - 1) / 7) + ((ordinal - 1) % 13) / 10, 2)
+    return pd.DataFrame({
+        '日期': days,
+        '股票代码': symbol,
+        '开盘': prev,
+        '收盘': close,
+        '最高': np.maximum(prev, close) + 0.1,
+        '最低': np.minimum(prev, close) - 0.1,
+        '成交量': (ordinal % 1000 + 1000).astype(np.int64),
+        '成交额': ordinal * 100.0,
+        '振幅': np.round((np.abs(close - prev) + 0.2) / prev * 100, 2),
+        '涨跌幅': np.round((close / prev - 1) * 100, 2),
+        '涨跌额': np.round(close - prev, 2),
+        '换手率': np.round(ordinal % 7 / 10, 2),
+    })
+
+
+class StubFetcher:
+    """BarStore 的桩取数函数：返回合成K线并记录每次请求的区间"""
+
+    def __init__(self, app):
+        self.app = app
+        self.calls = []
+
+    def __call__(self, symbol, start, end, adjust):
+        self.calls.append((start, end))
+        return self.app.compact_hist_frame(synthetic_bars(symbol, start, end))
+
+
+@pytest.fixture
+def stub_fetcher(app):
+    return StubFetcher(app)
+
+
+@pytest.fixture
+def bar_store(app, stub_fetcher, tmp_path):
+    return app.BarStore(str(tmp_path), stub_fetcher)
+
+
+@pytest.fixture
+def daily_frame():
+    """一段日线 (float64)，供指标、合并周期与导出测试使用"""
+    return synthetic_bars("600000", datetime.date(2024, 1, 2), datetime.date(2024, 12, 31))
@@ -0,0 +1,61 @@
+"""归档追加与表头扩展：已提供的指标不随归档变化，并与全量重算一致"""
+import datetime
+
+import numpy as np
+
+from conftest import synthetic_bars
+
+D = datetime.date
+
+
+def test_head_extension_keeps_served_indicators(app, bar_store):
+    before = bar_store.get("600000", D(2024, 3, 1), D(2024, 6, 28), "qfq")
+    before = {col: before[col].to_numpy().copy() for col in app.INDICATOR_COLUMNS}
+
+    bar_store.get("600000", D(2023, 1, 3), D(2024, 6, 28), "qfq")
+    after = bar_store.get("600000", D(2024, 3, 1), D(2024, 6, 28), "qfq")
+
+    for col in app.INDICATOR_COLUMNS:
+        np.testing.assert_allclose(after[col].to_numpy(), before[col], atol=1e-4, err_msg=col)
+
+
+def test_indicators_match_full_recompute(app, bar_store):
+    df = bar_store.get("600000", D(2024, 1, 2), D(2024, 12, 31), "qfq")
+
+    full = app.add_technical_indicators(app.expand_hist_frame(app.compact_hist_frame(
+        synthetic_bars("600000", D(2024, 1, 2) - datetime.timedelta(days=app.ARCHIVE_HEAD_WARMUP_DAYS),
+                       D(2024, 12, 31)))))
+    full = full[full['日期'] >= '2024-01-02']
+    for col in app.INDICATOR_COLUMNS:
+        np.testing.assert_allclose(df[col].to_numpy(), full[col].to_numpy(), rtol=1e-9, err_msg=col)
+
+
+def test_tail_append_computes_only_new_bars(app, bar_store, monkeypatch):
+    bar_store.get("600000", D(2020, 1, 2), D(2024, 6, 28), "qfq")
+    lengths = []
+    full_compute = app.add_technical_indicators
+
+    def spy(df, *args, **kwargs):
+        lengths.append(len(df))
+        return full_compute(df, *args, **kwargs)
+    monkeypatch.setattr(app, "add_technical_indicators", spy)
+
+    df = bar_store.get("600000", D(2024, 1, 2), D(2024, 12, 31), "qfq")
+
+    # 只对归档末尾的预热窗口调用一次全量计算，不随归档长度增长
+    assert lengths and max(lengths) <= app.ARCHIVE_WARMUP
+    full = full_compute(app.expand_hist_frame(app.compact_hist_frame(
+        synthetic_bars("600000", D(2020, 1, 2) - datetime.timedelta(days=app.ARCHIVE_HEAD_WARMUP_DAYS),
+                       D(2024, 12, 31)))))
+    full = full[full['日期'] >= '2024-01-02']
+    for col in app.INDICATOR_COLUMNS:
+        np.testing.assert_allclose(df[col].to_numpy(), full[col].to_numpy(), rtol=1e-9, err_msg=col)
+
+
+def test_memory_maps_are_bounded(app, stub_fetcher, tmp_path):
+    store = app.BarStore(str(tmp_path), stub_fetcher, max_cached=2)
+    for symbol in ("600000", "600001", "600002"):
+        store.get(symbol, D(2024, 3, 1), D(2024, 3, 29), "qfq")
+
+    assert list(store._maps) == [("600001", "qfq"), ("600002", "qfq")]
+    assert len(store.get("600000", D(2024, 3, 1), D(2024, 3, 29), "qfq")) == 21
@@ -0,0 +1,87 @@
+"""向量化回测：净值、成本与交易统计按定义计算"""
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+
+
+def test_equity_follows_next_bar_positions_with_costs(app):
+    close = np.array([10.0, 11.0, 12.1, 10.89, 11.979, 11.979])
+    target = np.array([1, 1, 0, 0, 1, 0], dtype=float)
+    fee, slippage = 0.001, 0.002
+
+    metrics, equity = app.evaluate_positions(close, target, fee, slippage)
+
+    # 信号次日生效：持仓 [0, 1, 1, 0, 0, 1]；换仓当日扣 fee + slippage
+    held = np.array([0, 1, 1, 0, 0, 1], dtype=float)
+    ret = np.r_[0, close[1:] / close[:-1] - 1]
+    cost = np.abs(np.diff(held, prepend=0)) * (fee + slippage)
+    expected = np.cumprod(1 + held * ret - cost)
+    np.testing.assert_allclose(equity[:, 0], expected)
+    assert metrics['总收益'][0] == pytest.approx(expected[-1] - 1)
+    assert metrics['交易次数'][0] == 2
+    # 第一笔 (+10%, +10%, 离场) 盈利；第二笔 (持平) 只有成本，亏损
+    assert metrics['胜率'][0] == pytest.approx(0.5)
+    assert metrics['最大回撤'][0] == pytest.approx((expected / np.maximum.accumulate(expected) - 1).min())
+    assert metrics['持仓占比'][0] == pytest.approx(held.mean())
+
+
+def test_columns_are_evaluated_independently(app):
+    close = 10 * np.exp(np.cumsum(np.random.default_rng(1).normal(0, 0.02, 200)))
+    positions = np.random.default_rng(2).integers(0, 2, (200, 3)).astype(float)
+
+    metrics, equity = app.evaluate_positions(close, positions)
+
+    for j in range(3):
+        single, single_equity = app.evaluate_positions(close, positions[:, j])
+        np.testing.assert_allclose(equity[:, j], single_equity[:, 0])
+        for name, values in metrics.items():
+            np.testing.assert_allclose(values[j], single[name][0], equal_nan=True, err_msg=name)
+
+
+def test_hold_between_enters_and_exits():
+    entry = np.array([0, 1, 0, 0, 1, 0, 0, 0], dtype=bool)
+    exit_ = np.array([0, 0, 0, 1, 0, 0, 1, 0], dtype=bool)
+
+    np.testing.assert_array_equal(backtest.hold_between(entry, exit_), [0, 1, 1, 0, 1, 1, 0, 0])
+
+
+def test_signal_features_match_indicator_columns(app, daily_frame):
+    df = app.add_technical_indicators(daily_frame.copy())
+    features = app.SignalFeatures(df['收盘'].to_numpy())
+
+    np.testing.assert_allclose(features.ma(20), df['MA20'], equal_nan=True)
+    np.testing.assert_allclose(features.rsi(14), df['RSI'], equal_nan=True, atol=1e-8)
+    macd, signal = features.macd()
+    np.testing.assert_allclose(macd, df['MACD'])
+    np.testing.assert_allclose(signal, df['Signal'])
+    _, upper, lower = features.bollinger()
+    np.testing.assert_allclose(upper, df['BB_Upper'], equal_nan=True, atol=1e-8)
+    np.testing.assert_allclose(lower, df['BB_Lower'], equal_nan=True, atol=1e-8)
+
+
+def test_sweep_labels_every_combination(app, daily_frame):
+    closes = {"600000": daily_frame['收盘'].to_numpy(), "600001": daily_frame['收盘'].to_numpy()[::-1]}
+    rules = {"均线交叉": app.parameter_grid({"fast": [5, 10], "slow": [10, 20]})}
+
+    result = app.run_backtest_sweep(closes, rules)
+
+    assert len(result) == 2 * 3
+    assert list(result['代码'].unique()) == ["600000", "600001"]
+    assert set(result['参数']) == {"fast=5, slow=10", "fast=5, slow=20", "fast=10, slow=20"}
+    assert isinstance(result, pd.DataFrame)
+
+
+def test_sweep_on_spawn_pool_matches_serial(app):
+    rng = np.random.default_rng(3)
+    closes = {f"{600000 + j:06d}": 10 * np.exp(np.cumsum(rng.normal(0, 0.02, 300))) for j in range(5)}
+
+    serial = app.run_backtest_sweep(closes)
+    with ProcessPoolExecutor(2, mp_context=multiprocessing.get_context("spawn")) as pool:
+        parallel = app.run_backtest_sweep(closes, pool=pool, workers=2)
+
+    pd.testing.assert_frame_equal(parallel, serial)
@@ -0,0 +1,47 @@
+"""BarStore：只拉取缺失的首尾区间，覆盖区间内的查询不访问数据源"""
+import datetime
+
+import numpy as np
+
+from conftest import synthetic_bars
+
+D = datetime.date
+
+
+def test_first_fetch_includes_indicator_warmup(app, bar_store, stub_fetcher):
+    df = bar_store.get("600000", D(2024, 3, 1), D(2024, 6, 28), "qfq")
+
+    warmup = datetime.timedelta(days=app.ARCHIVE_HEAD_WARMUP_DAYS)
+    assert stub_fetcher.calls == [(D(2024, 3, 1) - warmup, D(2024, 6, 28))]
+    assert df['日期'].iloc[0].date() == D(2024, 3, 1)
+    assert df['日期'].iloc[-1].date() == D(2024, 6, 28)
+    assert bar_store.coverage("600000", "qfq") == (D(2024, 3, 1), D(2024, 6, 28))
+
+
+def test_sub_range_does_not_fetch(bar_store, stub_fetcher):
+    bar_store.get("600000", D(2024, 3, 1), D(2024, 6, 28), "qfq")
+    stub_fetcher.calls.clear()
+
+    df = bar_store.get("600000", D(2024, 4, 1), D(2024, 4, 30), "qfq")
+
+    assert stub_fetcher.calls == []
+    expected = synthetic_bars("600000", D(2024, 4, 1), D(2024, 4, 30))
+    np.testing.assert_allclose(df['收盘'].to_numpy(dtype=float), expected['收盘'], atol=1e-4)
+
+
+def test_head_and_tail_gaps_fetch_only_missing_ranges(app, bar_store, stub_fetcher):
+    bar_store.get("600000", D(2024, 3, 1), D(2024, 6, 28), "qfq")
+    first_archived = bar_store.records("600000", "qfq")['日期'][0].astype(datetime.date)
+    stub_fetcher.calls.clear()
+
+    df = bar_store.get("600000", D(2024, 1, 2), D(2024, 8, 30), "qfq")
+
+    warmup = datetime.timedelta(days=app.ARCHIVE_HEAD_WARMUP_DAYS)
+    assert stub_fetcher.calls == [
+        (D(2024, 1, 2) - warmup, first_archived - datetime.timedelta(days=1)),
+        (D(2024, 6, 29), D(2024, 8, 30)),
+    ]
+    assert bar_store.coverage("600000", "qfq") == (D(2024, 1, 2), D(2024, 8, 30))
+    expected = synthetic_bars("600000", D(2024, 1, 2), D(2024, 8, 30))
+    assert len(df) == len(expected)
+    np.testing.assert_allclose(df['收盘'].to_numpy(dtype=float), expected['收盘'], atol=1e-4)
@@ -0,0 +1,66 @@
+"""长区间图表降采样：K线分桶、LTTB 与框选区间"""
+import datetime
+
+import numpy as np
+import pytest
+
+from conftest import synthetic_bars
+
+D = datetime.date
+
+
+@pytest.fixture
+def long_frame():
+    return synthetic_bars("600000", D(2005, 1, 3), D(2024, 12, 31))
+
+
+def test_buckets_are_bounded_and_preserve_extremes(app, long_frame):
+    candles, label = app.bucket_ohlcv(long_frame, max_points=1000)
+
+    assert label == "月K" and len(candles) <= 1000
+    assert candles['最高'].max() == long_frame['最高'].max()
+    assert candles['最低'].min() == long_frame['最低'].min()
+    assert candles['成交量'].sum() == long_frame['成交量'].sum()
+    assert candles['开盘'].iloc[0] == long_frame['开盘'].iloc[0]
+    assert candles['收盘'].iloc[-1] == long_frame['收盘'].iloc[-1]
+
+
+def test_short_ranges_are_not_bucketed(app, daily_frame):
+    candles, label = app.bucket_ohlcv(daily_frame, max_points=1000)
+
+    assert label is None and candles is daily_frame
+
+
+def test_lttb_keeps_endpoints_and_extremes(app):
+    y = np.sin(np.linspace(0, 20, 5000))
+    y[1234] = 5.0
+
+    keep = app.lttb_indices(y, 200)
+
+    assert len(keep) == 200 and keep[0] == 0 and keep[-1] == len(y) - 1
+    assert np.all(np.diff(keep) > 0)
+    assert 1234 in keep
+
+
+def test_chart_size_is_bounded(app, long_frame):
+    df = app.add_technical_indicators(long_frame)
+
+    fig = app.create_candlestick_chart(df, True, True, max_points=500)
+
+    assert all(len(trace.x) <= 500 for trace in fig.data)
+
+
+@pytest.mark.parametrize("x, expected", [
+    (["2024-05-31 20:00", "2024-02-01 07:12:33.5"], (D(2024, 2, 1), D(2024, 5, 31))),
+    (["2004-06-01", "2005-03-01"], (D(2005, 1, 3), D(2005, 3, 1))),
+    (["2030-01-01", "2031-01-01"], None),
+])
+def test_box_selection_to_date_range(app, x, expected):
+    event = {"selection": {"box": [{"xref": "x", "yref": "y", "x": x, "y": [0, 1]}], "points": []}}
+
+    assert app.box_selected_range(event, D(2005, 1, 3), D(2024, 12, 31)) == expected
+
+
+def test_no_box_selection(app):
+    assert app.box_selected_range(None, D(2005, 1, 3), D(2024, 12, 31)) is None
+    assert app.box_selected_range({"selection": {"box": [], "points": []}}, D(2005, 1, 3), D(2024, 12, 31)) is None
@@ -0,0 +1,54 @@
+"""导出文件写出后读回，与原始行情一致"""
+import io
+import zipfile
+
+import pandas as pd
+import pytest
+
+
+@pytest.mark.parametrize("with_indicators", [False, True])
+def test_csv_round_trip(app, daily_frame, with_indicators):
+    df = app.add_technical_indicators(daily_frame.copy())
+    data = app.export_frame(df, "CSV", with_indicators)
+
+    assert data.startswith(b"\xef\xbb\xbf")
+    back = pd.read_csv(io.BytesIO(data), encoding="utf-8-sig", dtype={'股票代码': str}, parse_dates=['日期'])
+    expected = df[app.export_columns(df, with_indicators)]
+    assert list(back.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(back, expected.reset_index(drop=True), check_dtype=False)
+
+
+@pytest.mark.parametrize("with_indicators", [False, True])
+def test_parquet_round_trip_keeps_types(app, daily_frame, with_indicators):
+    df = app.add_technical_indicators(daily_frame.copy())
+    data = app.export_frame(df, "Parquet", with_indicators)
+
+    back = pd.read_parquet(io.BytesIO(data))
+    expected = df[app.export_columns(df, with_indicators)].reset_index(drop=True)
+    pd.testing.assert_frame_equal(back, expected, check_index_type=False)
+
+
+def test_chunked_writers_match_single_write(app, daily_frame):
+    csv_chunked, csv_single = io.BytesIO(), io.BytesIO()
+    app.write_csv_chunks(daily_frame, csv_chunked, chunk_rows=7)
+    app.write_csv_chunks(daily_frame, csv_single, chunk_rows=len(daily_frame))
+    assert csv_chunked.getvalue() == csv_single.getvalue()
+
+    parquet = io.BytesIO()
+    app.write_parquet_chunks(daily_frame, parquet, chunk_rows=50)
+    parquet.seek(0)
+    assert pd.read_parquet(parquet).equals(daily_frame)
+
+
+def test_zip_members_use_stored_for_parquet(app, daily_frame):
+    ext, _, writer, compression = app.EXPORT_FORMATS["Parquet"]
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", compression=compression) as archive:
+        with archive.open(f"600000.{ext}", "w") as member:
+            writer(daily_frame, member)
+
+    with zipfile.ZipFile(buf) as archive:
+        info = archive.getinfo("600000.parquet")
+        assert info.compress_type == zipfile.ZIP_STORED
+        back = pd.read_parquet(io.BytesIO(archive.read(info)))
+    assert back.equals(daily_frame)
@@ -0,0 +1,138 @@
+"""复权因子：除权事件检测、前/后复权派生与因子的增量接续"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import synthetic_bars
+
+D = datetime.date
+
+
+def raw_bars_with_dividend(app):
+    """2024-03-01 至 03-08 的不复权K线，03-06 每股派息 0.5 元"""
+    df = synthetic_bars("600000", D(2024, 3, 1), D(2024, 3, 8))
+    close = df['收盘'].to_numpy(dtype=float)
+    preclose = np.r_[np.nan, close[:-1]]
+    ex_day = 3
+    preclose[ex_day] -= 0.5
+    df['涨跌额'] = np.round(close - preclose, 2)
+    df.loc[0, '涨跌额'] = 0.0
+    return app.compact_hist_frame(df), close[ex_day - 1] / preclose[ex_day]
+
+
+class StubFactors:
+    """AdjustFactorStore 的桩取数函数：依次返回预设的因子表，None 表示数据源不支持"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, symbol):
+        self.calls += 1
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def factor_table(*rows):
+    return pd.DataFrame(rows, columns=['date', 'hfq_factor'])
+
+
+def test_ex_rights_events_finds_dividend(app):
+    raw, ratio = raw_bars_with_dividend(app)
+
+    dates, ratios = app.ex_rights_events(app.expand_hist_frame(raw))
+
+    assert dates.tolist() == [np.datetime64('2024-03-06', 'D')]
+    assert ratios[0] == pytest.approx(ratio)
+
+
+def test_backward_adjust_scales_from_ex_date(app):
+    raw, _ = raw_bars_with_dividend(app)
+    factors = (np.array(['2024-03-06'], dtype='datetime64[D]'), np.array([2.0]))
+
+    hfq = app.expand_hist_frame(app.backward_adjust(raw, factors))
+
+    expected = app.expand_hist_frame(raw)
+    scale = np.where(expected['日期'] >= '2024-03-06', 2.0, 1.0)
+    for col in app.ADJUST_PRICE_COLS:
+        np.testing.assert_allclose(hfq[col], np.round(expected[col] * scale, 2), err_msg=col)
+    np.testing.assert_array_equal(hfq['成交量'], expected['成交量'])
+
+
+def test_forward_adjust_divides_by_latest_factor(app, monkeypatch):
+    raw, _ = raw_bars_with_dividend(app)
+    factors = (np.array(['2024-03-06'], dtype='datetime64[D]'), np.array([2.0]))
+    hfq = app.add_technical_indicators(app.expand_hist_frame(app.backward_adjust(raw, factors)))
+    monkeypatch.setattr(app, "market_now", lambda: datetime.datetime(2024, 3, 8, 16, tzinfo=app.MARKET_TZ))
+
+    qfq = app.expand_hist_frame(app.forward_adjust(app.compact_hist_frame(hfq), factors))
+
+    np.testing.assert_allclose(qfq['收盘'], np.round(hfq['收盘'] / 2, 2))
+    np.testing.assert_allclose(qfq['MA5'], hfq['MA5'] / 2, equal_nan=True, rtol=1e-6)
+    np.testing.assert_allclose(qfq['RSI'], hfq['RSI'], equal_nan=True, rtol=1e-6)
+
+
+def test_store_fetches_once_and_persists(app, tmp_path):
+    fetcher = StubFactors(factor_table(('2020-06-01', 1.5)))
+    store = app.AdjustFactorStore(str(tmp_path), fetcher)
+
+    dates, values = store.get("600000")
+    store.get("600000")
+    reloaded = app.AdjustFactorStore(str(tmp_path), fetcher).get("600000")
+
+    assert fetcher.calls == 1
+    assert dates.tolist() == [np.datetime64('2020-06-01', 'D')]
+    np.testing.assert_array_equal(reloaded[1], values)
+
+
+def test_store_chains_events_missing_upstream(app, tmp_path):
+    fetcher = StubFactors(factor_table(('2020-06-01', 1.5)), factor_table(('2020-06-01', 1.5)))
+    store = app.AdjustFactorStore(str(tmp_path), fetcher)
+    store.get("600000")
+    events = (np.array(['2020-06-01', '2024-03-06', '2024-07-01'], dtype='datetime64[D]'),
+              np.array([1.5, 1.1, 1.2]))
+
+    dates, values = store.get("600000", events)
+
+    # 上游只收录了第一个事件，之后两个按K线推算的比例依次接续
+    assert fetcher.calls == 2
+    assert dates.astype(str).tolist() == ['2020-06-01', '2024-03-06', '2024-07-01']
+    np.testing.assert_allclose(values, [1.5, 1.5 * 1.1, 1.5 * 1.1 * 1.2])
+    assert store.stats()['implied'] == 2
+    # 推算的事件已接续，相同的事件不再触发刷新
+    store.get("600000", events)
+    assert fetcher.calls == 2
+
+
+def test_store_refresh_failure_falls_back_to_implied(app, tmp_path):
+    fetcher = StubFactors(factor_table(), app.UpstreamError("factors: 熔断中"))
+    store = app.AdjustFactorStore(str(tmp_path), fetcher)
+    store.get("600000")
+    events = (np.array(['2024-03-06'], dtype='datetime64[D]'), np.array([1.1]))
+
+    dates, values = store.get("600000", events)
+
+    assert dates.astype(str).tolist() == ['2024-03-06']
+    np.testing.assert_allclose(values, [1.1])
+
+
+def test_qfq_ranges_expire_but_hfq_does_not(app):
+    past = app.market_now().date() - datetime.timedelta(days=30)
+
+    assert app.hist_expiry("600000", past - datetime.timedelta(days=30), past, "hfq") is None
+    assert app.hist_expiry("600000", past - datetime.timedelta(days=30), past, "qfq") > 0
+
+
+def test_qfq_falls_back_when_factors_unavailable(app, monkeypatch, bar_store, stub_fetcher):
+    store = app.AdjustFactorStore(bar_store.root, StubFactors(app.UpstreamError("factors: 超时")))
+    monkeypatch.setattr(app, "get_bar_store", lambda: bar_store)
+    monkeypatch.setattr(app, "get_factor_store", lambda: store)
+
+    df = app.load_hist_bars("600000", D(2024, 3, 1), D(2024, 3, 29), "qfq")
+
+    assert len(df) == len(synthetic_bars("600000", D(2024, 3, 1), D(2024, 3, 29)))
+    assert bar_store.coverage("600000", "qfq") == (D(2024, 3, 1), D(2024, 3, 29))
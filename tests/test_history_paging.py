@@ -0,0 +1,57 @@
+"""历史明细分页：二分定位筛选区间，按页切片 (升序/降序)"""
+import datetime
+
+D = datetime.date
+
+
+def dates_of(frame):
+    return [d.date() for d in frame['日期']]
+
+
+def test_history_range_bisects_dates(app, daily_frame):
+    lo, hi = app.history_range(daily_frame, D(2024, 3, 2), D(2024, 3, 8))
+
+    # 03-02 是周六，区间从下一个交易日 03-04 开始，含结束日
+    assert dates_of(daily_frame.iloc[lo:hi]) == [D(2024, 3, d) for d in range(4, 9)]
+    assert app.history_range(daily_frame) == (0, len(daily_frame))
+
+
+def test_history_range_single_day_and_empty(app, daily_frame):
+    lo, hi = app.history_range(daily_frame, D(2024, 3, 5), D(2024, 3, 5))
+    assert dates_of(daily_frame.iloc[lo:hi]) == [D(2024, 3, 5)]
+
+    lo, hi = app.history_range(daily_frame, D(2024, 3, 9), D(2024, 3, 10))
+    assert hi == lo
+    lo, hi = app.history_range(daily_frame, D(2024, 3, 8), D(2024, 3, 1))
+    assert hi == lo
+
+
+def test_page_count(app):
+    assert app.page_count(0, 50) == 1
+    assert app.page_count(50, 50) == 1
+    assert app.page_count(51, 50) == 2
+
+
+def test_descending_pages_cover_range_without_overlap(app, daily_frame):
+    lo, hi = app.history_range(daily_frame, D(2024, 1, 1), D(2024, 6, 30))
+    pages = [app.history_page(daily_frame, lo, hi, True, page, 50)
+             for page in range(1, app.page_count(hi - lo, 50) + 1)]
+
+    seen = [d for page in pages for d in dates_of(page)]
+    assert seen == sorted(dates_of(daily_frame.iloc[lo:hi]), reverse=True)
+    assert all(len(page) == 50 for page in pages[:-1])
+
+
+def test_ascending_pages_and_clamped_page_number(app, daily_frame):
+    lo, hi = app.history_range(daily_frame, D(2024, 2, 1), D(2024, 2, 29))
+
+    first = app.history_page(daily_frame, lo, hi, False, 1, 10)
+    last = app.history_page(daily_frame, lo, hi, False, 99, 10)
+
+    assert dates_of(first) == dates_of(daily_frame.iloc[lo:lo + 10])
+    assert dates_of(last) == dates_of(daily_frame.iloc[lo + 20:hi])
+    assert dates_of(app.history_page(daily_frame, lo, hi, False, 0, 10)) == dates_of(first)
+
+
+def test_empty_range_gives_empty_page(app, daily_frame):
+    assert app.history_page(daily_frame, 5, 5, True, 1, 50).empty
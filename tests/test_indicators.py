@@ -0,0 +1,54 @@
+"""IncrementalIndicators 与 pandas 版 calculate_* 的结果一致"""
+import numpy as np
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def closes():
+    rng = np.random.default_rng(7)
+    return np.round(20 * np.exp(np.cumsum(rng.normal(0, 0.02, 300))), 2)
+
+
+def reference(app, dates, closes):
+    df = pd.DataFrame({'日期': dates, '收盘': closes})
+    df = app.calculate_ma(df)
+    df = app.calculate_macd(df)
+    df = app.calculate_rsi(df)
+    return app.calculate_bollinger_bands(df)
+
+
+def assert_matches(app, columns, ref):
+    for col in app.INDICATOR_COLUMNS:
+        np.testing.assert_allclose(columns[col], ref[col].to_numpy(), rtol=1e-9, atol=1e-9,
+                                   equal_nan=True, err_msg=col)
+
+
+def test_append_matches_pandas(app, closes):
+    dates = pd.bdate_range("2024-01-02", periods=len(closes))
+    engine = app.IncrementalIndicators()
+    for date, close in zip(dates, closes):
+        engine.append(date, close)
+
+    assert_matches(app, engine.columns(), reference(app, dates, closes))
+
+
+def test_update_last_matches_pandas(app, closes):
+    dates = pd.bdate_range("2024-01-02", periods=len(closes))
+    engine = app.IncrementalIndicators()
+    for date, close in zip(dates[:-1], closes[:-1]):
+        engine.append(date, close)
+    engine.append(dates[-1], closes[-1] * 1.05)
+    engine.update_last(closes[-1] * 0.97)
+    engine.update_last(closes[-1])
+
+    assert_matches(app, engine.columns(), reference(app, dates, closes))
+
+
+def test_from_frame_then_append(app, closes):
+    dates = pd.bdate_range("2024-01-02", periods=len(closes))
+    engine = app.IncrementalIndicators.from_frame(reference(app, dates[:200], closes[:200]))
+    for date, close in zip(dates[200:], closes[200:]):
+        engine.append(date, close)
+
+    assert_matches(app, engine.columns(), reference(app, dates, closes))
@@ -0,0 +1,131 @@
+"""分时行情：分钟环形缓冲、多周期合并与增量刷新"""
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+DAY = datetime.date(2024, 3, 6)
+
+
+def minute_bars(app, day=DAY):
+    """某交易日的确定性 1 分钟K线 (列名与 fetch_minute_upstream 一致)"""
+    times = pd.to_datetime(app.session_minutes(day).astype('datetime64[ns]'))
+    k = np.arange(len(times), dtype=float)
+    close = np.round(10 + np.sin(k / 9) + k / 200, 2)
+    open_ = np.r_[10.0, close[:-1]]
+    return pd.DataFrame({'日期': times, '开盘': open_, '收盘': close,
+                         '最高': np.maximum(open_, close) + 0.01, '最低': np.minimum(open_, close) - 0.01,
+                         '成交量': 100 + k, '成交额': (100 + k) * close * 100})
+
+
+def as_bar(row):
+    return (np.datetime64(row.日期.to_pydatetime(), 'm'), row.开盘, row.收盘, row.最高, row.最低,
+            row.成交量, row.成交额)
+
+
+def test_session_minute_index_round_trip(app):
+    times = pd.to_datetime(app.session_minutes(DAY).astype('datetime64[ns]'))
+
+    assert len(times) == app.SESSION_MINUTES == 240
+    assert [app.session_minute_index(t) for t in times] == list(range(240))
+    assert all(app.session_minute_time(DAY, i) == t for i, t in enumerate(times.to_pydatetime()))
+    # 集合竞价并入首分钟，午休时刻归入下午首分钟，收盘后归入最后一分钟
+    assert app.session_minute_index(datetime.datetime(2024, 3, 6, 9, 30)) == 0
+    assert app.session_minute_index(datetime.datetime(2024, 3, 6, 12, 0)) == 120
+    assert app.session_minute_index(datetime.datetime(2024, 3, 6, 15, 5)) == 239
+
+
+def test_ring_keeps_latest_in_order(app):
+    ring = app.MinuteRing(3)
+    stamps = np.datetime64('2024-03-06T09:31') + np.arange(5)
+    for i, ts in enumerate(stamps):
+        ring.append((ts, i, i, i, i, i, i))
+    ring.update_last((stamps[-1], 9, 9, 9, 9, 9, 9))
+
+    view = ring.view()
+    assert len(ring) == 3
+    assert view['日期'].tolist() == stamps[2:].tolist()
+    assert view['收盘'].tolist() == [2, 3, 9]
+    assert ring.last()['收盘'] == 9
+
+
+@pytest.mark.parametrize("minutes", [5, 30, 60])
+def test_aggregator_matches_resample(app, minutes):
+    df = minute_bars(app)
+    aggregator = app.BarAggregator(minutes)
+    for i, row in enumerate(df.itertuples(index=False)):
+        aggregator.push(DAY, i, as_bar(row))
+
+    out = aggregator.frame()
+    bucket = np.arange(len(df)) // minutes
+    expected = df.groupby(bucket).agg({'日期': 'last', '开盘': 'first', '收盘': 'last', '最高': 'max',
+                                       '最低': 'min', '成交量': 'sum', '成交额': 'sum'})
+    assert len(out) == 240 // minutes
+    for col in expected:
+        np.testing.assert_allclose(out[col].to_numpy(dtype=float), expected[col].to_numpy(dtype=float),
+                                   err_msg=col)
+    pd.testing.assert_series_equal(out['MA5'], out['收盘'].rolling(5).mean(), check_names=False)
+
+
+def test_sixty_minute_bars_end_at_session_boundaries(app):
+    df = minute_bars(app)
+    aggregator = app.BarAggregator(60)
+    for i, row in enumerate(df.itertuples(index=False)):
+        aggregator.push(DAY, i, as_bar(row))
+
+    ends = [t.strftime("%H:%M") for t in aggregator.frame()['日期']]
+    assert ends == ["10:30", "11:30", "14:00", "15:00"]
+
+
+def test_replacing_last_minute_updates_bar(app):
+    df = minute_bars(app)
+    aggregator = app.BarAggregator(5)
+    rows = list(df.itertuples(index=False))[:7]
+    for i, row in enumerate(rows):
+        aggregator.push(DAY, i, as_bar(row))
+    revised = as_bar(rows[-1])[:2] + (20.0, 20.0) + as_bar(rows[-1])[4:]
+
+    aggregator.push(DAY, 6, revised, replace=True)
+
+    last = aggregator.frame().iloc[-1]
+    assert last['收盘'] == 20.0 and last['最高'] == 20.0
+    assert last['开盘'] == rows[5].开盘
+    assert last['成交量'] == rows[5].成交量 + rows[6].成交量
+
+
+class StubMinutes:
+    """分时取数桩：只返回截至 until 的分钟K线，并记录请求的起点"""
+
+    def __init__(self, df):
+        self.df = df
+        self.until = df['日期'].iloc[-1]
+        self.starts = []
+
+    def __call__(self, symbol, start, end):
+        self.starts.append(start)
+        mask = (self.df['日期'] >= pd.Timestamp(start)) & (self.df['日期'] <= self.until)
+        return self.df[mask].reset_index(drop=True)
+
+
+def test_feed_refresh_fetches_only_new_minutes(app, monkeypatch):
+    monkeypatch.setattr(app, "is_trading_day", lambda day: day.weekday() < 5)
+    monkeypatch.setattr(app, "market_now",
+                        lambda: datetime.datetime.combine(DAY, datetime.time(10, 0), app.MARKET_TZ))
+    df = minute_bars(app)
+    fetcher = StubMinutes(df)
+    fetcher.until = df['日期'].iloc[29]
+    feed = app.IntradayFeed("600000", fetcher, lambda symbol, day: 9.8)
+
+    assert feed.refresh(ttl=0)
+    fetcher.until = df['日期'].iloc[59]
+    assert feed.refresh(ttl=0)
+    assert not feed.refresh(ttl=3600)
+
+    assert fetcher.starts[1] == df['日期'].iloc[29].to_pydatetime()
+    assert len(feed.frame(1)) == 60 and len(feed.frame(30)) == 2
+    summary = feed.summary()
+    assert summary['收盘'] == df['收盘'].iloc[59]
+    assert summary['成交量'] == pytest.approx(df['成交量'].iloc[:60].sum())
+    assert summary['昨收'] == 9.8
+    assert feed.counters['minutes'] == 60
@@ -0,0 +1,103 @@
+"""行情缓存：按失效时间过期，宽限期内先返回旧值并后台刷新，按字节数淘汰"""
+import threading
+import time
+
+
+class Loader:
+    """返回递增版本号的加载函数，可阻塞以观察后台刷新"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self):
+        self.release.wait(5)
+        self.calls += 1
+        return f"v{self.calls}"
+
+
+def test_hit_until_expiry(app):
+    cache = app.MarketCache(max_bytes=10_000)
+    load = Loader()
+
+    first = cache.get_or_load("k", load, lambda: time.time() + 60)
+    second = cache.get_or_load("k", load, lambda: time.time() + 60)
+
+    assert first == second == "v1"
+    assert load.calls == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_never_expiring_entries(app):
+    cache = app.MarketCache(max_bytes=10_000)
+    load = Loader()
+
+    cache.get_or_load("k", load, lambda: None)
+
+    assert cache.get_or_load("k", load, lambda: None) == "v1"
+    assert load.calls == 1
+
+
+def test_stale_value_served_while_refreshing(app):
+    cache = app.MarketCache(max_bytes=10_000, stale_grace=60)
+    load = Loader()
+    cache.put("k", "old", time.time() - 1)
+    load.release.clear()
+
+    assert cache.get_or_load("k", load, lambda: time.time() + 60) == "old"
+    # 刷新进行中，再次访问仍返回旧值，且不会重复发起刷新
+    assert cache.get_or_load("k", load, lambda: time.time() + 60) == "old"
+    load.release.set()
+    deadline = time.time() + 5
+    while cache.stats().get('refreshes', 0) < 1 and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert cache.get_or_load("k", load, lambda: time.time() + 60) == "v1"
+    assert load.calls == 1
+    assert cache.stats()['stale_hits'] == 2
+
+
+def test_reloads_synchronously_after_grace(app):
+    cache = app.MarketCache(max_bytes=10_000, stale_grace=1)
+    load = Loader()
+    cache.put("k", "old", time.time() - 10)
+
+    assert cache.get_or_load("k", load, lambda: time.time() + 60) == "v1"
+    assert cache.stats()['expired'] == 1
+
+
+def test_none_is_not_cached(app):
+    cache = app.MarketCache(max_bytes=10_000)
+    calls = []
+
+    for _ in range(2):
+        cache.get_or_load("k", lambda: calls.append(1), lambda: None)
+
+    assert len(calls) == 2
+    assert len(cache) == 0
+
+
+def test_evicts_least_recently_used_by_bytes(app):
+    item = "x" * 1000
+    cache = app.MarketCache(max_bytes=3 * app.estimate_size(item))
+    for key in "abc":
+        cache.put(key, item, None)
+    cache.get_or_load("a", Loader(), lambda: None)
+
+    cache.put("d", item, None)
+
+    assert cache.find(lambda k: k == "b") is None
+    assert cache.find(lambda k: k == "a") == item
+    assert cache.stats()['evictions'] == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_find_skips_expired_and_invalidate_removes(app):
+    cache = app.MarketCache(max_bytes=10_000)
+    cache.put(("hist", "600000", 1), "expired", time.time() - 1)
+    cache.put(("hist", "600000", 2), "fresh", time.time() + 60)
+
+    assert cache.find(lambda k: k[1] == "600000") == "fresh"
+    assert cache.invalidate(lambda k: k[1] == "600000") == 2
+    assert len(cache) == 0 and cache.bytes == 0
@@ -0,0 +1,114 @@
+"""全市场面板：除权除息时前复权调整，停机错过的交易日按交易日历补齐"""
+import collections
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+D = datetime.date
+
+
+def day_frame(closes, preclose=None):
+    """以代码为索引的单日截面 (快照格式)"""
+    frame = pd.DataFrame({field: pd.Series(closes, dtype=float) for field in ['收盘', '开盘', '最高', '最低']})
+    frame['成交量'], frame['成交额'], frame['换手率'], frame['涨跌幅'] = 1000.0, 1e6, 1.0, 0.0
+    if preclose is not None:
+        frame['昨收'] = pd.Series(preclose, dtype=float)
+    return frame
+
+
+def daily_bars(closes):
+    """{日期: 收盘} -> fetch_hist_upstream 格式的日线"""
+    dates = list(closes)
+    close = np.array(list(closes.values()), dtype=float)
+    return pd.DataFrame({'日期': pd.to_datetime(dates), '开盘': close, '收盘': close, '最高': close,
+                         '最低': close, '成交量': 1000, '成交额': 1e6, '换手率': 1.0, '涨跌幅': 0.0})
+
+
+class FakeSpotSource:
+    def __init__(self, frame):
+        self.frame = frame
+
+    def fetch_spot(self):
+        spot = self.frame.rename(columns={'收盘': '最新价', '开盘': '今开'}).rename_axis('代码').reset_index()
+        spot['名称'] = spot['代码']
+        return spot
+
+
+@pytest.fixture
+def service(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(app, "is_trading_day", lambda day: day.weekday() < 5)
+    monkeypatch.setattr(app, "call_upstream", lambda endpoint, source, func, *args: func(*args))
+    svc = app.MarketPanelService.__new__(app.MarketPanelService)
+    svc.root = str(tmp_path)
+    svc.counters = collections.Counter()
+    svc.backfill_progress = None
+    svc._filled_through = None
+    panel = app.MarketPanel.empty()
+    panel = panel.append(D(2024, 3, 4), day_frame({"000001": 10.0, "000002": 20.0}))
+    svc.panel = panel.append(D(2024, 3, 5), day_frame({"000001": 11.0, "000002": 21.0}))
+    return svc
+
+
+def at(app, monkeypatch, day, hour=16):
+    now = datetime.datetime.combine(day, datetime.time(hour), app.MARKET_TZ)
+    monkeypatch.setattr(app, "market_now", lambda: now)
+    return now
+
+
+def test_extend_merges_days_and_codes(app, service):
+    other = app.MarketPanel.empty().append(D(2024, 3, 6), day_frame({"000002": 22.0, "000003": 5.0}))
+
+    merged = service.panel.extend(other)
+
+    assert merged.dates == [D(2024, 3, 4), D(2024, 3, 5), D(2024, 3, 6)]
+    assert merged.codes == ["000001", "000002", "000003"]
+    np.testing.assert_array_equal(merged.fields['收盘'][:, 1], [20.0, 21.0, 22.0])
+    assert np.isnan(merged.fields['收盘'][2, 0]) and np.isnan(merged.fields['收盘'][0, 2])
+
+
+def test_append_rescales_history_on_ex_rights(app, monkeypatch, service):
+    now = at(app, monkeypatch, D(2024, 3, 6))
+    # 000002 十送十：昨收 21.0 -> 10.5
+    spot = day_frame({"000001": 11.5, "000002": 10.8}, preclose={"000001": 11.0, "000002": 10.5})
+    monkeypatch.setattr(app, "get_data_source", lambda: FakeSpotSource(spot))
+
+    assert service._missing_days(now) == [D(2024, 3, 6)]
+    service._append_today()
+
+    panel = service.panel
+    assert panel.dates[-1] == D(2024, 3, 6)
+    np.testing.assert_allclose(panel.fields['收盘'][:, 0], [10.0, 11.0, 11.5])
+    np.testing.assert_allclose(panel.fields['收盘'][:, 1], [10.0, 10.5, 10.8])
+    np.testing.assert_allclose(panel.fields['最高'][:, 1], [10.0, 10.5, 10.8])
+    np.testing.assert_array_equal(panel.fields['成交量'][:, 1], [1000, 1000, 1000])
+    assert service.counters['ex_rights'] == 1
+
+
+def test_missed_days_are_backfilled_from_calendar(app, monkeypatch, service):
+    now = at(app, monkeypatch, D(2024, 3, 8))
+    spot = day_frame({"000001": 12.0, "000002": 11.0})
+    monkeypatch.setattr(app, "get_data_source", lambda: FakeSpotSource(spot))
+    # 停机期间 000002 在 03-07 除权，上游前复权K线中 03-05 的收盘已折半
+    upstream = {
+        "000001": {D(2024, 3, 5): 11.0, D(2024, 3, 6): 11.2, D(2024, 3, 7): 11.6, D(2024, 3, 8): 12.0},
+        "000002": {D(2024, 3, 5): 10.5, D(2024, 3, 6): 10.6, D(2024, 3, 7): 10.9, D(2024, 3, 8): 11.0},
+    }
+    calls = []
+
+    def fetch(code, start, end, adjust, endpoint="hist"):
+        calls.append((code, start, end, adjust))
+        return daily_bars({d: c for d, c in upstream[code].items() if start <= d <= end})
+    monkeypatch.setattr(app, "fetch_hist_upstream", fetch)
+
+    assert service._missing_days(now) == [D(2024, 3, 6), D(2024, 3, 7), D(2024, 3, 8)]
+    service._backfill(since=service.panel.dates[-1])
+
+    assert calls == [(code, D(2024, 3, 5), D(2024, 3, 8), "qfq") for code in ("000001", "000002")]
+    panel = service.panel
+    assert panel.dates == [D(2024, 3, 4) + datetime.timedelta(days=i) for i in range(5)]
+    np.testing.assert_allclose(panel.fields['收盘'][:, 0], [10.0, 11.0, 11.2, 11.6, 12.0])
+    np.testing.assert_allclose(panel.fields['收盘'][:, 1], [10.0, 10.5, 10.6, 10.9, 11.0])
+    assert service._missing_days(now) == []
+    assert app.MarketPanel.load(service.root).dates == panel.dates
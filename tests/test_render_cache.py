@@ -0,0 +1,71 @@
+"""渲染缓存：按字节数淘汰，图表以 JSON 缓存并在命中时还原为新的 Figure"""
+import json
+
+import pandas as pd
+import plotly.graph_objects as go
+import pytest
+
+
+@pytest.fixture
+def render_cache(app, monkeypatch):
+    cache = app.RenderCache(max_bytes=10_000)
+    monkeypatch.setattr(app, "get_render_cache", lambda: cache)
+    return cache
+
+
+def test_evicts_least_recently_used_by_bytes(app):
+    cache = app.RenderCache(max_bytes=3 * 1100)
+    for key in "abc":
+        cache.put(key, "x" * 1000)
+    cache.get("a")
+
+    cache.put("d", "x" * 1000)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("d") is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_oversized_items_are_not_cached(app):
+    cache = app.RenderCache(max_bytes=100)
+
+    cache.put("big", "x" * 1000)
+
+    assert cache.get("big") is None
+    assert cache.bytes == 0
+
+
+def test_figures_are_cached_as_json(app, render_cache):
+    builds = []
+
+    @app.render_cached
+    def build(values):
+        builds.append(values)
+        return go.Figure(go.Scatter(y=values.tolist()))
+
+    values = pd.Series([1.0, 2.0, 3.0])
+    first = build(values)
+    second = build(values.copy())
+    second.update_layout(title="只改本会话的图表")
+    third = build(values)
+
+    assert len(builds) == 1
+    (spec, size), = render_cache._items.values()
+    assert isinstance(spec, str) and json.loads(spec) == json.loads(first.to_json())
+    assert render_cache.bytes == size >= len(spec)
+    assert second is not third
+    assert third.layout.title.text is None
+    assert json.loads(third.to_json()) == json.loads(first.to_json())
+
+
+def test_different_inputs_build_separately(app, render_cache):
+    @app.render_cached
+    def build(values, scale=1):
+        return values * scale
+
+    a = build(pd.Series([1, 2]), scale=2)
+    b = build(pd.Series([1, 2]), scale=3)
+
+    assert a.tolist() == [2, 4] and b.tolist() == [3, 6]
+    assert render_cache.stats()['misses'] == 2
@@ -0,0 +1,42 @@
+"""日线合并为周K/月K"""
+import numpy as np
+import pandas as pd
+
+
+def test_weekly_bars_aggregate_daily(app, daily_frame):
+    weekly = app.resample_bars(daily_frame, "W")
+
+    groups = daily_frame.groupby(pd.PeriodIndex(daily_frame['日期'], freq="W"))
+    assert len(weekly) == groups.ngroups
+    np.testing.assert_array_equal(weekly['日期'].to_numpy(), groups['日期'].last().to_numpy())
+    np.testing.assert_allclose(weekly['开盘'], groups['开盘'].first())
+    np.testing.assert_allclose(weekly['收盘'], groups['收盘'].last())
+    np.testing.assert_allclose(weekly['最高'], groups['最高'].max())
+    np.testing.assert_allclose(weekly['最低'], groups['最低'].min())
+    np.testing.assert_allclose(weekly['成交量'], groups['成交量'].sum())
+    np.testing.assert_allclose(weekly['成交额'], groups['成交额'].sum())
+
+
+def test_period_change_compounds_daily_change(app, daily_frame):
+    monthly = app.resample_bars(daily_frame, "M")
+
+    growth = (1 + daily_frame['涨跌幅'] / 100).groupby(pd.PeriodIndex(daily_frame['日期'], freq="M")).prod()
+    np.testing.assert_allclose(monthly['涨跌幅'], np.round((growth.to_numpy() - 1) * 100, 2), atol=1e-9)
+    first = daily_frame.groupby(pd.PeriodIndex(daily_frame['日期'], freq="M")).head(1)
+    prev_close = first['收盘'].to_numpy() - first['涨跌额'].to_numpy()
+    np.testing.assert_allclose(monthly['涨跌额'], np.round(monthly['收盘'] - prev_close, 2), atol=1e-9)
+
+
+def test_indicators_recomputed_on_resampled_bars(app, daily_frame):
+    weekly = app.resample_bars(daily_frame, "W")
+
+    expected = app.add_technical_indicators(weekly[['日期', '收盘']].copy())
+    for col in app.INDICATOR_COLUMNS:
+        np.testing.assert_allclose(weekly[col], expected[col], equal_nan=True, err_msg=col)
+
+
+def test_period_starts_skip_missing_days(app):
+    dates = pd.to_datetime(["2024-01-02", "2024-01-05", "2024-01-15", "2024-01-16", "2024-02-01"])
+
+    np.testing.assert_array_equal(app.period_starts(dates, "W"), [0, 2, 4])
+    np.testing.assert_array_equal(app.period_starts(dates, "M"), [0, 4])
@@ -0,0 +1,68 @@
+"""请求合并：同一键的并发调用只执行一次，结果与异常由所有调用方共享"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def run_concurrently(flight, key, func, n):
+    started = threading.Barrier(n)
+
+    def call():
+        started.wait()
+        return flight.do(key, func)
+
+    with ThreadPoolExecutor(n) as pool:
+        futures = [pool.submit(call) for _ in range(n)]
+    return futures
+
+
+def test_concurrent_calls_share_one_execution(app):
+    flight = app.SingleFlight()
+    calls = []
+    gate = threading.Event()
+
+    def slow():
+        calls.append(1)
+        gate.wait(5)
+        return "result"
+
+    threading.Timer(0.2, gate.set).start()
+    futures = run_concurrently(flight, "k", slow, 4)
+
+    assert [f.result() for f in futures] == ["result"] * 4
+    assert len(calls) == 1
+    assert flight.stats() == {'leader': 1, 'shared': 3, 'in_flight': 0}
+
+
+def test_exception_is_shared_and_key_released(app):
+    flight = app.SingleFlight()
+    gate = threading.Event()
+
+    def failing():
+        gate.wait(5)
+        raise ConnectionError("upstream down")
+
+    threading.Timer(0.2, gate.set).start()
+    futures = run_concurrently(flight, "k", failing, 3)
+
+    for future in futures:
+        with pytest.raises(ConnectionError):
+            future.result()
+    # 失败后键已释放，下一次调用重新执行
+    assert flight.do("k", lambda: "retry") == "retry"
+
+
+def test_find_returns_in_flight_call(app):
+    flight = app.SingleFlight()
+    gate = threading.Event()
+    with ThreadPoolExecutor(1) as pool:
+        pending = pool.submit(flight.do, ("hist", "600000"), lambda: gate.wait(5) and "wide")
+        while flight.find(lambda k: k[1] == "600000") is None:
+            time.sleep(0.01)
+        in_flight = flight.find(lambda k: k[1] == "600000")
+        gate.set()
+
+    assert in_flight.result() == pending.result() == "wide"
+    assert flight.find(lambda k: True) is None
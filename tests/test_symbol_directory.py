@@ -0,0 +1,51 @@
+"""证券代码目录：代码、简称与拼音首字母的前缀检索"""
+import pandas as pd
+import pytest
+
+
+@pytest.fixture
+def directory(app):
+    frame = pd.DataFrame({
+        'code': ['600519', '000858', '600036', '600000', '000001', '60051'],
+        'name': ['贵州茅台', '五 粮 液', '招商银行', '浦发银行', '平安银行', '短代码'],
+    })
+    return app.SymbolDirectory(frame)
+
+
+def test_code_prefix(directory):
+    assert [code for code, _ in directory.search("6000")] == ['600000', '600036']
+
+
+def test_codes_are_zero_padded(directory):
+    assert directory.search("600519") == [('600519', '贵州茅台')]
+    assert directory.search("06005") == [('060051', '短代码')]
+
+
+def test_name_prefix_ignores_spaces(directory):
+    assert directory.search("五粮") == [('000858', '五粮液')]
+    assert directory.name('000858') == '五粮液'
+
+
+def test_pinyin_initials(app, directory):
+    assert app.name_initials("贵州茅台") == "gzmt"
+    assert directory.search("GZ") == [('600519', '贵州茅台')]
+    assert {code for code, _ in directory.search("pa")} == {'000001'}
+
+
+def test_prefix_only_and_limit(directory):
+    # 只按前缀匹配，简称中间的字不参与检索
+    assert directory.search("银行") == []
+    assert len(directory.search("6", limit=2)) == 2
+    assert '600036' in directory and '999999' not in directory
+    assert directory.search("  ") == []
+
+
+def test_service_reads_local_cache(app, tmp_path, monkeypatch):
+    path = tmp_path / "symbols.parquet"
+    pd.DataFrame({'code': ['600519'], 'name': ['贵州茅台']}).to_parquet(path, index=False)
+    monkeypatch.setattr(app.SymbolDirectoryService, "_run", lambda self: None)
+
+    service = app.SymbolDirectoryService(str(path), ttl=3600)
+
+    assert '600519' in service.directory
+    assert service.stats()['symbols'] == 1
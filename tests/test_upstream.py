@@ -0,0 +1,85 @@
+"""上游请求层：只重试临时故障，限速排队不计入超时"""
+import concurrent.futures
+import threading
+import time
+import types
+import urllib.error
+
+import pytest
+import requests
+
+
+@pytest.fixture
+def upstream(app, monkeypatch):
+    monkeypatch.setattr(app, "UPSTREAM_BACKOFF_BASE", 0.001)
+    return app.AsyncUpstream(max_workers=4)
+
+
+def failing(exc, calls):
+    def func():
+        calls.append(1)
+        raise exc
+    return func
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status}", response=response)
+
+
+@pytest.mark.parametrize("exc", [ValueError("无此代码"), KeyError("date"),
+                                 urllib.error.HTTPError("url", 404, "Not Found", None, None),
+                                 http_error(403), FileNotFoundError("replay/600000.csv"),
+                                 PermissionError("denied")])
+def test_invalid_responses_are_not_retried(app, upstream, exc):
+    calls = []
+    with pytest.raises(app.UpstreamRejectedError):
+        upstream.run("hist", failing(exc, calls))
+
+    assert len(calls) == 1
+    assert upstream.breaker("hist").failures == 0
+
+
+@pytest.mark.parametrize("exc", [ConnectionError("reset"), TimeoutError("slow"),
+                                 urllib.error.HTTPError("url", 502, "Bad Gateway", None, None),
+                                 urllib.error.URLError("Name or service not known"), http_error(503),
+                                 requests.ConnectionError("reset"), requests.ReadTimeout("slow")])
+def test_transient_errors_are_retried(app, upstream, exc):
+    calls = []
+    with pytest.raises(app.UpstreamError) as info:
+        upstream.run("hist", failing(exc, calls))
+
+    assert not isinstance(info.value, app.UpstreamRejectedError)
+    assert len(calls) == app.UPSTREAM_ATTEMPTS
+    assert upstream.breaker("hist").failures == app.UPSTREAM_ATTEMPTS
+
+
+def test_rate_limit_wait_does_not_count_toward_timeout(app, upstream, monkeypatch):
+    monkeypatch.setitem(app.UPSTREAM_TIMEOUTS, "hist", 0.3)
+    limiter = app.RateLimiter(4, burst=1)
+
+    # 4 个并发请求按每秒 4 个放行，最后一个排队约 0.75 秒，远超 0.3 秒的超时
+    start = time.monotonic()
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: upstream.run("hist", lambda: time.sleep(0.1) or "ok",
+                                                         limiter=limiter), range(4)))
+
+    assert results == ["ok"] * 4
+    assert upstream.counters['timeouts'] == 0
+    assert time.monotonic() - start >= 0.75
+
+
+def test_submit_restores_thread_context(app, monkeypatch):
+    upstream = app.AsyncUpstream(max_workers=1)
+    attr = app.SCRIPT_RUN_CONTEXT_ATTR_NAME
+    session = types.SimpleNamespace(pages_manager=types.SimpleNamespace(main_script_hash="main"))
+    monkeypatch.setattr(app, "get_script_run_ctx", lambda: session)
+    seen = upstream.submit(lambda: getattr(threading.current_thread(), attr, None)).result()
+    monkeypatch.setattr(app, "get_script_run_ctx", lambda: None)
+
+    # 复用同一线程的下一个任务 (不在会话中提交) 不应继承上一个会话
+    leftover = upstream.submit(lambda: getattr(threading.current_thread(), attr, None)).result()
+
+    assert seen is session
+    assert leftover is None
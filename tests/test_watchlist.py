@@ -0,0 +1,32 @@
+"""自选股并发获取：单只股票的任何异常只让该行失败"""
+import datetime
+
+from conftest import synthetic_bars
+
+D = datetime.date
+
+
+def test_unexpected_error_marks_only_that_symbol(app, monkeypatch):
+    def hist(symbol, start, end, adjust):
+        if symbol == "000002":
+            raise KeyError("上游返回的列名变化")
+        return synthetic_bars(symbol, start, end)
+
+    def info(symbol):
+        if symbol == "000001":
+            raise RuntimeError("解析失败")
+        return None
+
+    monkeypatch.setattr(app, "get_hist_data", hist)
+    monkeypatch.setattr(app, "get_base_info", info)
+    progress = []
+
+    hist_map, info_map = app.fetch_watchlist(["600000", "000001", "000002"], D(2024, 3, 1),
+                                             D(2024, 3, 29), "qfq", on_progress=progress.append)
+
+    assert hist_map["000002"] is None
+    assert len(hist_map["600000"]) == len(hist_map["000001"]) > 0
+    assert info_map == {"600000": None, "000001": None, "000002": None}
+    assert progress[-1] == 1.0
+    summary = app.build_watchlist_summary(hist_map, info_map)
+    assert sorted(summary['代码']) == ["000001", "600000"]